@@ -0,0 +1,271 @@
+import json
+import multiprocessing
+import os
+import string
+import sys
+import time
+import tempfile
+import tracemalloc
+import cleanup
+import collection_snapshot
+import extraction
+import models
+import porter
+import retrieval_benchmark
+import scoring
+import shared_index
+
+RAW_DATA_PATH = "raw_data"
+DATA_PATH = "data"
+COLLECTION_PATH = os.path.join(DATA_PATH, "my_collection.json")
+STOPWORD_FILE_PATH = os.path.join(DATA_PATH, "stopwords.json")
+
+
+def best_of(function, repeat=5) -> float:
+    """
+    Runs a function several times and returns the fastest run time in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _legacy_filter_collection(collection, stop_word_list: list[str]):
+    # The original implementation: list membership test and a new translation table for every term.
+    for document in collection:
+        cleaned_term_list = []
+        for term in document.terms:
+            term = term.lower().replace("'s", "")
+            cleaned_term_list.append(term.translate(str.maketrans('', '', string.punctuation)))
+        document.filtered_terms = [term for term in cleaned_term_list if term not in stop_word_list]
+
+
+def benchmark_stop_word_filtering(collection, stop_word_list: list[str], repeat=5) -> dict:
+    """
+    Compares the throughput of the original stop word filtering with cleanup.filter_collection() and with the fused
+    pass of cleanup.TextNormalizer.tokenize() over the raw texts.
+    :return: Dictionary with the best run times (seconds) and throughputs (tokens per second)
+    """
+    num_tokens = sum(len(document.terms) for document in collection)
+    legacy = best_of(lambda: _legacy_filter_collection(collection, stop_word_list), repeat)
+    compiled = best_of(lambda: cleanup.filter_collection(collection, stop_word_list), repeat)
+    normalizer = cleanup.TextNormalizer(stop_word_list)
+    fused = best_of(lambda: [normalizer.tokenize(document.raw_text) for document in collection], repeat)
+    return {
+        'tokens': num_tokens,
+        'legacy_seconds': legacy,
+        'compiled_seconds': compiled,
+        'fused_seconds': fused,
+        'legacy_tokens_per_second': num_tokens / legacy if legacy else 0.0,
+        'compiled_tokens_per_second': num_tokens / compiled if compiled else 0.0,
+        'fused_tokens_per_second': num_tokens / fused if fused else 0.0,
+        'speedup': legacy / compiled if compiled else 0.0,
+    }
+
+
+class _LegacyDocument(object):
+    # The original document: a plain object with one list of str objects per representation.
+    def __init__(self, values: dict):
+        self.document_id = values['document_id']
+        self.title = values['title']
+        self.raw_text = values['raw_text']
+        self.terms = values['terms']
+        self.filtered_terms = values['filtered_terms']
+        self.stemmed_terms = values['stemmed_terms']
+
+
+def _allocated_bytes(function) -> int:
+    """
+    Returns the memory allocated by function() that is still reachable through its return value.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+
+def benchmark_document_memory(collection) -> dict:
+    """
+    Compares the memory of the collection as legacy documents (string lists loaded from JSON) and as compact
+    documents (term id arrays into the shared vocabulary). Raw texts are loaded in both cases.
+    :return: Dictionary with the number of tokens and the bytes per token of both representations
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "collection.json")
+        snapshot_path = os.path.join(directory, "collection.bin")
+        extraction.save_collection_as_json(collection, json_path)
+        collection_snapshot.write_collection_snapshot(collection, snapshot_path)
+
+        def load_legacy():
+            with open(json_path, "r") as f:
+                return [_LegacyDocument(values) for values in json.load(f)]
+
+        def load_compact():
+            documents = collection_snapshot.load_collection_snapshot(snapshot_path)
+            for document in documents:
+                document.raw_text
+            return documents
+
+        collection_snapshot.load_collection_snapshot(snapshot_path)  # the shared vocabulary is not counted
+        legacy = _allocated_bytes(load_legacy)
+        compact = _allocated_bytes(load_compact)
+
+    num_tokens = sum(
+        len(document.term_ids) + len(document.filtered_term_ids) + len(document.stemmed_term_ids)
+        for document in collection
+    )
+    return {
+        'tokens': num_tokens,
+        'legacy_bytes_per_token': legacy / num_tokens if num_tokens else 0.0,
+        'compact_bytes_per_token': compact / num_tokens if num_tokens else 0.0,
+        'reduction': legacy / compact if compact else 0.0,
+    }
+
+
+def benchmark_collection_formats(collection, repeat=5) -> dict:
+    """
+    Compares the JSON collection file with the binary snapshot: file size, load time, and load time including the
+    raw texts (which the snapshot loads lazily).
+    :return: Dictionary with the file sizes (bytes) and best load times (seconds) of both formats
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "collection.json")
+        snapshot_path = os.path.join(directory, "collection.bin")
+        extraction.save_collection_as_json(collection, json_path)
+        collection_snapshot.write_collection_snapshot(collection, snapshot_path)
+
+        def load_snapshot_with_texts():
+            for document in collection_snapshot.load_collection_snapshot(snapshot_path):
+                document.raw_text
+
+        return {
+            'documents': len(collection),
+            'json_bytes': os.path.getsize(json_path),
+            'snapshot_bytes': os.path.getsize(snapshot_path),
+            'json_load_seconds': best_of(lambda: extraction.load_collection_from_json(json_path), repeat),
+            'snapshot_load_seconds': best_of(lambda: collection_snapshot.load_collection_snapshot(snapshot_path),
+                                             repeat),
+            'snapshot_load_with_texts_seconds': best_of(load_snapshot_with_texts, repeat),
+        }
+
+
+def _private_bytes() -> int:
+    """
+    Memory of this process that is not shared with other processes (Private_Clean + Private_Dirty), Linux only.
+    """
+    total = 0
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def _shared_index_worker(load_model, workload: list[str], connection):
+    start = _private_bytes()
+    model = load_model()
+    for query in workload:
+        model.top_k(query, 10)
+    connection.send(_private_bytes() - start)
+    connection.close()
+
+
+def benchmark_shared_index(collection, workers=(1, 2, 4), scale=16) -> dict:
+    """
+    Measures how much private memory forked worker processes need to answer BM25 queries when every worker builds
+    its own index, when all workers use a dict-based index built before forking (shared copy-on-write until reference
+    counting touches its objects) and when they map one flat index in shared memory. Linux only.
+    :param scale: Number of copies of the collection, so the index is larger than the per-process noise
+    :return: Dictionary with the index size and, per variant, a list of (workers, mean private bytes per worker)
+    """
+    documents = retrieval_benchmark.scale_collection(collection, scale)
+    model = models.VectorSpaceModel(scoring.BM25Scorer())
+    model.build_inverted_index(documents)
+    terms = sorted(model.statistics.postings)[::7]
+    workload = [f"{a} {b}" for a, b in zip(terms, reversed(terms))]
+    data = shared_index.build_flat_index(model.statistics, model.scorer)
+    block = shared_index.publish_flat_index(data)
+
+    def build_own():
+        own_model = models.VectorSpaceModel(scoring.BM25Scorer())
+        own_model.build_inverted_index(documents)
+        return own_model
+
+    variants = {
+        'build': build_own,
+        'fork': lambda: model,
+        'flat': lambda: shared_index.FlatVectorSpaceModel(shared_index.attach_flat_index(block.name)),
+    }
+    context = multiprocessing.get_context("fork")
+    results = {'index_bytes': len(data)}
+    try:
+        for name, load_model in variants.items():
+            results[name] = []
+            for num_workers in workers:
+                connections = []
+                processes = []
+                for _ in range(num_workers):
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=_shared_index_worker, args=(load_model, workload, sender))
+                    process.start()
+                    connections.append(receiver)
+                    processes.append(process)
+                private = [connection.recv() for connection in connections]
+                for process in processes:
+                    process.join()
+                results[name].append((num_workers, sum(private) / num_workers))
+    finally:
+        block.close()
+        block.unlink()
+    return results
+
+
+def main():
+    collection = extraction.extract_collection(os.path.join(RAW_DATA_PATH, "aesopa10.txt"))
+    with open(STOPWORD_FILE_PATH, "r") as f:
+        stop_word_list = json.load(f)
+
+    print("Stop word filtering:")
+    result = benchmark_stop_word_filtering(collection, stop_word_list)
+    print(f"  {result['tokens']} tokens")
+    print(f"  legacy:   {result['legacy_seconds'] * 1000:.2f} ms ({result['legacy_tokens_per_second']:.0f} tokens/s)")
+    print(f"  compiled: {result['compiled_seconds'] * 1000:.2f} ms ({result['compiled_tokens_per_second']:.0f} tokens/s)")
+    print(f"  fused:    {result['fused_seconds'] * 1000:.2f} ms ({result['fused_tokens_per_second']:.0f} tokens/s)")
+    print(f"  speedup:  {result['speedup']:.1f}x")
+
+    cleanup.filter_collection(collection, stop_word_list)
+    for document in collection:
+        document.stemmed_terms = [porter.stem_term(term) for term in document.filtered_terms]
+    print("Collection file formats:")
+    result = benchmark_collection_formats(collection)
+    print(f"  {result['documents']} documents")
+    print(f"  JSON:     {result['json_bytes']} bytes, load {result['json_load_seconds'] * 1000:.2f} ms")
+    print(f"  snapshot: {result['snapshot_bytes']} bytes, load {result['snapshot_load_seconds'] * 1000:.2f} ms "
+          f"({result['snapshot_load_with_texts_seconds'] * 1000:.2f} ms with raw texts)")
+
+    print("Document memory:")
+    result = benchmark_document_memory(collection)
+    print(f"  {result['tokens']} tokens in all representations")
+    print(f"  legacy:  {result['legacy_bytes_per_token']:.1f} bytes/token")
+    print(f"  compact: {result['compact_bytes_per_token']:.1f} bytes/token")
+    print(f"  reduction: {result['reduction']:.1f}x")
+
+    if sys.platform.startswith("linux"):
+        print("Worker memory (BM25, private memory per worker):")
+        result = benchmark_shared_index(collection)
+        print(f"  flat index: {result['index_bytes'] / 1024:.0f} KiB")
+        for name in ("build", "fork", "flat"):
+            print(f"  {name:6}" + "".join(f"  {workers} workers: {private / 1024:7.0f} KiB"
+                                          for workers, private in result[name]))
+
+
+if __name__ == "__main__":
+    main()
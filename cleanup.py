@@ -1,7 +1,12 @@
-from document import Document
+from array import array
+from document import Document, TERM_ID_TYPE, vocabulary
+import functools
 import string
 from collections import Counter
 
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+_MISSING = object()
+
 def remove_symbols(text_string: str) -> str:
     """
     Removes all punctuation marks and similar symbols from a given string.
@@ -11,13 +16,13 @@ def remove_symbols(text_string: str) -> str:
     """
     text_string = text_string.lower()
     text_string = text_string.replace("'s", "")
-    text_string = text_string.translate(str.maketrans('', '', string.punctuation))
+    text_string = text_string.translate(_PUNCTUATION_TABLE)
     return text_string
 
-def is_stop_word(term: str, stop_word_list: list[str]) -> bool:
+def is_stop_word(term: str, stop_word_list) -> bool:
     """
     Checks if a given term is a stop word.
-    :param stop_word_list: List of all considered stop words.
+    :param stop_word_list: List (or, much faster, set) of all considered stop words.
     :param term: The term to be checked.
     :return: True if the term is a stop word.
     """
@@ -30,9 +35,93 @@ def remove_stop_words_from_term_list(term_list: list[str], stop_word_list: list[
     :param stop_word_list: List of stop words.
     :return: List of terms without stop words
     """
-    cleaned_term_list = [remove_symbols(term) for term in term_list]
-    filtered_terms = [term for term in cleaned_term_list if not is_stop_word(term, stop_word_list)]
-    return filtered_terms
+    return _cached_normalizer(frozenset(stop_word_list)).filter_terms(term_list)
+
+@functools.lru_cache(maxsize=8)
+def _cached_normalizer(stop_words: frozenset) -> 'TextNormalizer':
+    return TextNormalizer(stop_words)
+
+class TextNormalizer(object):
+    """
+    Compiled form of remove_symbols() and the stop word check. The stop words are kept in a frozenset and the
+    normalized form of every distinct term is computed only once, so filtering costs one dictionary lookup per token.
+    Create one normalizer per stop word list and reuse it for the whole collection.
+    The caches of normalized terms are cleared whenever they reach max_size entries, which keeps the memory of a
+    long-running process bounded while the lookup of a cached term stays a plain dictionary access.
+    """
+
+    def __init__(self, stop_word_list: list[str], max_size=100000):
+        self.stop_words = frozenset(stop_word_list)
+        self.max_size = max_size
+        self._normalized = {}  # term -> normalized term, or None for stop words
+        self._normalized_ids = {}  # term id -> id of the normalized term, or None for stop words
+
+    def normalize(self, term: str):
+        """
+        Returns the term after remove_symbols(), or None if the result is a stop word.
+        """
+        try:
+            return self._normalized[term]
+        except KeyError:
+            normalized = remove_symbols(term)
+            if normalized in self.stop_words:
+                normalized = None
+            if len(self._normalized) >= self.max_size:
+                self._normalized.clear()
+            self._normalized[term] = normalized
+            return normalized
+
+    def filter_terms(self, term_list: list[str]) -> list[str]:
+        """
+        Same result as remove_stop_words_from_term_list().
+        """
+        normalized_terms = self._normalized
+        normalize = self.normalize
+        filtered_terms = []
+        for term in term_list:
+            normalized = normalized_terms.get(term, _MISSING)
+            if normalized is _MISSING:
+                normalized = normalize(term)
+            if normalized is not None:
+                filtered_terms.append(normalized)
+        return filtered_terms
+
+    def tokenize(self, text: str) -> list[str]:
+        """
+        Tokenizes, normalizes and filters a raw text in one pass over its tokens: every whitespace-separated token is
+        looked up in the cache of normalized terms, so remove_symbols() runs once per distinct token instead of over
+        the whole text. Same result as filter_terms(remove_symbols(text).split()).
+        :return: Terms of the text without symbols and stop words
+        """
+        normalized_terms = self._normalized
+        normalize = self.normalize
+        terms = []
+        for token in text.split():
+            normalized = normalized_terms.get(token, _MISSING)
+            if normalized is _MISSING:
+                normalized = normalize(token)
+            if normalized:  # None for stop words, empty for tokens that consist of symbols only
+                terms.append(normalized)
+        return terms
+
+    def filter_term_ids(self, term_ids) -> array:
+        """
+        Same as filter_terms() on term ids of the shared vocabulary. Every distinct term id is mapped only once.
+        """
+        normalized_ids = self._normalized_ids
+        filtered_ids = array(TERM_ID_TYPE)
+        for term_id in term_ids:
+            try:
+                normalized_id = normalized_ids[term_id]
+            except KeyError:
+                normalized = self.normalize(vocabulary.terms[term_id])
+                normalized_id = vocabulary.id(normalized) if normalized is not None else None
+                if len(normalized_ids) >= self.max_size:
+                    normalized_ids.clear()
+                normalized_ids[term_id] = normalized_id
+            if normalized_id is not None:
+                filtered_ids.append(normalized_id)
+        return filtered_ids
 
 def filter_collection(collection: list[Document], stop_word_list: list[str]):
     """
@@ -40,10 +129,22 @@ def filter_collection(collection: list[Document], stop_word_list: list[str]):
     Warning: The result is NOT saved in the documents term list, but in an extra field called filtered_terms.
     :param collection: Document collection to process
     """
+    normalizer = TextNormalizer(stop_word_list)
     for document in collection:
-        document.filtered_terms = remove_stop_words_from_term_list(document.terms, stop_word_list)
+        document.filtered_term_ids = normalizer.filter_term_ids(document.term_ids)
     return collection
 
+def iter_filter_collection(documents, stop_word_list: list[str]):
+    """
+    Lazy variant of filter_collection(): filters the stop words of each document as it is consumed.
+    :param documents: Iterable of Document objects, e.g. extraction.iter_collection()
+    :return: Generator of the processed documents
+    """
+    normalizer = TextNormalizer(stop_word_list)
+    for document in documents:
+        document.filtered_term_ids = normalizer.filter_term_ids(document.term_ids)
+        yield document
+
 def load_stop_word_list(raw_file_path: str) -> list[str]:
     """
     Loads a text file that contains stop words and saves it as a list. The text file is expected to be formatted so that
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from document import Document, TERM_ID_TYPE, vocabulary as shared_vocabulary
+
+# File layout (all integers little endian):
+#   header      magic, version, number of documents, number of terms, offset and length of the vocabulary,
+#               offset of the raw texts, digest of the stop word list the filtered representations were computed with
+#               (UNKNOWN_STOP_WORDS if not recorded)
+#   documents   per document: a fixed-size record, the utf-8 title and the terms, filtered terms, stemmed terms and
+#               stemmed filtered terms as arrays of uint32 term ids; derived representations that were not computed
+#               have the length NOT_COMPUTED and no data
+#   vocabulary  all distinct terms (utf-8) separated by NUL bytes, a term's id is its position
+#   raw texts   the utf-8 raw text of every document, read only when a document's raw_text is accessed
+MAGIC = b'IRCS'
+VERSION = 3
+NOT_COMPUTED = 0xFFFFFFFF
+UNKNOWN_STOP_WORDS = 0
+
+_HEADER = struct.Struct('<4sHIIQQQQ')
+_DOCUMENT = struct.Struct('<qIIIIIQI')  # id, title length, number of terms, filtered terms, stemmed terms,
+                                        # stemmed filtered terms, raw text offset (relative to the raw texts),
+                                        # raw text length
+_TERM_ID_SIZE = array(TERM_ID_TYPE).itemsize
+_REPRESENTATIONS = ('term_ids', 'filtered_term_ids', 'stemmed_term_ids', 'filtered_stemmed_term_ids')
+_FILTERED_REPRESENTATIONS = ('filtered_term_ids', 'filtered_stemmed_term_ids')
+_SWAP_BYTES = sys.byteorder != 'little'
+
+
+class SnapshotDocument(Document):
+    """
+    Document loaded from a snapshot. The raw text stays in the file until raw_text is read for the first time.
+    """
+
+    __slots__ = ('_raw_text', '_raw_text_location')
+
+    def __init__(self, file_path: str, raw_text_offset: int, raw_text_length: int):
+        super().__init__()
+        self._raw_text = None
+        self._raw_text_location = (file_path, raw_text_offset, raw_text_length)
+
+    @property
+    def raw_text(self) -> str:
+        if self._raw_text is None:
+            file_path, offset, length = self._raw_text_location
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                self._raw_text = f.read(length).decode('utf-8')
+        return self._raw_text
+
+    @raw_text.setter
+    def raw_text(self, value: str):
+        self._raw_text = value
+
+
+def stop_word_digest(stop_word_list) -> int:
+    """
+    Order independent 64 bit digest of a stop word list, never UNKNOWN_STOP_WORDS.
+    """
+    data = '\n'.join(sorted(set(stop_word_list))).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little') or 1
+
+
+def write_collection_snapshot(collection: list[Document], file_path: str, stop_word_list=None):
+    """
+    Writes a collection to a binary snapshot file. The file is written to a temporary file first and renamed, so an
+    existing snapshot is replaced atomically.
+    :param collection: The collection to store (= a list of Document objects)
+    :param file_path: Path of the snapshot file
+    :param stop_word_list: Stop word list the filtered representations were computed with, recorded so they can be
+                           recognized as stale after the list changed; None if unknown
+    """
+    vocabulary = {}  # shared vocabulary id -> snapshot id
+    records = []
+    texts = []
+    text_offset = 0
+    for document in collection:
+        title = document.title.encode('utf-8')
+        raw_text = document.raw_text.encode('utf-8')
+        term_ids = [
+            array(TERM_ID_TYPE, [vocabulary.setdefault(term_id, len(vocabulary)) for term_id in shared_ids])
+            if shared_ids is not None else None
+            for shared_ids in (getattr(document, name) for name in _REPRESENTATIONS)
+        ]
+        if _SWAP_BYTES:
+            for ids in term_ids:
+                if ids is not None:
+                    ids.byteswap()
+        lengths = [len(ids) if ids is not None else NOT_COMPUTED for ids in term_ids]
+        record = _DOCUMENT.pack(document.document_id, len(title), *lengths, text_offset, len(raw_text))
+        records.append(record + title + b''.join(ids.tobytes() for ids in term_ids if ids is not None))
+        texts.append(raw_text)
+        text_offset += len(raw_text)
+
+    encoded_vocabulary = '\0'.join(shared_vocabulary.decode(vocabulary)).encode('utf-8')
+    vocabulary_offset = _HEADER.size + sum(len(record) for record in records)
+    header = _HEADER.pack(MAGIC, VERSION, len(records), len(vocabulary), vocabulary_offset, len(encoded_vocabulary),
+                          vocabulary_offset + len(encoded_vocabulary),
+                          stop_word_digest(stop_word_list) if stop_word_list is not None else UNKNOWN_STOP_WORDS)
+
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(header)
+        file.writelines(records)
+        file.write(encoded_vocabulary)
+        file.writelines(texts)
+    os.replace(temp_path, file_path)
+
+
+def load_collection_snapshot(file_path: str, stop_word_list=None) -> list[Document]:
+    """
+    Loads a collection written by write_collection_snapshot(). The term ids of the file are translated to ids of the
+    shared vocabulary without creating any per-token strings; raw texts are loaded lazily.
+    :param file_path: Path of the snapshot file
+    :param stop_word_list: Current stop word list. Filtered representations that were computed with a different or
+                           unrecorded list are not loaded, they are derived again when needed. None: load them all.
+    :return: List of Document objects
+    :raises ValueError: if the file is not a collection snapshot
+    """
+    with open(file_path, 'rb') as file:
+        header = file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f'{file_path} is not a collection snapshot')
+        magic, version, num_documents, num_terms, vocabulary_offset, vocabulary_length, text_offset, digest = \
+            _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{file_path} is not a collection snapshot')
+        data = file.read(text_offset - _HEADER.size)
+    stale = stop_word_list is not None and digest != stop_word_digest(stop_word_list)
+
+    vocabulary_start = vocabulary_offset - _HEADER.size
+    vocabulary = data[vocabulary_start:vocabulary_start + vocabulary_length].decode('utf-8').split('\0')
+    shared_ids = shared_vocabulary.encode(vocabulary if num_terms else [])  # snapshot id -> shared vocabulary id
+
+    collection = []
+    position = 0
+    for _ in range(num_documents):
+        document_id, title_length, *lengths, raw_text_offset, raw_text_length = _DOCUMENT.unpack_from(data, position)
+        position += _DOCUMENT.size
+        document = SnapshotDocument(file_path, text_offset + raw_text_offset, raw_text_length)
+        document.document_id = document_id
+        document.title = data[position:position + title_length].decode('utf-8')
+        position += title_length
+        for name, length in zip(_REPRESENTATIONS, lengths):
+            if length == NOT_COMPUTED:
+                setattr(document, name, None)
+                continue
+            if stale and name in _FILTERED_REPRESENTATIONS:
+                setattr(document, name, None)
+                position += length * _TERM_ID_SIZE
+                continue
+            term_ids = array(TERM_ID_TYPE)
+            term_ids.frombytes(data[position:position + length * _TERM_ID_SIZE])
+            position += length * _TERM_ID_SIZE
+            if _SWAP_BYTES:
+                term_ids.byteswap()
+            setattr(document, name, array(TERM_ID_TYPE, map(shared_ids.__getitem__, term_ids)))
+        collection.append(document)
+    return collection
@@ -0,0 +1,58 @@
+from document import Document
+
+
+class CollectionStore(object):
+    """
+    Owns the documents of a collection. Besides the document order it keeps a lookup table from document id to the
+    document's dense ordinal (= its position in the collection), so documents can be fetched by id in constant time.
+    Iteration, len() and positional indexing behave like the list the collection used to be.
+    """
+
+    def __init__(self, documents=None):
+        self._documents = []
+        self._ordinals = {}
+        for document in documents if documents is not None else []:
+            self.append(document)
+
+    def append(self, document: Document):
+        if document.document_id in self._ordinals:
+            raise ValueError(f'Duplicate document id {document.document_id}')
+        self._ordinals[document.document_id] = len(self._documents)
+        self._documents.append(document)
+
+    def get(self, doc_id, default=None):
+        """
+        Returns the document with the given id or default if there is none.
+        """
+        ordinal = self._ordinals.get(doc_id)
+        return self._documents[ordinal] if ordinal is not None else default
+
+    def ordinal(self, doc_id) -> int:
+        """
+        Returns the dense ordinal (0..len-1) of the document with the given id.
+        :raises KeyError: if there is no such document
+        """
+        return self._ordinals[doc_id]
+
+    def get_many(self, doc_ids) -> list[Document]:
+        """
+        Returns the documents for the given ids in the given order. Unknown ids are skipped.
+        """
+        ordinals = self._ordinals
+        documents = self._documents
+        return [documents[ordinals[doc_id]] for doc_id in doc_ids if doc_id in ordinals]
+
+    def document_ids(self) -> list:
+        return [document.document_id for document in self._documents]
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._ordinals
+
+    def __getitem__(self, ordinal):
+        return self._documents[ordinal]
+
+    def __iter__(self):
+        return iter(self._documents)
+
+    def __len__(self) -> int:
+        return len(self._documents)
@@ -1,15 +1,116 @@
 # Contains a unified class definition for a document.
+import threading
+from array import array
+
+TERM_ID_TYPE = 'I'  # unsigned 32 bit term ids
+
+
+class Vocabulary(object):
+    """
+    Term dictionary shared by all documents of a process. Every distinct term is stored once and identified by its
+    position; documents only hold arrays of term ids.
+    """
+
+    def __init__(self):
+        self.ids = {}  # term -> id
+        self.terms = []  # id -> term
+        self._lock = threading.Lock()
+
+    def id(self, term: str) -> int:
+        term_id = self.ids.get(term)
+        if term_id is None:
+            with self._lock:  # two threads adding the same new term must get the same id
+                term_id = self.ids.get(term)
+                if term_id is None:
+                    self.terms.append(term)
+                    term_id = self.ids[term] = len(self.terms) - 1
+        return term_id
+
+    def encode(self, terms) -> array:
+        return array(TERM_ID_TYPE, map(self.id, terms))
+
+    def decode(self, term_ids) -> list[str]:
+        return list(map(self.terms.__getitem__, term_ids))
+
+    def decode_optional(self, term_ids):
+        return self.decode(term_ids) if term_ids is not None else None
+
+    def encode_optional(self, terms):
+        return self.encode(terms) if terms is not None else None
+
+    def __len__(self):
+        return len(self.terms)
+
+
+vocabulary = Vocabulary()
+
+_DERIVED_REPRESENTATIONS = ('filtered_term_ids', 'stemmed_term_ids', 'filtered_stemmed_term_ids')
+
 
 class Document(object):
+    """
+    The term lists are stored as arrays of ids into the shared vocabulary (4 bytes per token instead of a reference to
+    a separate str object). terms, filtered_terms and stemmed_terms decode them into new lists on every access and
+    encode assigned lists; code that only needs ids should use the *_ids attributes directly.
+    The derived representations are None until they are computed, see representation.RepresentationPipeline; their
+    list properties return an empty list in that case.
+    """
+
+    __slots__ = ('document_id', 'title', 'raw_text', 'term_ids', 'filtered_term_ids', 'stemmed_term_ids',
+                 'filtered_stemmed_term_ids')
+
     def __init__(self):
         self.document_id = None  # Unique document ID
         self.title = ''  # Title of document
         self.raw_text = ''  # Holds complete text of document.
-        self.terms = []  # Holds all terms.
-        self.filtered_terms = []  # Holds terms without stopwords.
-        self.stemmed_terms = []  # Holds terms that were stemmed with Porter algorithm. (Only relevant in PR03!)
+        self.term_ids = array(TERM_ID_TYPE)  # Holds all terms.
+        self.filtered_term_ids = None  # Holds terms without stopwords.
+        self.stemmed_term_ids = None  # Holds terms that were stemmed with Porter algorithm. (Only relevant in PR03!)
+        self.filtered_stemmed_term_ids = None  # Holds the stems of the terms without stopwords.
         # Note: See PR02 task description for instructions regarding these properties.
 
+    @property
+    def terms(self) -> list[str]:
+        return vocabulary.decode(self.term_ids)
+
+    @terms.setter
+    def terms(self, terms: list[str]):
+        self.term_ids = vocabulary.encode(terms)
+
+    @property
+    def filtered_terms(self) -> list[str]:
+        return vocabulary.decode(self.filtered_term_ids or ())
+
+    @filtered_terms.setter
+    def filtered_terms(self, terms: list[str]):
+        self.filtered_term_ids = vocabulary.encode(terms)
+
+    @property
+    def stemmed_terms(self) -> list[str]:
+        return vocabulary.decode(self.stemmed_term_ids or ())
+
+    @stemmed_terms.setter
+    def stemmed_terms(self, terms: list[str]):
+        self.stemmed_term_ids = vocabulary.encode(terms)
+
+    @property
+    def filtered_stemmed_terms(self) -> list[str]:
+        return vocabulary.decode(self.filtered_stemmed_term_ids or ())
+
+    @filtered_stemmed_terms.setter
+    def filtered_stemmed_terms(self, terms: list[str]):
+        self.filtered_stemmed_term_ids = vocabulary.encode(terms)
+
+    def __getstate__(self):
+        # Term ids are only valid within one process, so documents are pickled with their terms.
+        return (self.document_id, self.title, self.raw_text, vocabulary.decode(self.term_ids),
+                *(vocabulary.decode_optional(getattr(self, name)) for name in _DERIVED_REPRESENTATIONS))
+
+    def __setstate__(self, state):
+        self.document_id, self.title, self.raw_text, terms, *derived = state
+        self.term_ids = vocabulary.encode(terms)
+        for name, terms in zip(_DERIVED_REPRESENTATIONS, derived):
+            setattr(self, name, vocabulary.encode_optional(terms))
 
     def __str__(self):
         shortened_content = self.raw_text[:10] + "..." if len(self.raw_text) > 10 else self.raw_text
@@ -0,0 +1,210 @@
+import argparse
+import math
+import os
+from result_cache import normalize_query
+
+try:
+    import numpy as np
+except ImportError:  # optional, the metrics fall back to plain Python
+    np = None
+
+RAW_DATA_PATH = "raw_data"
+GROUND_TRUTH_PATH = os.path.join(RAW_DATA_PATH, "ground_truth.txt")
+METRICS = ('precision', 'recall', 'average_precision', 'ndcg', 'reciprocal_rank')
+
+
+def _judgment_key(query: str) -> str:
+    return normalize_query(query).lower()
+
+
+class GroundTruth(object):
+    """
+    Relevance judgments, parsed once: every query of the ground truth file maps to the set of its relevant document
+    ids. Queries are matched case-insensitively and independent of whitespace.
+    """
+
+    def __init__(self, judgments: dict = None):
+        self.judgments = {_judgment_key(query): frozenset(ids) for query, ids in (judgments or {}).items()}
+
+    @staticmethod
+    def load(file_path: str = GROUND_TRUTH_PATH) -> 'GroundTruth':
+        """
+        Parses a ground truth file with lines "query - id, id, ...". Empty lines and comments (#) are skipped.
+        :raises FileNotFoundError: if the file does not exist
+        """
+        judgments = {}
+        with open(file_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "-" not in line:
+                    continue
+                query, _, ids = line.rpartition("-")
+                judgments[query] = [int(doc_id) for doc_id in ids.split(",") if doc_id.strip()]
+        return GroundTruth(judgments)
+
+    def relevant(self, query: str):
+        """
+        :return: Set of relevant document ids, or None if the query was not judged
+        """
+        return self.judgments.get(_judgment_key(query))
+
+    def queries(self) -> list[str]:
+        return list(self.judgments)
+
+    def __contains__(self, query: str) -> bool:
+        return _judgment_key(query) in self.judgments
+
+    def __len__(self):
+        return len(self.judgments)
+
+
+def relevance_matrix(rankings: list[list], relevant_sets: list, depth: int) -> list[list[int]]:
+    """
+    Binary relevance of the first depth results of every ranking, padded with zeros.
+    """
+    return [
+        [1 if doc_id in relevant else 0 for doc_id in ranking[:depth]] + [0] * (depth - len(ranking[:depth]))
+        for ranking, relevant in zip(rankings, relevant_sets)
+    ]
+
+
+def _metrics_numpy(matrix: list[list[int]], num_relevant: list[int], num_retrieved: list[int], k: int) -> dict:
+    relevance = np.asarray(matrix, dtype=np.float64).reshape(len(matrix), k)
+    num_relevant = np.asarray(num_relevant, dtype=np.float64)
+    num_retrieved = np.asarray(num_retrieved, dtype=np.float64)
+    ranks = np.arange(1, k + 1, dtype=np.float64)
+    hits = relevance.sum(axis=1)
+    safe_relevant = np.maximum(num_relevant, 1)
+
+    discounts = 1 / np.log2(ranks + 1)
+    ideal = np.cumsum(discounts)[np.minimum(num_relevant, k).astype(np.int64) - 1]
+    first_hit = np.argmax(relevance > 0, axis=1)
+    return {
+        'precision': np.where(num_retrieved > 0, hits / np.maximum(num_retrieved, 1), 0.0),
+        'recall': np.where(num_relevant > 0, hits / safe_relevant, 0.0),
+        'average_precision': (np.cumsum(relevance, axis=1) / ranks * relevance).sum(axis=1) / safe_relevant,
+        'ndcg': np.where(num_relevant > 0, (relevance * discounts).sum(axis=1) / np.where(num_relevant > 0, ideal, 1),
+                         0.0),
+        'reciprocal_rank': np.where(hits > 0, 1 / (first_hit + 1), 0.0),
+    }
+
+
+def _metrics_python(matrix: list[list[int]], num_relevant: list[int], num_retrieved: list[int], k: int) -> dict:
+    discounts = [1 / math.log2(rank + 1) for rank in range(1, k + 1)]
+    metrics = {name: [] for name in METRICS}
+    for row, relevant, retrieved in zip(matrix, num_relevant, num_retrieved):
+        hits = sum(row)
+        precision_sum = 0.0
+        found = 0
+        for rank, relevance in enumerate(row, 1):
+            if relevance:
+                found += 1
+                precision_sum += found / rank
+        ideal = sum(discounts[:min(relevant, k)])
+        metrics['precision'].append(hits / retrieved if retrieved else 0.0)
+        metrics['recall'].append(hits / relevant if relevant else 0.0)
+        metrics['average_precision'].append(precision_sum / relevant if relevant else 0.0)
+        metrics['ndcg'].append(sum(d for d, relevance in zip(discounts, row) if relevance) / ideal if ideal else 0.0)
+        metrics['reciprocal_rank'].append(1 / (row.index(1) + 1) if hits else 0.0)
+    return metrics
+
+
+def evaluate_rankings(rankings: list[list], relevant_sets: list, k: int) -> dict:
+    """
+    Computes the metrics of many queries at once on a binary relevance matrix. Precision is precision@k (divided by
+    the number of retrieved documents if fewer than k were returned), recall, average precision and nDCG are cut off
+    at k, reciprocal rank is 0 if no relevant document is among the first k.
+    :param rankings: Per query: document ids in rank order
+    :param relevant_sets: Per query: set of relevant document ids
+    :param k: Cut-off rank
+    :return: Dictionary with the per-query values of each metric (lists) and their means under 'mean_<metric>'
+    """
+    matrix = relevance_matrix(rankings, relevant_sets, k)
+    num_relevant = [len(relevant) for relevant in relevant_sets]
+    num_retrieved = [min(len(ranking), k) for ranking in rankings]
+    if not matrix:
+        metrics = {name: [] for name in METRICS}
+    elif np is not None:
+        metrics = {name: values.tolist() for name, values in _metrics_numpy(matrix, num_relevant, num_retrieved,
+                                                                              k).items()}
+    else:
+        metrics = _metrics_python(matrix, num_relevant, num_retrieved, k)
+    for name in METRICS:
+        values = metrics[name]
+        metrics['mean_' + name] = sum(values) / len(values) if values else 0.0
+    return metrics
+
+
+def evaluate(search, ground_truth: GroundTruth, k=10, queries: list[str] = None) -> dict:
+    """
+    Runs a query set through a search function and evaluates the rankings.
+    :param search: Function query -> document ids in rank order
+    :param ground_truth: Relevance judgments
+    :param k: Cut-off rank
+    :param queries: Queries to run, default: all judged queries
+    :return: Result of evaluate_rankings() with the queries under 'queries'
+    """
+    queries = queries if queries is not None else ground_truth.queries()
+    rankings = [list(search(query)) for query in queries]
+    metrics = evaluate_rankings(rankings, [ground_truth.relevant(query) or frozenset() for query in queries], k)
+    metrics['queries'] = queries
+    return metrics
+
+
+def evaluate_system(system, model_selectors: dict, ground_truth: GroundTruth, k=10, search_modes=None) -> list[dict]:
+    """
+    Regression sweep: evaluates every model in every search mode of an InformationRetrievalSystem. The results of the
+    Boolean models are unranked and evaluated in the order the system returns them. Models whose optional dependencies
+    are missing (ImportError on selection) are skipped.
+    :param system: ir_system.InformationRetrievalSystem
+    :param model_selectors: Model name -> function system -> None that selects the model
+    :param search_modes: (stop word filtering, stemming) tuples, default: all four
+    :return: One dictionary per model and search mode with the mean metrics
+    """
+    search_modes = search_modes or ((False, False), (True, False), (False, True), (True, True))
+    output_k = system.output_k
+    system.output_k = k
+    results = []
+    try:
+        for name, select in model_selectors.items():
+            try:
+                select(system)
+            except ImportError:
+                continue
+            for stop_word_filtering, stemming in search_modes:
+                metrics = evaluate(
+                    lambda query: [document.document_id
+                                   for _, document in system.search(query, stemming, stop_word_filtering)],
+                    ground_truth, k,
+                )
+                result = {'model': name, 'stopword_filtering': stop_word_filtering, 'stemming': stemming}
+                result.update({key: value for key, value in metrics.items() if key.startswith('mean_')})
+                results.append(result)
+    finally:
+        system.output_k = output_k
+    return results
+
+
+def main():
+    import ir_system  # imports this module
+
+    selectors = ir_system.MODEL_SELECTORS
+    parser = argparse.ArgumentParser(description="Evaluates all models in all search modes on the ground truth.")
+    parser.add_argument("--models", nargs="+", choices=list(selectors), default=list(selectors))
+    parser.add_argument("-k", type=int, default=10, help="cut-off rank of the metrics")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH, help="ground truth file")
+    args = parser.parse_args()
+
+    ground_truth = GroundTruth.load(args.ground_truth)
+    system = ir_system.InformationRetrievalSystem()
+    selected = {name: selectors[name] for name in args.models}
+    print(f"{len(ground_truth)} queries, k = {args.k}")
+    print(f"{'model':10} {'sw':>3} {'stem':>4}  {'P@k':>5} {'recall':>6} {'MAP':>5} {'nDCG':>5} {'MRR':>5}")
+    for result in evaluate_system(system, selected, ground_truth, args.k):
+        print(f"{result['model']:10} {'y' if result['stopword_filtering'] else 'n':>3} "
+              f"{'y' if result['stemming'] else 'n':>4}  {result['mean_precision']:5.2f} {result['mean_recall']:6.2f} "
+              f"{result['mean_average_precision']:5.2f} {result['mean_ndcg']:5.2f} {result['mean_reciprocal_rank']:5.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,83 @@
 import json
 import re
-from document import Document
+from collections import deque
+from document import Document, vocabulary
 from cleanup import remove_symbols
+import instrumentation
 
-def extract_collection(source_file_path: str) -> list[Document]:
+_TITLE_PATTERN = re.compile(r'(?:\s?)[a-zA-Z]{1}\n')
+
+def iter_split_collection(source_file_path: str):
     """
-    Loads a text file (aesopa10.txt) and extracts each of the listed fables/stories from the file.
-    :param source_file_name: File name of the file that contains the fables
-    :return: List of Document objects
+    Streams a text file (aesopa10.txt) and yields the lines of each of the listed fables/stories as soon as the start
+    of the next fable (or the end of the file) is reached. Only the current fable and a window of six lines are kept
+    in memory. A fable starts with a title line that is preceded by three and followed by two empty lines.
+    :param source_file_path: File name of the file that contains the fables
+    :return: Generator of (document id, lines of the fable) tuples
     """
-    catalog = [] 
+    window = deque(maxlen=6)
+    fable = None
+    document_id = 0
 
     with open(source_file_path, 'r') as file:
-        content = file.readlines()
-
-    
-    totalLines = len(content)
-    lines_fableStart = []
-    for i in range(0, totalLines-1):
-    
-        if(content[i] == '\n' and content[i+1] == '\n' and content[i+2] == '\n'):
-
-            if(content[i+4] == '\n' and content[i+5] == '\n'):
-
-                if(re.search('(?:\s?)[a-zA-Z]{1}\n', content[i+3])):
-
-                    lines_fableStart.append(i+3)
-        else:
-            continue
-
-
-    for i,fable in enumerate(lines_fableStart):
-        if(i == len(lines_fableStart)-1):
-           fable = content[lines_fableStart[i]:]
-        else:
-            fable = content[lines_fableStart[i]:lines_fableStart[i+1]]
-
-        fable_title = fable[0].strip()
-        fable_content = ' '.join(fable[3:]).replace('\n', ' ').strip()
-        fable_content = remove_symbols(fable_content)
-        fable_terms =  fable_content.split()  # simple tokenization, adjust as needed
-        document = Document()
-        document.document_id = i
-        document.title = fable_title
-        document.raw_text = fable_content
-        document.terms = fable_terms
-        catalog.append(document)
-
+        for line in file:
+            window.append(line)
+            if fable is not None:
+                fable.append(line)
+
+            if (len(window) == 6 and window[0] == '\n' and window[1] == '\n' and window[2] == '\n'
+                    and window[4] == '\n' and window[5] == '\n' and _TITLE_PATTERN.search(window[3])):
+                if fable is not None:
+                    yield document_id, fable[:-3]
+                    document_id += 1
+                fable = [window[3], window[4], window[5]]
+
+    if fable is not None:
+        yield document_id, fable
+
+def split_collection(source_file_path: str) -> list[tuple[int, list[str]]]:
+    """
+    Loads a text file (aesopa10.txt) and splits it into the lines of each of the listed fables/stories.
+    :param source_file_path: File name of the file that contains the fables
+    :return: List of (document id, lines of the fable) tuples
+    """
+    return list(iter_split_collection(source_file_path))
 
+def create_document(document_id: int, fable: list[str]) -> Document:
+    """
+    Creates a Document from the lines of one fable as returned by split_collection().
+    :param document_id: ID of the new document
+    :param fable: Lines of the fable, starting with the title line
+    :return: Document object
+    """
+    fable_title = fable[0].strip()
+    fable_content = ' '.join(fable[3:]).replace('\n', ' ').strip()
+    fable_content = remove_symbols(fable_content)
+    fable_terms =  fable_content.split()  # simple tokenization, adjust as needed
+    document = Document()
+    document.document_id = document_id
+    document.title = fable_title
+    document.raw_text = fable_content
+    document.terms = fable_terms
+    return document
+
+def iter_collection(source_file_path: str):
+    """
+    Streams a text file (aesopa10.txt) and yields the extracted fables/stories one at a time.
+    :param source_file_path: File name of the file that contains the fables
+    :return: Generator of Document objects
+    """
+    for i, fable in iter_split_collection(source_file_path):
+        yield create_document(i, fable)
 
-    return catalog
+@instrumentation.timed('extraction')
+def extract_collection(source_file_path: str) -> list[Document]:
+    """
+    Loads a text file (aesopa10.txt) and extracts each of the listed fables/stories from the file.
+    :param source_file_name: File name of the file that contains the fables
+    :return: List of Document objects
+    """
+    return list(iter_collection(source_file_path))
 
 def save_collection_as_json(collection: list[Document], file_path: str) -> None:
     """
@@ -65,8 +93,8 @@ def save_collection_as_json(collection: list[Document], file_path: str) -> None:
             'title': document.title,
             'raw_text': document.raw_text,
             'terms': document.terms,
-            'filtered_terms': document.filtered_terms,
-            'stemmed_terms': document.stemmed_terms
+            'filtered_terms': vocabulary.decode_optional(document.filtered_term_ids),  # None: not computed
+            'stemmed_terms': vocabulary.decode_optional(document.stemmed_term_ids)
         }]
 
     with open(file_path, "w") as json_file:
@@ -89,8 +117,10 @@ def load_collection_from_json(file_path: str) -> list[Document]:
             document.title = doc_dict.get('title')
             document.raw_text = doc_dict.get('raw_text')
             document.terms = doc_dict.get('terms')
-            document.filtered_terms = doc_dict.get('filtered_terms')
-            document.stemmed_terms = doc_dict.get('stemmed_terms')
+            # Older files stored an empty list for representations that were never computed, so a missing, null or
+            # empty value is loaded as "not computed" and derived again when it is needed.
+            document.filtered_term_ids = vocabulary.encode_optional(doc_dict.get('filtered_terms') or None)
+            document.stemmed_term_ids = vocabulary.encode_optional(doc_dict.get('stemmed_terms') or None)
             collection += [document]
 
         return collection
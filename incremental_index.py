@@ -0,0 +1,219 @@
+import math
+import threading
+from collections import defaultdict
+from document import Document
+from models import VectorSpaceModel
+import topk
+
+
+class Segment(object):
+    """
+    Part of an IncrementalVectorSpaceModel. Postings store the raw term frequency, so a segment never has to be
+    rewritten when the idf of a term changes.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(list)  # term -> [(doc_id, tf)] in insertion order
+        self.max_tf = defaultdict(int)  # term -> highest tf in this segment (stays a valid bound after deletes)
+        self.document_terms = {}  # doc_id -> {term: tf}
+        self.deleted = 0  # number of documents of this segment that were deleted or updated since
+
+    def add(self, doc_id, term_count: dict):
+        self.document_terms[doc_id] = term_count
+        for term, tf in term_count.items():
+            self.postings[term].append((doc_id, tf))
+            if tf > self.max_tf[term]:
+                self.max_tf[term] = tf
+
+    def discard(self, doc_id):
+        """
+        Removes a document and its postings. Only used for the buffer segment, which is still small and mutable;
+        sealed segments keep the postings of dead documents until they are merged.
+        """
+        for term in self.document_terms.pop(doc_id):
+            postings = [posting for posting in self.postings[term] if posting[0] != doc_id]
+            if postings:
+                self.postings[term] = postings
+            else:
+                del self.postings[term]
+
+    def __len__(self):
+        return len(self.document_terms)
+
+
+class IncrementalVectorSpaceModel(VectorSpaceModel):
+    """
+    Vector Space Model that supports adding, removing and updating single documents without a rebuild.
+
+    New documents go into a small in-memory buffer segment. Full buffers are sealed and kept as immutable segments,
+    a deleted or updated document simply stops being the live version of its id (a tombstone), and its postings
+    are dropped when segments are merged. Document frequencies are maintained on every change and idf values are
+    computed at query time, so ingesting documents costs time proportional to the new documents, not to the
+    collection. Scores are the same tf-idf dot products VectorSpaceModel ranks by.
+    """
+
+    def __init__(self, buffer_size=64, max_segments=8):
+        super().__init__()
+        self.buffer_size = buffer_size
+        self.max_segments = max_segments
+        self.segments = []  # sealed segments, oldest first
+        self.buffer = Segment()
+        self.document_frequency = defaultdict(int)
+        self._live = {}  # doc_id -> segment that holds the live version of the document
+        self.stopword_filtering = False  # search mode of the indexed representations
+        self.stemming = False
+        self._lock = threading.RLock()
+        self._merge_requested = threading.Event()
+        self._merge_thread = None
+        self._stopping = False
+
+    def build_inverted_index(self, documents: list[Document], stopword_filtering=False, stemming=False):
+        with self._lock:
+            self.segments = []
+            self.buffer = Segment()
+            self.document_frequency = defaultdict(int)
+            self._live = {}
+            self.stopword_filtering = stopword_filtering
+            self.stemming = stemming
+            for document in documents:
+                self.add_document(document)
+            self.flush()
+            self.merge_segments()
+
+    def add_document(self, document: Document):
+        """
+        Adds a document in the search mode the index was built for. If a document with the same id exists, it is
+        replaced.
+        """
+        term_count = defaultdict(int)
+        for term in self.document_to_representation(document, self.stopword_filtering, self.stemming):
+            term_count[term] += 1
+        with self._lock:
+            self.remove_document(document.document_id)
+            self.buffer.add(document.document_id, term_count)
+            self._live[document.document_id] = self.buffer
+            for term in term_count:
+                self.document_frequency[term] += 1
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+
+    def update_document(self, document: Document):
+        self.add_document(document)
+
+    def remove_document(self, doc_id) -> bool:
+        """
+        Deletes a document. A document in the buffer is removed right away, one in a sealed segment is marked as dead
+        and its postings are removed by the next merge.
+        :return: True if the document existed
+        """
+        with self._lock:
+            segment = self._live.pop(doc_id, None)
+            if segment is None:
+                return False
+            for term in segment.document_terms[doc_id]:
+                self.document_frequency[term] -= 1
+                if not self.document_frequency[term]:
+                    del self.document_frequency[term]
+            if segment is self.buffer:
+                # A replaced buffered document would otherwise leave its old postings next to the new ones.
+                segment.discard(doc_id)
+            else:
+                segment.deleted += 1
+            return True
+
+    def flush(self):
+        """
+        Seals the buffer segment. Requests a background merge if there are too many segments.
+        """
+        with self._lock:
+            if not len(self.buffer):
+                return
+            self.segments.append(self.buffer)
+            self.buffer = Segment()
+            if len(self.segments) > self.max_segments:
+                self._merge_requested.set()
+
+    def merge_segments(self):
+        """
+        Merges all sealed segments into one and drops the postings of deleted documents. The merged segment is built
+        from a snapshot and swapped in afterwards, so queries and updates only wait for the swap.
+        """
+        with self._lock:
+            sources = list(self.segments)
+        if len(sources) <= 1 and not any(segment.deleted for segment in sources):
+            return
+
+        merged = Segment()
+        for segment in sources:
+            for doc_id, term_count in segment.document_terms.items():
+                if self._live.get(doc_id) is segment:
+                    merged.add(doc_id, term_count)
+
+        with self._lock:
+            # Documents deleted or updated while the merge was running are dead in the merged segment as well.
+            for doc_id in merged.document_terms:
+                if self._live.get(doc_id) in sources:
+                    self._live[doc_id] = merged
+                else:
+                    merged.deleted += 1
+            self.segments = [merged] + [segment for segment in self.segments if segment not in sources]
+
+    def start_background_merging(self):
+        if self._merge_thread is not None:
+            return
+        self._stopping = False
+        self._merge_thread = threading.Thread(target=self._merge_loop, daemon=True)
+        self._merge_thread.start()
+
+    def stop_background_merging(self):
+        if self._merge_thread is None:
+            return
+        self._stopping = True
+        self._merge_requested.set()
+        self._merge_thread.join()
+        self._merge_thread = None
+
+    def _merge_loop(self):
+        while True:
+            self._merge_requested.wait()
+            self._merge_requested.clear()
+            if self._stopping:
+                return
+            self.merge_segments()
+
+    def idf(self, term: str) -> float:
+        document_frequency = self.document_frequency.get(term, 0)
+        return math.log10(len(self._live) / document_frequency) if document_frequency else 0.0
+
+    def live_postings(self, term: str) -> list[tuple]:
+        """
+        Returns the (doc_id, tf) postings of all live documents containing the term, sorted by doc_id.
+        """
+        with self._lock:
+            postings = [
+                posting
+                for segment in self.segments + [self.buffer]
+                for posting in segment.postings.get(term, ())
+                if self._live.get(posting[0]) is segment
+            ]
+        postings.sort(key=lambda posting: posting[0])
+        return postings
+
+    def top_k(self, query: str, k: int, stats: dict = None) -> list[tuple]:
+        with self._lock:
+            cursors = []
+            for term, weight in self.query_to_vector(query).items():
+                postings = self.live_postings(term)
+                if postings:
+                    max_tf = max(segment.max_tf.get(term, 0) for segment in self.segments + [self.buffer])
+                    cursors.append(topk.TfIdfCursor(postings, weight, self.idf(term), max_tf))
+        return topk.maxscore_top_k(cursors, k, stats)
+
+    def is_built(self) -> bool:
+        return bool(self._live)
+
+    def __len__(self):
+        return len(self._live)
+
+    def __str__(self):
+        return 'Vector Space Model (Incremental)'
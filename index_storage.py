@@ -0,0 +1,255 @@
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+# File layout (all integers little endian):
+#   header      magic, version, flags, number of terms, number of documents, offset of the term table
+#   postings    per term: sorted document ids as variable-byte encoded gaps, with FLAG_FREQUENCIES each gap is
+#               followed by the term frequency
+#   term blob   all terms (utf-8) concatenated in sorted order
+#   term table  one fixed-size entry per term, sorted by term, so lookups can binary search inside the mmap
+MAGIC = b'IRIX'
+VERSION = 1
+FLAG_STOPWORD_FILTERING = 1
+FLAG_STEMMING = 2
+FLAG_FREQUENCIES = 4
+
+_HEADER = struct.Struct('<4sHHIIQ')
+_TERM_ENTRY = struct.Struct('<QIQII')  # term offset, term length, postings offset, postings length, document frequency
+
+
+def encode_vbyte(numbers) -> bytes:
+    """
+    Encodes a sequence of non-negative integers with variable-byte encoding. Each integer is split into 7 bit groups,
+    the high bit of the last byte of a number is set to mark its end.
+    :param numbers: Iterable of non-negative integers
+    :return: Encoded bytes
+    """
+    encoded = bytearray()
+    for number in numbers:
+        while number >= 128:
+            encoded.append(number & 127)
+            number >>= 7
+        encoded.append(number | 128)
+    return bytes(encoded)
+
+
+def decode_vbyte(data) -> list[int]:
+    """
+    Decodes a byte sequence created by encode_vbyte().
+    :param data: bytes, bytearray or memoryview
+    :return: List of the decoded integers
+    """
+    numbers = []
+    number = 0
+    shift = 0
+    for byte in data:
+        if byte & 128:
+            numbers.append(number | ((byte & 127) << shift))
+            number = 0
+            shift = 0
+        else:
+            number |= byte << shift
+            shift += 7
+    return numbers
+
+
+def encode_postings(doc_ids) -> bytes:
+    """
+    Sorts the given document ids and encodes them as variable-byte compressed gaps (d-gaps).
+    :param doc_ids: Iterable of non-negative document ids
+    :return: Encoded posting list
+    """
+    gaps = []
+    previous = 0
+    for doc_id in sorted(doc_ids):
+        gaps.append(doc_id - previous)
+        previous = doc_id
+    return encode_vbyte(gaps)
+
+
+def decode_postings(data) -> list[int]:
+    """
+    Decodes a posting list created by encode_postings().
+    :param data: Encoded posting list
+    :return: Sorted list of document ids
+    """
+    doc_ids = decode_vbyte(data)
+    for i in range(1, len(doc_ids)):
+        doc_ids[i] += doc_ids[i - 1]
+    return doc_ids
+
+
+def encode_postings_with_frequencies(postings) -> bytes:
+    """
+    Sorts the given (doc_id, tf) postings by document id and encodes them as variable-byte compressed pairs of
+    d-gap and term frequency.
+    :param postings: Iterable of (doc_id, tf) tuples
+    :return: Encoded posting list
+    """
+    numbers = []
+    previous = 0
+    for doc_id, tf in sorted(postings):
+        numbers.append(doc_id - previous)
+        numbers.append(tf)
+        previous = doc_id
+    return encode_vbyte(numbers)
+
+
+def decode_postings_with_frequencies(data) -> list[tuple[int, int]]:
+    """
+    Decodes a posting list created by encode_postings_with_frequencies().
+    :param data: Encoded posting list
+    :return: List of (doc_id, tf) tuples sorted by document id
+    """
+    numbers = decode_vbyte(data)
+    postings = []
+    doc_id = 0
+    for i in range(0, len(numbers), 2):
+        doc_id += numbers[i]
+        postings.append((doc_id, numbers[i + 1]))
+    return postings
+
+
+def write_inverted_index(inverted_index: dict, file_path: str, num_documents=0,
+                         stopword_filtering=False, stemming=False, frequencies=False) -> None:
+    """
+    Writes an inverted index (term -> iterable of document ids) to a compressed index file. The file is written to a
+    temporary path first and renamed afterwards, so readers never see a half written index.
+    :param inverted_index: Dictionary that maps terms to document ids, or to (doc_id, tf) tuples if frequencies is set
+    :param file_path: Path of the index file
+    :param num_documents: Number of documents the index was built from
+    :param stopword_filtering: Whether the index was built from terms without stop words
+    :param stemming: Whether the index was built from stemmed terms
+    :param frequencies: Whether the postings carry term frequencies
+    """
+    terms = sorted(inverted_index)
+    flags = (FLAG_STOPWORD_FILTERING if stopword_filtering else 0) | (FLAG_STEMMING if stemming else 0)
+    flags |= FLAG_FREQUENCIES if frequencies else 0
+    encode = encode_postings_with_frequencies if frequencies else encode_postings
+
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(b'\0' * _HEADER.size)
+
+        entries = []
+        offset = _HEADER.size
+        for term in terms:
+            doc_ids = inverted_index[term]
+            postings = encode(doc_ids)
+            file.write(postings)
+            entries.append([0, 0, offset, len(postings), len(doc_ids)])
+            offset += len(postings)
+
+        for entry, term in zip(entries, terms):
+            encoded_term = term.encode('utf-8')
+            file.write(encoded_term)
+            entry[0] = offset
+            entry[1] = len(encoded_term)
+            offset += len(encoded_term)
+
+        table_offset = offset
+        for entry in entries:
+            file.write(_TERM_ENTRY.pack(*entry))
+
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, VERSION, flags, len(terms), num_documents, table_offset))
+    os.replace(temp_path, file_path)
+
+
+class DiskInvertedIndex(Mapping):
+    """
+    Read-only view of an index file written by write_inverted_index(). The file is memory mapped; only the term table
+    entries touched by the binary search and the posting lists of the requested terms are read, so the resident
+    memory depends on the queries and not on the size of the collection.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._file.close()
+            raise ValueError(f'{file_path} is not an inverted index file')
+        if len(self._mmap) < _HEADER.size:  # truncated
+            self.close()
+            raise ValueError(f'{file_path} is not an inverted index file')
+
+        magic, version, flags, num_terms, num_documents, table_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{file_path} is not an inverted index file')
+        self.num_terms = num_terms
+        self.num_documents = num_documents
+        self.stopword_filtering = bool(flags & FLAG_STOPWORD_FILTERING)
+        self.stemming = bool(flags & FLAG_STEMMING)
+        self.frequencies = bool(flags & FLAG_FREQUENCIES)
+        self._table_offset = table_offset
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _entry(self, position: int) -> tuple:
+        return _TERM_ENTRY.unpack_from(self._mmap, self._table_offset + position * _TERM_ENTRY.size)
+
+    def _term_at(self, entry: tuple) -> bytes:
+        return self._mmap[entry[0]:entry[0] + entry[1]]
+
+    def _find(self, term: str):
+        key = term.encode('utf-8')
+        low, high = 0, self.num_terms
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            middle_term = self._term_at(entry)
+            if middle_term < key:
+                low = middle + 1
+            elif middle_term > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def document_frequency(self, term: str) -> int:
+        entry = self._find(term) if isinstance(term, str) else None
+        return entry[4] if entry is not None else 0
+
+    def __getitem__(self, term: str) -> list[int]:
+        entry = self._find(term) if isinstance(term, str) else None
+        if entry is None:
+            raise KeyError(term)
+        data = self._mmap[entry[2]:entry[2] + entry[3]]
+        if self.frequencies:
+            return [doc_id for doc_id, _ in decode_postings_with_frequencies(data)]
+        return decode_postings(data)
+
+    def postings_with_frequencies(self, term: str) -> list[tuple[int, int]]:
+        """
+        Returns the (doc_id, tf) postings of a term, or an empty list if the term is not indexed.
+        Only available for files written with frequencies=True.
+        """
+        if not self.frequencies:
+            raise ValueError(f'{self.file_path} was written without term frequencies')
+        entry = self._find(term) if isinstance(term, str) else None
+        if entry is None:
+            return []
+        return decode_postings_with_frequencies(self._mmap[entry[2]:entry[2] + entry[3]])
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self._find(term) is not None
+
+    def __iter__(self):
+        for position in range(self.num_terms):
+            yield self._term_at(self._entry(position)).decode('utf-8')
+
+    def __len__(self) -> int:
+        return self.num_terms
@@ -0,0 +1,328 @@
+import cProfile
+import functools
+import heapq
+import io
+import itertools
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+# Stages of the pipeline, in the order they are reported
+STAGES = ('extraction', 'cleanup', 'stemming', 'index_build', 'query_parse', 'posting_fetch', 'scoring',
+          'materialization')
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    """
+    Measures the exclusive time of a stage: the time of timers nested inside it is attributed to their own stages,
+    so the stage times of a query add up to its total time.
+    """
+
+    __slots__ = ('recorder', 'stage', 'start', 'children')
+
+    def __init__(self, recorder: 'Recorder', stage: str):
+        self.recorder = recorder
+        self.stage = stage
+        self.children = 0.0
+
+    def __enter__(self):
+        self.recorder._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.recorder._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.recorder._record_time(self.stage, elapsed - self.children)
+        return False
+
+
+class Recorder(object):
+    """
+    Collects stage timings and counters. Disabled by default: timer() then returns a shared no-op object and count()
+    returns immediately, so instrumented code pays one attribute check per call.
+    Hooks are called for every event with (kind, name, value): ('timer', stage, seconds), ('counter', name, amount)
+    and ('query', query, record) at the end of every query() block. Hooks run in the thread that produced the event.
+    Timings of worker processes are recorded in those processes and are not merged into this recorder.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_queries = False
+        self.trace_memory = False
+        self.max_slow_queries = 10
+        self.hooks = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def enable(self, profile_queries=False, trace_memory=False, max_slow_queries=10):
+        """
+        :param profile_queries: Run every query under cProfile and keep the profile of the slowest ones
+        :param trace_memory: Record the peak traced memory of every query with tracemalloc. The peak is process
+                             wide, so it is only accurate when queries do not run concurrently.
+        :param max_slow_queries: Number of slowest queries whose records are kept
+        """
+        self.profile_queries = profile_queries
+        self.trace_memory = trace_memory
+        self.max_slow_queries = max_slow_queries
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        with self._lock:
+            self.stage_seconds = defaultdict(float)
+            self.stage_calls = defaultdict(int)
+            self.counters = defaultdict(int)
+            self.queries = 0
+            self.query_seconds = 0.0
+            self._slow_queries = []  # min-heap of (seconds, sequence number, record)
+            self._sequence = itertools.count()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += 1
+        record = getattr(self._local, 'query', None)
+        if record is not None:
+            record['stages'][stage] = record['stages'].get(stage, 0.0) + seconds
+        for hook in self.hooks:
+            hook('timer', stage, seconds)
+
+    def timer(self, stage: str):
+        """
+        Context manager that times a stage.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def timed(self, stage: str):
+        """
+        Decorator that times every call of a function as a stage.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Timer(self, stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += amount
+        record = getattr(self._local, 'query', None)
+        if record is not None:
+            record['counters'][name] = record['counters'].get(name, 0) + amount
+        for hook in self.hooks:
+            hook('counter', name, amount)
+
+    def query(self, query: str):
+        """
+        Context manager around the execution of one query. Collects the stage times and counters of the query and,
+        if enabled, its cProfile profile and peak memory. Nested query() blocks belong to the outermost one.
+        """
+        if not self.enabled or getattr(self._local, 'query', None) is not None:
+            return _NULL_TIMER
+        return _QueryCapture(self, query)
+
+    def _finish_query(self, record: dict):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += record['seconds']
+            entry = (record['seconds'], next(self._sequence), record)
+            if len(self._slow_queries) < self.max_slow_queries:
+                heapq.heappush(self._slow_queries, entry)
+            elif entry > self._slow_queries[0]:
+                heapq.heapreplace(self._slow_queries, entry)
+        for hook in self.hooks:
+            hook('query', record['query'], record)
+
+    def slow_queries(self) -> list[dict]:
+        """
+        :return: Records of the slowest queries, slowest first
+        """
+        with self._lock:
+            return [record for _, _, record in sorted(self._slow_queries, reverse=True)]
+
+    def summary(self) -> dict:
+        with self._lock:
+            total = sum(self.stage_seconds.values())
+            stages = {
+                stage: {
+                    'calls': self.stage_calls[stage],
+                    'seconds': self.stage_seconds[stage],
+                    'mean_ms': self.stage_seconds[stage] / self.stage_calls[stage] * 1000,
+                    'share': self.stage_seconds[stage] / total if total else 0.0,
+                }
+                for stage in sorted(self.stage_seconds, key=_stage_order)
+            }
+            summary = {
+                'stages': stages,
+                'counters': dict(self.counters),
+                'queries': self.queries,
+                'mean_query_ms': self.query_seconds / self.queries * 1000 if self.queries else 0.0,
+            }
+        summary['slow_queries'] = self.slow_queries()
+        return summary
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [f"{'stage':16} {'calls':>8} {'total ms':>10} {'mean ms':>9} {'share':>6}"]
+        for stage, values in summary['stages'].items():
+            lines.append(f"{stage:16} {values['calls']:8} {values['seconds'] * 1000:10.2f} "
+                         f"{values['mean_ms']:9.3f} {values['share']:6.1%}")
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"{name}: {value}")
+        if summary['queries']:
+            lines.append(f"{summary['queries']} queries, {summary['mean_query_ms']:.3f} ms on average")
+        for i, record in enumerate(summary['slow_queries']):
+            stages = ", ".join(f"{stage} {seconds * 1000:.2f} ms"
+                               for stage, seconds in sorted(record['stages'].items(), key=lambda item: -item[1]))
+            lines.append(f"slow query {record['query']!r}: {record['seconds'] * 1000:.2f} ms ({stages})")
+            if 'peak_memory_bytes' in record:
+                lines.append(f"  peak memory {record['peak_memory_bytes'] / 1024:.1f} KiB")
+            if 'profile' in record and i == 0:  # the profiles of the others are in dump()
+                lines.extend("  " + line for line in record['profile'].splitlines() if line.strip())
+        return "\n".join(lines)
+
+    def dump(self, file_path: str):
+        """
+        Writes summary() to a JSON file.
+        """
+        with open(file_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def _stage_order(stage: str):
+    return (STAGES.index(stage), '') if stage in STAGES else (len(STAGES), stage)
+
+
+class _QueryCapture(object):
+    def __init__(self, recorder: Recorder, query: str):
+        self.recorder = recorder
+        self.record = {'query': query, 'seconds': 0.0, 'stages': {}, 'counters': {}}
+        self.profile = None
+
+    def __enter__(self):
+        recorder = self.recorder
+        recorder._local.query = self.record
+        if recorder.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        if recorder.profile_queries:
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:  # another profiler is active in this thread
+                self.profile = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record['seconds'] = time.perf_counter() - self.start
+        recorder = self.recorder
+        if self.profile is not None:
+            self.profile.disable()
+            output = io.StringIO()
+            pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(15)
+            self.record['profile'] = output.getvalue()
+        if recorder.trace_memory and tracemalloc.is_tracing():
+            self.record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - self.memory_start
+        recorder._local.query = None
+        recorder._finish_query(self.record)
+        return False
+
+
+recorder = Recorder()  # process-wide recorder used by the instrumented modules
+
+enable = recorder.enable
+disable = recorder.disable
+reset = recorder.reset
+add_hook = recorder.add_hook
+remove_hook = recorder.remove_hook
+timer = recorder.timer
+timed = recorder.timed
+count = recorder.count
+query = recorder.query
+summary = recorder.summary
+format_summary = recorder.format_summary
+dump = recorder.dump
+
+
+def add_arguments(parser):
+    """
+    Adds the instrumentation options to an argparse parser of a command line tool.
+    """
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--instrument", action="store_true", help="time the pipeline stages and print a summary")
+    group.add_argument("--profile-queries", action="store_true",
+                       help="profile every query with cProfile and report the slowest ones (implies --instrument)")
+    group.add_argument("--trace-memory", action="store_true",
+                       help="record the peak memory of every query with tracemalloc (implies --instrument)")
+    group.add_argument("--instrumentation-output", metavar="FILE",
+                       help="write the summary as JSON to this file (implies --instrument)")
+
+
+def enable_from_arguments(args) -> bool:
+    """
+    Enables the recorder if any of the options of add_arguments() was given.
+    :return: True if instrumentation is enabled
+    """
+    if args.instrument or args.profile_queries or args.trace_memory or args.instrumentation_output:
+        enable(profile_queries=args.profile_queries, trace_memory=args.trace_memory)
+    return recorder.enabled
+
+
+def report(args):
+    """
+    Prints the summary to stderr and writes it to --instrumentation-output, if instrumentation is enabled.
+    """
+    if not recorder.enabled:
+        return
+    print(format_summary(), file=sys.stderr)
+    if args.instrumentation_output:
+        dump(args.instrumentation_output)
@@ -1,17 +1,36 @@
+import argparse
+import contextlib
+import copy
 import json
 import os
+import sys
 import time
 import cleanup
+import collection_snapshot
+from collection_store import CollectionStore
+import evaluation
 import extraction
+import instrumentation
 import models
+import pipeline
 import porter
+import query_parser
+import representation
+from postings_cache import CachedInvertedIndex
+from result_cache import QueryResultCache
+import scoring
+import sparse_vsm
 from document import Document
 
 
 RAW_DATA_PATH = "raw_data"
 DATA_PATH = "data"
 COLLECTION_PATH = os.path.join(DATA_PATH, "my_collection.json")
+SNAPSHOT_PATH = os.path.join(DATA_PATH, "my_collection.bin")
 STOPWORD_FILE_PATH = os.path.join(DATA_PATH, "stopwords.json")
+INVERTED_INDEX_PATH = os.path.join(DATA_PATH, "inverted_index.bin")
+SEARCH_MODES = ((False, False), (True, False), (False, True), (True, True))  # (stop word filtering, stemming)
+POSTINGS_CACHE_BYTES = 8 * 1024 * 1024
 
 (
     CHOICE_LIST,
@@ -20,32 +39,80 @@ STOPWORD_FILE_PATH = os.path.join(DATA_PATH, "stopwords.json")
     CHOICE_UPDATE_STOP_WORDS,
     CHOICE_SET_MODEL,
     CHOICE_SHOW_DOCUMENT,
+    CHOICE_INDEX_STATISTICS,
     CHOICE_EXIT,
-) = (1, 2, 3, 4, 5, 6, 9)
-MODEL_BOOL_LIN, MODEL_BOOL_INV, MODEL_SIG, MODEL_VSM_INV = 1, 2, 3, 4
+) = (1, 2, 3, 4, 5, 6, 7, 9)
+MODEL_BOOL_LIN, MODEL_BOOL_INV, MODEL_SIG, MODEL_VSM_INV, MODEL_VSM_SPARSE, MODEL_VSM_BM25, MODEL_VSM_LM = range(1, 8)
 SW_METHOD_LIST, SW_METHOD_CROUCH = 1, 2
 
 
+def inverted_index_path(stopword_filtering: bool, stemming: bool) -> str:
+    """
+    Returns the path of the Boolean index file of a search mode, e.g. data/inverted_index_sw_stem.bin.
+    """
+    suffix = ("_sw" if stopword_filtering else "") + ("_stem" if stemming else "")
+    root, extension = os.path.splitext(INVERTED_INDEX_PATH)
+    return root + suffix + extension
+
+
+# Model name -> function that selects the model on an InformationRetrievalSystem (the models of the menu)
+MODEL_SELECTORS = {
+    'linear': lambda system: system.set_model(models.LinearBooleanModel),
+    'inverted': lambda system: system.set_model(models.InvertedListBooleanModel),
+    'signature': lambda system: system.set_model(models.SignatureBasedBooleanModel),
+    'vsm-tfidf': lambda system: system.set_ranking_model(scoring.TfIdfCosineScorer()),
+    'vsm-sparse': lambda system: system.set_model(sparse_vsm.SparseVectorSpaceModel),
+    'vsm-bm25': lambda system: system.set_ranking_model(scoring.BM25Scorer()),
+    'vsm-lm': lambda system: system.set_ranking_model(scoring.LanguageModelScorer()),
+}
+
+
 class InformationRetrievalSystem(object):
-    def __init__(self):
+    def __init__(self, collection: CollectionStore = None):
+        """
+        :param collection: Collection to search instead of the one saved in data/, e.g. to share one loaded
+                           collection between several systems
+        """
         if not os.path.isdir(DATA_PATH):
             os.makedirs(DATA_PATH)
 
-        try:
-            self.collection = extraction.load_collection_from_json(COLLECTION_PATH)
-        except FileNotFoundError:
-            print("No previous collection was found. Creating empty one.")
-            self.collection = []
-
         try:
             with open(STOPWORD_FILE_PATH, "r") as f:
                 self.stop_word_list = json.load(f)
         except FileNotFoundError:
             print("No stopword list was found.")
             self.stop_word_list = []
+        representation.default_pipeline.set_stop_word_list(self.stop_word_list)
+
+        if collection is not None:
+            self.collection = collection
+        else:
+            try:
+                # Filtered representations computed with another stop word list are not loaded.
+                self.collection = CollectionStore(
+                    collection_snapshot.load_collection_snapshot(SNAPSHOT_PATH, self.stop_word_list)
+                )
+            except (FileNotFoundError, ValueError):
+                # Collections saved before the snapshot format existed are converted once. It is unknown which stop
+                # word list their filtered terms were computed with, so those are derived again.
+                self.collection = CollectionStore(
+                    extraction.load_collection_from_json(COLLECTION_PATH)
+                )
+                representation.default_pipeline.set_stop_word_list(self.stop_word_list, self.collection)
+                if self.collection:
+                    collection_snapshot.write_collection_snapshot(self.collection, SNAPSHOT_PATH, self.stop_word_list)
 
         self.model = None
+        self.model_factory = None  # creates the current model, once per search mode
+        self.model_variants = {}  # (stop word filtering, stemming) -> model with the index of that search mode
         self.output_k = 5
+        self.result_cache = QueryResultCache()
+
+        try:
+            self.ground_truth = evaluation.GroundTruth.load(evaluation.GROUND_TRUTH_PATH)
+        except FileNotFoundError:
+            print("Ground truth file not found.")
+            self.ground_truth = None
 
     def main_menu(self):
         while True:
@@ -59,6 +126,7 @@ class InformationRetrievalSystem(object):
             print(f"{CHOICE_UPDATE_STOP_WORDS} - Rebuild stopword list")
             print(f"{CHOICE_SET_MODEL} - Set model")
             print(f"{CHOICE_SHOW_DOCUMENT} - Show a specific document")
+            print(f"{CHOICE_INDEX_STATISTICS} - Show index statistics")
             print(f"{CHOICE_EXIT} - Exit")
 
             try:
@@ -106,52 +174,57 @@ class InformationRetrievalSystem(object):
                 )
 
                 query = input("Query: ")
-                if stemming:
-                    query = porter.stem_query_terms(query)
 
+                key = self.result_cache.key(query, self.model, stop_word_filtering, stemming, self.output_k)
                 st = time.time()
-                if isinstance(self.model, models.InvertedListBooleanModel):
-                    results = self.inverted_list_search(
-                        query, stemming, stop_word_filtering
-                    )
-                elif isinstance(self.model, models.SignatureBasedBooleanModel):
-                    results = self.model.search(query, stop_word_filtering, stemming)
-                    results = [
-                        (1.0, self.get_document_by_id(doc_id)) for doc_id in results
-                    ]
-                elif isinstance(self.model, models.VectorSpaceModel):
-                    results = self.vsm_search(query)
-                else:
-                    results = self.basic_query_search(
-                        query, stemming, stop_word_filtering
+                try:
+                    results, cached = self.result_cache.get_or_compute(
+                        key, lambda: self.search(query, stemming, stop_word_filtering)
                     )
+                except query_parser.QuerySyntaxError as e:
+                    print(e)
+                    continue
                 et = time.time()
 
-                results = [result for result in results if result[0] > 0]
-
                 for score, document in results:
                     print(f"{score}: {document}")
 
                 print()
-                print(f"precision: {self.calculate_precision(results):.2f}")
-                print(f"recall: {self.calculate_recall(results):.2f}")
-                print(f"Time taken: {(et - st) * 1000:.2f} ms")
+                metrics = self.evaluate_results(query, results)
+                if metrics is not None:
+                    print(f"precision: {metrics['precision']:.2f}")
+                    print(f"recall: {metrics['recall']:.2f}")
+                    print(f"average precision: {metrics['average_precision']:.2f}")
+                    print(f"nDCG: {metrics['ndcg']:.2f}")
+                else:
+                    print("No relevance judgments for this query.")
+                if isinstance(self.model, models.SignatureBasedBooleanModel):
+                    print(f"false drop rate: {self.model.false_drop_rate():.4f}")
+                if isinstance(getattr(self.model, "inverted_index", None), CachedInvertedIndex):
+                    postings_cache = self.model.inverted_index
+                    print(
+                        f"Postings cache: {postings_cache.hit_rate():.0%} hit rate, "
+                        f"{postings_cache.used_bytes / 1024:.0f} KiB used"
+                    )
+                print(f"Time taken: {(et - st) * 1000:.2f} ms{' (cached)' if cached else ''}")
+                print(
+                    f"Result cache: {self.result_cache.hit_rate():.0%} hit rate, "
+                    f"{self.result_cache.saved_seconds * 1000:.2f} ms saved"
+                )
 
             elif action_choice == CHOICE_EXTRACT:
+                # The workers filter with the current stop word list and stem; the indexes of the other search modes
+                # are built when a search mode needs them.
                 raw_collection_file = os.path.join(RAW_DATA_PATH, "aesopa10.txt")
-                self.collection = extraction.extract_collection(raw_collection_file)
-                assert isinstance(self.collection, list)
+                build = pipeline.build_collection(raw_collection_file, self.stop_word_list, stemming=True)
+                self.collection = CollectionStore(build.documents)
                 assert all(isinstance(d, Document) for d in self.collection)
 
-                if input("Should stopwords be filtered? [Y/N]: ") == "y":
-                    self.collection = cleanup.filter_collection(
-                        self.collection, self.stop_word_list
-                    )
-
-                if input("Should stemming be performed? [Y/N]: ") == "y":
-                    porter.stem_all_documents(self.collection)
-
-                extraction.save_collection_as_json(self.collection, COLLECTION_PATH)
+                collection_snapshot.write_collection_snapshot(self.collection, SNAPSHOT_PATH, self.stop_word_list)
+                self.drop_model_variants(SEARCH_MODES)
+                build.to_inverted_list_model().save_inverted_index(
+                    inverted_index_path(False, False), len(self.collection)
+                )
                 print("Done.\n")
 
             elif action_choice == CHOICE_UPDATE_STOP_WORDS:
@@ -181,8 +254,12 @@ class InformationRetrievalSystem(object):
                         )
                         print("Done.\n")
 
+                    representation.default_pipeline.set_stop_word_list(self.stop_word_list, self.collection)
+                    self.drop_model_variants([mode for mode in SEARCH_MODES if mode[0]])
                     with open(STOPWORD_FILE_PATH, "w") as f:
                         json.dump(self.stop_word_list, f)
+                    # The snapshot must not keep the representations filtered with the old list.
+                    collection_snapshot.write_collection_snapshot(self.collection, SNAPSHOT_PATH, self.stop_word_list)
                 else:
                     print("Invalid choice.")
 
@@ -193,6 +270,9 @@ class InformationRetrievalSystem(object):
                 print(f"{MODEL_BOOL_INV} - Boolean model with inverted lists")
                 print(f"{MODEL_SIG} - Signature Based Boolean Model")
                 print(f"{MODEL_VSM_INV} - Vector Space Model with inverted lists")
+                print(f"{MODEL_VSM_SPARSE} - Vector Space Model with sparse matrix (numpy/scipy)")
+                print(f"{MODEL_VSM_BM25} - Ranked retrieval with BM25")
+                print(f"{MODEL_VSM_LM} - Ranked retrieval with a language model (Jelinek-Mercer smoothing)")
 
                 try:
                     model_choice = int(input("Enter choice: "))
@@ -203,17 +283,22 @@ class InformationRetrievalSystem(object):
                     continue
 
                 if model_choice == MODEL_BOOL_LIN:
-                    self.model = models.LinearBooleanModel()
+                    self.set_model(models.LinearBooleanModel)
                 elif model_choice == MODEL_BOOL_INV:
-                    self.model = models.InvertedListBooleanModel()
-                    self.model.build_inverted_index(self.collection, stopword_filtering=True, stemming=True)
+                    self.set_model(models.InvertedListBooleanModel)
                 elif model_choice == MODEL_SIG:
-                    self.model = models.SignatureBasedBooleanModel()
-                    self.model.build_signature_index(
-                        self.collection, stopword_filtering=True, stemming=True
-                    )
+                    self.set_model(models.SignatureBasedBooleanModel)
                 elif model_choice == MODEL_VSM_INV:
-                    self.model = models.VectorSpaceModel()
+                    self.set_ranking_model(scoring.TfIdfCosineScorer())
+                elif model_choice == MODEL_VSM_SPARSE:
+                    try:
+                        self.set_model(sparse_vsm.SparseVectorSpaceModel)
+                    except ImportError as e:
+                        print(e)
+                elif model_choice == MODEL_VSM_BM25:
+                    self.set_ranking_model(scoring.BM25Scorer())
+                elif model_choice == MODEL_VSM_LM:
+                    self.set_ranking_model(scoring.LanguageModelScorer())
                 else:
                     print("Invalid choice.")
 
@@ -223,18 +308,18 @@ class InformationRetrievalSystem(object):
                 except ValueError:
                     print("Invalid choice. Please enter a valid document ID.")
                     continue
-                
-                found = False
-                for document in self.collection:
-                    if document.document_id == target_id:
-                        print(document.title)
-                        print("-" * len(document.title))
-                        print(document.raw_text)
-                        found = True
-
-                if not found:
+
+                document = self.collection.get(target_id)
+                if document is not None:
+                    print(document.title)
+                    print("-" * len(document.title))
+                    print(document.raw_text)
+                else:
                     print(f"Document #{target_id} not found!")
 
+            elif action_choice == CHOICE_INDEX_STATISTICS:
+                self.print_index_statistics()
+
             elif action_choice == CHOICE_EXIT:
                 break
             else:
@@ -244,126 +329,287 @@ class InformationRetrievalSystem(object):
             input("Press ENTER to continue...")
             print()
 
-    def basic_query_search(self, query: str, stemming: bool, stop_word_filtering: bool) -> list:
-        query_representation = self.model.query_to_representation(query)
-        document_representations = [self.model.document_to_representation(d, stop_word_filtering, stemming)
-                                    for d in self.collection]
-        scores = [self.model.match(dr, query_representation) for dr in document_representations]
-        ranked_collection = sorted(zip(scores, self.collection), key=lambda x: x[0], reverse=True)
-        results = ranked_collection[: self.output_k]
+    def search(self, query: str, stemming: bool, stop_word_filtering: bool, k: int = None) -> list:
+        """
+        Runs a query against the current model. The model instance and k are resolved once per call and passed on,
+        so concurrent calls with different search modes or k do not interfere once the indexes are built.
+        :param k: Maximum number of results of the ranking models, default: output_k
+        :return: List of (score, document) tuples with a positive score, best first
+        :raises query_parser.QuerySyntaxError: if the query is malformed
+        """
+        with instrumentation.query(query):
+            k = k if k is not None else self.output_k
+            if stemming:
+                with instrumentation.timer('query_parse'):
+                    query = porter.stem_query_terms(query)
+            model = self.model
+            if self.model_factory is not None:
+                model = self.model_for_mode(stop_word_filtering, stemming)
+                self.model = model  # the menu reports statistics of the variant that answered the last query
+
+            if isinstance(model, models.InvertedListBooleanModel):
+                results = self.inverted_list_search(query, stemming, stop_word_filtering, model)
+            elif isinstance(model, models.SignatureBasedBooleanModel):
+                doc_ids = model.search(query, stop_word_filtering, stemming)
+                with instrumentation.timer('materialization'):
+                    results = [(1.0, self.get_document_by_id(doc_id)) for doc_id in doc_ids]
+            elif isinstance(model, models.VectorSpaceModel):
+                results = self.vsm_search(query, model, k)
+            else:
+                results = self.basic_query_search(query, stemming, stop_word_filtering, model, k)
+            return [result for result in results if result[0] > 0]
+
+    def set_model(self, model_factory):
+        """
+        Selects a retrieval model. No index is built here; model_for_mode() builds the index of a search mode when
+        the first query in that mode arrives.
+        :param model_factory: Function without arguments that creates a new instance of the model
+        """
+        self.model = model_factory()
+        self.model_factory = model_factory
+        self.model_variants = {}
+
+    def model_for_mode(self, stop_word_filtering: bool, stemming: bool):
+        """
+        Returns the instance of the current model that holds the index of a search mode, creating and indexing it
+        on first use.
+        """
+        mode = (stop_word_filtering, stemming)
+        model = self.model_variants.get(mode)
+        if model is None:
+            model = self.model_factory()
+            if isinstance(model, models.InvertedListBooleanModel):
+                self.load_or_build_inverted_index(stop_word_filtering, stemming, model)
+            elif isinstance(model, models.SignatureBasedBooleanModel):
+                model.build_signature_index(self.collection, stop_word_filtering, stemming)
+            elif isinstance(model, models.VectorSpaceModel):
+                model.build_inverted_index(self.collection, stop_word_filtering, stemming)
+            self.model_variants[mode] = model
+        return model
+
+    def prepare_mode(self, stop_word_filtering: bool, stemming: bool):
+        """
+        Builds everything the current model builds lazily for a search mode: its index, the positional index of the
+        inverted model and the document representations the linear model matches against. Afterwards queries in that
+        mode do not build anything, so they can run on several threads or in forked processes sharing the result.
+        :return: The model instance of the search mode
+        """
+        model = self.model_for_mode(stop_word_filtering, stemming)
+        if isinstance(model, models.InvertedListBooleanModel):
+            if model.positional_index is None:
+                model.build_positional_index(self.collection, stop_word_filtering, stemming)
+        elif isinstance(model, models.LinearBooleanModel):
+            for document in self.collection:
+                representation.default_pipeline.term_ids(document, stop_word_filtering, stemming)
+        return model
+
+    def drop_model_variants(self, modes):
+        """
+        Discards the indexes of the given search modes after their representations changed, in memory and on disk.
+        """
+        self.result_cache.invalidate()
+        for mode in modes:
+            self.model_variants.pop(mode, None)
+            if os.path.exists(inverted_index_path(*mode)):
+                os.remove(inverted_index_path(*mode))
+        if self.model_factory is not None:
+            self.model = self.model_factory()
+
+    def print_index_statistics(self):
+        """
+        Prints, per search mode of the current model, the most requested terms of the postings cache and the size of
+        the positional index compared with a non-positional one.
+        """
+        if not self.model_variants:
+            print("No index has been built for the current model yet.")
+            return
+        for (stop_word_filtering, stemming), model in self.model_variants.items():
+            print(f"Stop word filtering: {'on' if stop_word_filtering else 'off'}, "
+                  f"stemming: {'on' if stemming else 'off'}")
+            postings_cache = getattr(model, "inverted_index", None)
+            if isinstance(postings_cache, CachedInvertedIndex):
+                print(
+                    f"  Postings cache: {postings_cache.hit_rate():.0%} hit rate, "
+                    f"{postings_cache.used_bytes / 1024:.0f} KiB used"
+                )
+                for term, hits, misses in postings_cache.term_statistics():
+                    print(f"    {term}: {hits} hits, {misses} misses")
+            positional_index = getattr(model, "positional_index", None)
+            if positional_index is not None:
+                report = positional_index.memory_report()
+                print(
+                    f"  Positional index: {report['terms']} terms, {report['postings']} postings, "
+                    f"{report['positions']} positions"
+                )
+                print(
+                    f"    encoded: {report['positional_encoded_bytes'] / 1024:.0f} KiB "
+                    f"({report['encoded_ratio']:.2f}x the non-positional index), "
+                    f"in memory: {report['positional_memory_bytes'] / 1024:.0f} KiB "
+                    f"({report['memory_ratio']:.2f}x)"
+                )
+
+    def basic_query_search(self, query: str, stemming: bool, stop_word_filtering: bool, model=None, k=None) -> list:
+        model = model or self.model
+        query_representation = model.query_to_representation(query)
+        with instrumentation.timer('scoring'):
+            document_representations = [model.document_to_representation(d, stop_word_filtering, stemming)
+                                        for d in self.collection]
+            scores = [model.match(dr, query_representation) for dr in document_representations]
+        with instrumentation.timer('materialization'):
+            ranked_collection = sorted(zip(scores, self.collection), key=lambda x: x[0], reverse=True)
+            results = ranked_collection[: k if k is not None else self.output_k]
         return results
 
-    def inverted_list_search(self, query: str, stemming: bool, stop_word_filtering: bool) -> list:
-        if not isinstance(self.model, models.InvertedListBooleanModel):
+    def load_or_build_inverted_index(self, stopword_filtering: bool, stemming: bool, model=None):
+        """
+        Opens the on-disk inverted index of a search mode if it matches the current collection. Otherwise the index
+        is built from the collection, written to disk and opened afterwards.
+        :param model: InvertedListBooleanModel to load the index into, default: the current model
+        """
+        model = model or self.model
+        index_path = inverted_index_path(stopword_filtering, stemming)
+        try:
+            model.load_inverted_index(
+                index_path, self.collection.document_ids(), POSTINGS_CACHE_BYTES
+            )
+            index = model.inverted_index
+            if (
+                index.num_documents == len(self.collection)
+                and index.stopword_filtering == stopword_filtering
+                and index.stemming == stemming
+            ):
+                return
+            index.close()
+        except (FileNotFoundError, ValueError):
+            pass
+
+        model.build_inverted_index(self.collection, stopword_filtering, stemming)
+        model.save_inverted_index(
+            index_path, len(self.collection), stopword_filtering, stemming
+        )
+        model.load_inverted_index(
+            index_path, self.collection.document_ids(), POSTINGS_CACHE_BYTES
+        )
+
+    def inverted_list_search(self, query: str, stemming: bool, stop_word_filtering: bool, model=None) -> list:
+        model = model or self.model
+        if not isinstance(model, models.InvertedListBooleanModel):
             raise TypeError("Model is not an InvertedListBooleanModel")
 
-        if not self.model.inverted_index:
-            self.model.build_inverted_index(
+        if not model.inverted_index:
+            model.build_inverted_index(
                 self.collection, stop_word_filtering, stemming
             )
 
-        query_representation = self.model.query_to_representation(query)
-        results = set()
-        for term in query_representation:
-            if term in self.model.inverted_index:
-                results.update(self.model.inverted_index[term])
+        query_tree = query_parser.parse_query(query)
+        if model.positional_index is None and query_parser.needs_positions(query_tree):
+            # Only phrases and NEAR need positions; the index is built for the first such query of a search mode.
+            model.build_positional_index(
+                self.collection, stop_word_filtering, stemming
+            )
 
-        ranked_collection = [
-            (1.0, doc) for doc in self.collection if doc.document_id in results
-        ]
+        results = model.execute(query_tree)
+        with instrumentation.timer('materialization'):
+            ranked_collection = [(1.0, doc) for doc in self.collection.get_many(results)]
         return ranked_collection
 
-    def calculate_precision(self, result_list: list[tuple]) -> float:
-        try:
-            with open(os.path.join(RAW_DATA_PATH, "ground_truth.txt"), "r") as f:
-                ground_truth = []
-                for line in f:
-                    if line.strip() and not line.startswith(
-                        "#"
-                    ):  # Skip empty lines and comments
-                        parts = line.strip().split("-")
-                        if len(parts) > 1:
-                            ids = parts[1].split(",")
-                            ground_truth.extend([int(doc_id.strip()) for doc_id in ids])
-                        else:
-                            ground_truth.append(int(line.strip()))
-        except FileNotFoundError:
-            print("Ground truth file not found.")
-            return 0.0
-
-        retrieved_docs = [doc.document_id for score, doc in result_list]
-        relevant_docs = set(ground_truth)
-        true_positives = len(
-            [doc_id for doc_id in retrieved_docs if doc_id in relevant_docs]
+    def evaluate_results(self, query: str, result_list: list[tuple]):
+        """
+        Evaluates the results of a query against its relevance judgments.
+        :return: Dictionary with precision, recall, average precision, nDCG and reciprocal rank at the number of
+                 results, or None if the query has no judgments
+        """
+        if self.ground_truth is None or query not in self.ground_truth:
+            return None
+        metrics = evaluation.evaluate_rankings(
+            [[doc.document_id for score, doc in result_list]],
+            [self.ground_truth.relevant(query)],
+            max(len(result_list), 1),
         )
+        return {name: metrics[name][0] for name in evaluation.METRICS}
 
-        return round(true_positives / len(retrieved_docs), 2) if retrieved_docs else 0.0
-
-    def calculate_recall(self, result_list: list[tuple]) -> float:
-        try:
-            with open(os.path.join(RAW_DATA_PATH, "ground_truth.txt"), "r") as f:
-                ground_truth = []
-                for line in f:
-                    if line.strip() and not line.startswith(
-                        "#"
-                    ):  # Skip empty lines and comments
-                        parts = line.strip().split("-")
-                        if len(parts) > 1:
-                            ids = parts[1].split(",")
-                            ground_truth.extend([int(doc_id.strip()) for doc_id in ids])
-                        else:
-                            ground_truth.append(int(line.strip()))
-        except FileNotFoundError:
-            print("Ground truth file not found.")
-            return 0.0
-
-        retrieved_docs = [doc.document_id for score, doc in result_list]
-        relevant_docs = set(ground_truth)
-        true_positives = len([doc_id for doc_id in retrieved_docs if doc_id in relevant_docs])
+    def get_document_by_id(self, doc_id):
+        return self.collection.get(doc_id)
+
+    def set_ranking_model(self, scorer: scoring.Scorer):
+        """
+        Selects a VectorSpaceModel with the given scorer. The collection statistics of the search modes that were
+        already indexed are reused, so switching between scorers does not re-index the collection.
+        Every variant gets its own copy of the scorer, because a scorer is prepared for one set of statistics.
+        """
+        variants = {
+            mode: models.VectorSpaceModel(copy.copy(scorer), model.statistics)
+            for mode, model in self.model_variants.items()
+            if getattr(model, "statistics", None) is not None
+        }
+        self.set_model(lambda: models.VectorSpaceModel(copy.copy(scorer)))
+        self.model_variants = variants
+
+    def vsm_search(self, query: str, model=None, k=None) -> list:
+        model = model or self.model
+        if not isinstance(model, models.VectorSpaceModel):
+            raise TypeError("Model is not a VectorSpaceModel")
 
-        return round(true_positives / len(relevant_docs), 2) if relevant_docs else 0.0
+        if not model.is_built():
+            model.build_inverted_index(self.collection)
 
-    def get_document_by_id(self, doc_id):
-        for document in self.collection:
-            if document.document_id == doc_id:
-                return document
-        return None
+        ranking = model.top_k(query, k if k is not None else self.output_k)
+        with instrumentation.timer('materialization'):
+            ranked_collection = [(round(score, 2), self.get_document_by_id(doc_id)) for score, doc_id in ranking]
+        return ranked_collection
 
-    def vsm_search(self, query: str) -> list:
-        if not isinstance(self.model, models.VectorSpaceModel):
-            raise TypeError("Model is not a VectorSpaceModel")
 
-        if not self.model.inverted_index:
-            self.model.build_inverted_index(self.collection)
-
-        query_vector = self.model.query_to_vector(query)
-        scores = {}
-
-        for term, weight in sorted(
-            query_vector.items(), key=lambda item: item[1], reverse=True
-        ):
-            if term in self.model.inverted_index:
-                for doc_id, term_weight in self.model.inverted_index[term]:
-                    if doc_id not in scores:
-                        scores[doc_id] = 0
-                    scores[doc_id] += term_weight * weight
-
-            if len(scores) > self.output_k:
-                sorted_scores = sorted(scores.values(), reverse=True)
-                threshold = sorted_scores[self.output_k - 1]
-                if all(score < threshold for score in sorted_scores[self.output_k :]):
-                    break
-
-        ranked_collection = [
-            (round(score, 2), doc)
-            for doc_id, score in scores.items()
-            for doc in self.collection
-            if doc.document_id == doc_id
-        ]
-        ranked_collection.sort(reverse=True, key=lambda x: x[0])
-        return ranked_collection[: self.output_k]
+def main():
+    parser = argparse.ArgumentParser(
+        description="Information retrieval system. Without --queries the interactive menu is started."
+    )
+    parser.add_argument("--queries", help="JSONL file of search requests to run in bulk ('-' for stdin)")
+    parser.add_argument("--output", default="-", help="JSONL file for the results (default: stdout)")
+    parser.add_argument("--models", nargs="+", choices=list(MODEL_SELECTORS), help="models to load (default: all)")
+    parser.add_argument("--workers", type=int, help="size of the worker pool (default: number of CPUs)")
+    parser.add_argument("--processes", action="store_true", help="search in forked worker processes")
+    parser.add_argument("--unordered", action="store_true", help="write results in completion order")
+    parser.add_argument("--flat-index", action="store_true",
+                        help="search the ranking models on flat indexes in shared memory")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.enable_from_arguments(args)
+
+    if args.queries is None:
+        InformationRetrievalSystem().main_menu()
+        instrumentation.report(args)
+        return
+
+    import search_service  # imports this module
+
+    # Messages go to stderr, stdout may carry the results.
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        engine = search_service.SearchEngine(args.models, flat_indexes=args.flat_index)
+    print(f"Loaded {len(engine.models())} models in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+    input_file = sys.stdin if args.queries == "-" else open(args.queries, "r")
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        statistics = search_service.run_bulk_queries(
+            engine, input_file, output_file, args.workers, args.processes, not args.unordered
+        )
+    finally:
+        engine.close()
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    print(
+        f"{statistics['queries']} queries ({statistics['errors']} errors) in {statistics['seconds']:.2f} s: "
+        f"{statistics['queries_per_second']:.0f} queries/s",
+        file=sys.stderr,
+    )
+    if args.processes and instrumentation.recorder.enabled:
+        print("The searches ran in worker processes, their stage timings are not included below.", file=sys.stderr)
+    instrumentation.report(args)
 
 
 if __name__ == "__main__":
-    InformationRetrievalSystem().main_menu()
+    main()
     exit(0)
@@ -1,8 +1,17 @@
 from abc import ABC, abstractmethod
 from collections import defaultdict
+import hashlib
 import math
 from document import Document
 from math import log2, ceil
+import index_storage
+import instrumentation
+import query_parser
+import representation
+import scoring
+from positional_index import PositionalIndex
+from postings_cache import CachedInvertedIndex
+import topk
 
 class RetrievalModel(ABC):
     @abstractmethod
@@ -26,18 +35,17 @@ class LinearBooleanModel(RetrievalModel):
         self.documents = documents
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
-        if stopword_filtering:
-            return document.filtered_terms
-        if stemming:
-            return document.stemmed_terms
-        return document.terms
+        return representation.document_terms(document, stopword_filtering, stemming)
 
     def query_to_representation(self, query: str):
-        return query.lower().split()
+        return query_parser.parse_query(query)
 
     def match(self, document_representation, query_representation) -> float:
-        return 1.0 if any(term in document_representation for term in query_representation) else 0.0
+        if query_representation is None:
+            return 0.0
+        return 1.0 if query_representation.matches(document_representation, set(document_representation)) else 0.0
 
+    @instrumentation.timed('scoring')
     def search(self, query: str) -> list:
         result = []
         query_representation = self.query_to_representation(query)
@@ -53,22 +61,83 @@ class LinearBooleanModel(RetrievalModel):
 class InvertedListBooleanModel(RetrievalModel):
     def __init__(self):
         self.inverted_index = {}
+        self.document_ids = []
+        self.positional_index = None
 
+    @instrumentation.timed('index_build')
     def build_inverted_index(self, collection: list[Document], stopword_filtering=False, stemming=False):
         self.inverted_index = {}
+        self.document_ids = []
         for document in collection:
+            self.document_ids.append(document.document_id)
             terms = self.document_to_representation(document, stopword_filtering, stemming)
             for term in terms:
                 if term not in self.inverted_index:
                     self.inverted_index[term] = set()
                 self.inverted_index[term].add(document.document_id)
+        self.inverted_index = {term: sorted(doc_ids) for term, doc_ids in self.inverted_index.items()}
+        self.document_ids.sort()
+
+    def save_inverted_index(self, file_path: str, num_documents=0, stopword_filtering=False, stemming=False):
+        index_storage.write_inverted_index(self.inverted_index, file_path, num_documents, stopword_filtering, stemming)
+
+    @instrumentation.timed('index_build')
+    def load_inverted_index(self, file_path: str, document_ids: list = None, cache_bytes: int = None):
+        """
+        Opens an index file written by save_inverted_index().
+        :param document_ids: IDs of all documents of the collection, needed for negations
+        :param cache_bytes: Memory budget for decoded posting lists of frequently queried terms, None for no cache
+        """
+        self.inverted_index = index_storage.DiskInvertedIndex(file_path)
+        if cache_bytes is not None:
+            self.inverted_index = CachedInvertedIndex(self.inverted_index, cache_bytes)
+        if document_ids is not None:
+            self.document_ids = sorted(document_ids)
+
+    @instrumentation.timed('index_build')
+    def build_positional_index(self, collection: list[Document], stopword_filtering=False, stemming=False):
+        self.positional_index = PositionalIndex()
+        self.positional_index.build(
+            collection, lambda document: self.document_to_representation(document, stopword_filtering, stemming)
+        )
+
+    def document_frequency(self, term: str) -> int:
+        if isinstance(self.inverted_index, (index_storage.DiskInvertedIndex, CachedInvertedIndex)):
+            return self.inverted_index.document_frequency(term)
+        return len(self.inverted_index.get(term, ()))
+
+    def search(self, query: str, verify_phrase=None, verify_near=None) -> list:
+        """
+        Evaluates a Boolean query (AND, OR, NOT, parentheses, "phrases", NEAR/k) on the inverted index. Phrases and
+        proximity operators are answered by the positional index if one was built, otherwise by the verify functions.
+        :param verify_phrase: Function (doc_id, terms) -> bool that checks whether a document contains a phrase
+        :param verify_near: Function (doc_id, left, right, distance) -> bool
+        :return: Sorted list of the ids of all matching documents
+        :raises query_parser.QuerySyntaxError: if the query is malformed
+        :raises ValueError: if the query contains a phrase or NEAR but there is neither a positional index nor a verify
+                            function for it
+        """
+        return self.execute(query_parser.parse_query(query), verify_phrase, verify_near)
+
+    def execute(self, query_tree, verify_phrase=None, verify_near=None) -> list:
+        """
+        Like search(), for a query that was already parsed with query_parser.parse_query().
+        """
+        positional_index = self.positional_index
+        planner = query_parser.QueryPlanner(
+            postings=lambda term: self.inverted_index.get(term, []),
+            document_frequency=self.document_frequency,
+            all_doc_ids=lambda: self.document_ids,
+            phrase_postings=positional_index.phrase_postings if positional_index is not None else None,
+            verify_phrase=verify_phrase,
+            near_postings=positional_index.near_postings if positional_index is not None else None,
+            verify_near=verify_near,
+        )
+        with instrumentation.timer('scoring'):  # Boolean matching: evaluation of the query tree
+            return planner.execute(query_tree)
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
-        if stopword_filtering:
-            return document.filtered_terms
-        if stemming:
-            return document.stemmed_terms
-        return document.terms
+        return representation.document_terms(document, stopword_filtering, stemming)
 
     def query_to_representation(self, query: str):
         return query.lower().split()
@@ -81,83 +150,203 @@ class InvertedListBooleanModel(RetrievalModel):
 
 
 class SignatureBasedBooleanModel(RetrievalModel):
-    def __init__(self):
-        self.signature_index = {}
-
+    """
+    Boolean model on a bit-sliced signature file. Every term sets bits_per_term of the signature_width bits of a
+    document signature; the positions come from a keyed hash, so signatures are identical in every process.
+    The signatures are stored column-wise: bit_slices[b] is a bitmap (a Python int) with bit i set if bit b is set in
+    the signature of the i-th document. A query therefore only ANDs the slices of its own bits. Boolean queries (see
+    query_parser) are evaluated on the slices conservatively, every candidate is then verified against the terms of
+    the document to remove false drops, whose rate is tracked.
+    """
+
+    def __init__(self, signature_width=256, bits_per_term=2):
+        self.signature_width = signature_width
+        self.bits_per_term = bits_per_term
+        self.bit_slices = [0] * signature_width
+        self.doc_ids = []  # ordinal -> document id
+        self.document_terms = []  # ordinal -> set of terms, used to verify candidates
+        self.documents = []  # ordinal -> document, for phrases and NEAR, which need the term order
+        self.search_mode = (False, False)
+        self.candidates = 0
+        self.false_drops = 0
+        self.non_matching = 0
+
+    @instrumentation.timed('index_build')
     def build_signature_index(self, collection: list[Document], stopword_filtering=False, stemming=False):
-        self.signature_index = {}
-        for document in collection:
-            terms = self.document_to_representation(document, stopword_filtering, stemming)
+        self.bit_slices = [0] * self.signature_width
+        self.doc_ids = []
+        self.document_terms = []
+        self.documents = list(collection)
+        self.search_mode = (stopword_filtering, stemming)
+        for ordinal, document in enumerate(self.documents):
+            terms = frozenset(self.document_to_representation(document, stopword_filtering, stemming))
             signature = self.create_signature(terms)
-            self.signature_index[document.document_id] = signature
+            self.doc_ids.append(document.document_id)
+            self.document_terms.append(terms)
+            document_bit = 1 << ordinal
+            for position in self._bit_positions(signature):
+                self.bit_slices[position] |= document_bit
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
-        if stopword_filtering:
-            return document.filtered_terms
-        if stemming:
-            return document.stemmed_terms
-        return document.terms
+        return representation.document_terms(document, stopword_filtering, stemming)
 
     def query_to_representation(self, query: str):
-        return query.lower().split()
+        return query_parser.parse_query(query)
+
+    def term_positions(self, term: str) -> list[int]:
+        digest = hashlib.blake2b(term.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.signature_width for i in range(self.bits_per_term)]
 
     def create_signature(self, terms: list[str]) -> int:
         signature = 0
         for term in terms:
-            signature |= 1 << (hash(term) % 64)  # Using a 64-bit integer as the signature
+            for position in self.term_positions(term):
+                signature |= 1 << position
         return signature
 
-    def match(self, document_representation, query_representation) -> float:
-        query_signature = self.create_signature(query_representation)
-        return 1.0 if query_signature & document_representation == query_signature else 0.0
+    @staticmethod
+    def _bit_positions(bitmap: int):
+        while bitmap:
+            lowest_bit = bitmap & -bitmap
+            yield lowest_bit.bit_length() - 1
+            bitmap ^= lowest_bit
 
+    def match(self, document_representation, query_representation) -> float:
+        if query_representation is None:
+            return 0.0
+        return 1.0 if query_representation.matches(document_representation, set(document_representation)) else 0.0
+
+    def _candidates(self, node, all_documents: int) -> int:
+        """
+        Bitmap of the documents that may match a query node: a superset of the matches, never a subset. The slices
+        of a term can only produce false drops, so the complement of a term's bitmap could miss matches; negations
+        therefore keep all documents and are decided by the verification.
+        """
+        if isinstance(node, query_parser.Term):
+            candidates = all_documents
+            for position in self.term_positions(node.term):
+                candidates &= self.bit_slices[position]
+            return candidates
+        if isinstance(node, query_parser.Phrase):
+            return self._candidates(query_parser.And([query_parser.Term(term) for term in node.terms]), all_documents)
+        if isinstance(node, query_parser.Near):
+            return self._candidates(query_parser.And([query_parser.Term(node.left), query_parser.Term(node.right)]),
+                                    all_documents)
+        if isinstance(node, query_parser.And):
+            candidates = all_documents
+            for child in node.children:
+                candidates &= self._candidates(child, all_documents)
+                if not candidates:
+                    break
+            return candidates
+        if isinstance(node, query_parser.Or):
+            candidates = 0
+            for child in node.children:
+                candidates |= self._candidates(child, all_documents)
+            return candidates
+        return all_documents  # Not
+
+    @instrumentation.timed('scoring')
     def search(self, query: str, stopword_filtering=False, stemming=False) -> list:
+        """
+        Evaluates a Boolean query (AND, OR, NOT, parentheses, "phrases", NEAR/k) on the signature file.
+        :return: Ids of all matching documents, in collection order
+        :raises query_parser.QuerySyntaxError: if the query is malformed
+        """
         query_representation = self.query_to_representation(query)
-        query_signature = self.create_signature(query_representation)
-        results = []
+        if query_representation is None or not self.doc_ids:
+            return []
 
-        for doc_id, doc_signature in self.signature_index.items():
-            if query_signature & doc_signature == query_signature:
-                results.append(doc_id)
+        candidates = self._candidates(query_representation, (1 << len(self.doc_ids)) - 1)
+        term_order = query_parser.needs_positions(query_representation)
+
+        results = []
+        num_candidates = 0
+        for ordinal in self._bit_positions(candidates):
+            num_candidates += 1
+            terms = (self.document_to_representation(self.documents[ordinal], *self.search_mode)
+                     if term_order else ())
+            if query_representation.matches(terms, self.document_terms[ordinal]):
+                results.append(self.doc_ids[ordinal])
+
+        self.candidates += num_candidates
+        self.false_drops += num_candidates - len(results)
+        self.non_matching += len(self.doc_ids) - len(results)
         return results
 
+    def false_drop_rate(self) -> float:
+        """
+        Share of the non-matching documents that passed the signature test, over all searches so far.
+        """
+        return self.false_drops / self.non_matching if self.non_matching else 0.0
+
     def __str__(self):
         return 'Boolean Model (Signatures)'
-    
+
 
 class VectorSpaceModel(RetrievalModel):
-    def __init__(self):
+    def __init__(self, scorer: scoring.Scorer = None, statistics: scoring.CollectionStatistics = None):
         self.inverted_index = defaultdict(list)
         self.document_lengths = {}
+        self.max_weights = {}
+        self.scorer = scorer  # None: the stored tf-idf weights and query_to_vector() are used
+        self.statistics = statistics
 
-    def build_inverted_index(self, documents: list[Document]):
-        document_frequency = defaultdict(int)
+    @instrumentation.timed('index_build')
+    def build_inverted_index(self, documents: list[Document], stopword_filtering=False, stemming=False):
+        term_counts = defaultdict(list)
+        document_ids = []
 
         for document in documents:
             term_count = defaultdict(int)
-            for term in document.terms:
+            for term in self.document_to_representation(document, stopword_filtering, stemming):
                 term_count[term] += 1
             document_id = document.document_id
-            self.document_lengths[document_id] = 0
+            document_ids.append(document_id)
             for term, count in term_count.items():
-                tf = 1 + math.log10(count)
-                self.inverted_index[term].append((document_id, tf))
-                document_frequency[term] += 1
-
-        num_documents = len(documents)
-        for term, postings in self.inverted_index.items():
-            idf = math.log10(num_documents / document_frequency[term])
-            for i, (doc_id, tf) in enumerate(postings):
-                tf_idf = tf * idf
-                self.inverted_index[term][i] = (doc_id, tf_idf)
+                term_counts[term].append((document_id, count))
+
+        self.build_from_term_counts(term_counts, document_ids)
+
+    def build_from_term_counts(self, term_counts: dict, document_ids: list):
+        """
+        Builds the collection statistics from raw term counts. Without a scorer, the tf-idf weighted index is
+        computed as well.
+        :param term_counts: Dictionary that maps each term to a list of (doc_id, number of occurrences) tuples
+        :param document_ids: IDs of all documents of the collection
+        """
+        self.statistics = scoring.CollectionStatistics(term_counts, document_ids)
+        self.inverted_index = defaultdict(list)
+        self.document_lengths = {}
+        self.max_weights = {}
+        if self.scorer is None:
+            self._build_weights(term_counts, document_ids)
+
+    def _build_weights(self, term_counts: dict, document_ids: list):
+        self.inverted_index = defaultdict(list)
+        self.document_lengths = {document_id: 0 for document_id in document_ids}
+        self.max_weights = {}
+
+        num_documents = len(document_ids)
+        for term, counts in term_counts.items():
+            idf = math.log10(num_documents / len(counts))
+            postings = self.inverted_index[term]
+            for doc_id, count in counts:
+                tf_idf = (1 + math.log10(count)) * idf
+                postings.append((doc_id, tf_idf))
                 self.document_lengths[doc_id] += tf_idf ** 2
+            postings.sort(key=lambda posting: posting[0])
+            self.max_weights[term] = max(weight for _, weight in postings)
 
         for doc_id in self.document_lengths:
             self.document_lengths[doc_id] = math.sqrt(self.document_lengths[doc_id])
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
-        pass
+        return representation.document_terms(document, stopword_filtering, stemming)
 
+    @instrumentation.timed('query_parse')
     def query_to_representation(self, query: str):
         return query.lower().split()
 
@@ -174,8 +363,31 @@ class VectorSpaceModel(RetrievalModel):
             query_vector[term] = tf * idf
         return query_vector
 
+    def set_scorer(self, scorer: scoring.Scorer = None):
+        """
+        Switches the scoring function. Uses the existing statistics, no re-indexing is necessary.
+        """
+        self.scorer = scorer
+        if scorer is None and not self.document_lengths and self.statistics is not None:
+            self._build_weights(self.statistics.postings, list(self.statistics.document_lengths))
+
+    def is_built(self) -> bool:
+        return bool(self.document_lengths) or self.statistics is not None
+
+    def top_k(self, query: str, k: int, stats: dict = None) -> list[tuple]:
+        if self.scorer is not None:
+            return scoring.top_k(self.statistics, self.scorer, self.query_to_representation(query), k, stats)
+        cursors = []
+        with instrumentation.timer('posting_fetch'):
+            for term, weight in self.query_to_vector(query).items():
+                if term in self.inverted_index:
+                    postings = self.inverted_index[term]
+                    instrumentation.count('postings_fetched', len(postings))
+                    cursors.append(topk.TermCursor(postings, weight, self.max_weights[term]))
+        return topk.maxscore_top_k(cursors, k, stats)
+
     def match(self, document_representation, query_representation) -> float:
         return 1.0 if any(term in document_representation for term in query_representation) else 0.0
 
     def __str__(self):
-        return 'Vector Space Model'
+        return f'Vector Space Model ({self.scorer})' if self.scorer is not None else 'Vector Space Model'
@@ -0,0 +1,154 @@
+import itertools
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import cleanup
+import extraction
+import models
+import porter
+import representation
+from document import Document
+
+# Settings of the current worker process, set once by _init_worker() instead of being pickled with every shard.
+_worker_normalizer = None
+_worker_representation = None
+_worker_stemming = False
+_worker_index_stopword_filtering = False
+_worker_index_stemming = False
+
+DEFAULT_SHARD_SIZE = 16
+
+
+class BuildResult(object):
+    def __init__(self):
+        self.documents = []  # processed documents, ordered by document id
+        self.inverted_index = defaultdict(set)  # term -> document ids, for the Boolean models
+        self.term_counts = defaultdict(list)  # term -> [(doc_id, count)], for the VSM
+        self.document_frequency = defaultdict(int)  # term -> number of documents containing the term
+
+    def merge(self, partial: 'BuildResult'):
+        self.documents.extend(partial.documents)
+        for term, doc_ids in partial.inverted_index.items():
+            self.inverted_index[term].update(doc_ids)
+        for term, counts in partial.term_counts.items():
+            self.term_counts[term].extend(counts)
+            self.document_frequency[term] += partial.document_frequency[term]
+
+    def to_inverted_list_model(self) -> models.InvertedListBooleanModel:
+        model = models.InvertedListBooleanModel()
+        model.inverted_index = {term: sorted(doc_ids) for term, doc_ids in self.inverted_index.items()}
+        model.document_ids = [document.document_id for document in self.documents]
+        return model
+
+    def to_vector_space_model(self) -> models.VectorSpaceModel:
+        model = models.VectorSpaceModel()
+        model.build_from_term_counts(self.term_counts, [document.document_id for document in self.documents])
+        return model
+
+
+def _init_worker(stop_word_list, stemming, index_stopword_filtering, index_stemming):
+    global _worker_normalizer, _worker_representation, _worker_stemming
+    global _worker_index_stopword_filtering, _worker_index_stemming
+    _worker_representation = representation.RepresentationPipeline(stop_word_list or ())
+    _worker_normalizer = _worker_representation.normalizer if stop_word_list is not None else None
+    _worker_stemming = stemming
+    _worker_index_stopword_filtering = index_stopword_filtering
+    _worker_index_stemming = index_stemming
+
+
+def _process_document(document_id: int, fable: list[str]) -> Document:
+    document = extraction.create_document(document_id, fable)
+    if _worker_normalizer is not None:
+        document.filtered_term_ids = _worker_normalizer.filter_term_ids(document.term_ids)
+    if _worker_stemming:
+        porter.stem_all_documents([document])
+    return document
+
+
+def _add_document(partial: BuildResult, document: Document, representation_pipeline, stopword_filtering, stemming):
+    partial.documents.append(document)
+    document_id = document.document_id
+
+    term_count = defaultdict(int)
+    for term in representation_pipeline.terms(document, stopword_filtering, stemming):
+        term_count[term] += 1
+    for term, count in term_count.items():
+        partial.inverted_index[term].add(document_id)
+        partial.term_counts[term].append((document_id, count))
+        partial.document_frequency[term] += 1
+
+
+def _process_shard(shard: list[tuple[int, list[str]]]) -> BuildResult:
+    """
+    Map step: runs all per-document stages on one shard and builds the partial indexes of the shard.
+    """
+    partial = BuildResult()
+    for document_id, fable in shard:
+        _add_document(partial, _process_document(document_id, fable), _worker_representation,
+                      _worker_index_stopword_filtering, _worker_index_stemming)
+    return partial
+
+
+def _iter_shards(fables, shard_size: int):
+    fables = iter(fables)
+    while shard := list(itertools.islice(fables, shard_size)):
+        yield shard
+
+
+def iter_documents(source_file_path: str, stop_word_list: list[str] = None, stemming=False):
+    """
+    Serial, streaming document source, used by build_collection() with one worker. Documents are extracted, filtered
+    and stemmed one at a time while they are consumed, e.g. by an index build, so only the current fable of the source
+    file is held in memory.
+    :param source_file_path: File that contains the fables
+    :param stop_word_list: If given, stop words are filtered into document.filtered_terms
+    :param stemming: Whether document.stemmed_terms should be computed
+    :return: Generator of Document objects
+    """
+    documents = extraction.iter_collection(source_file_path)
+    if stop_word_list is not None:
+        documents = cleanup.iter_filter_collection(documents, stop_word_list)
+    if stemming:
+        documents = porter.iter_stem_documents(documents)
+    return documents
+
+
+def build_collection(source_file_path: str, stop_word_list: list[str] = None, stemming=False,
+                     index_stopword_filtering=False, index_stemming=False, workers=None,
+                     shard_size=None) -> BuildResult:
+    """
+    Builds the collection and its indexes map-reduce style: the source file is streamed into shards of fables, the
+    shards are sent to a process pool that extracts, cleans, filters and stems the documents and builds partial
+    inverted indexes and document frequencies, and the partial results are merged in document order as they arrive. At most two shards per
+    worker are read ahead, so the raw text of the source file is never held in memory as a whole. With one worker the
+    documents come from iter_documents() and are indexed as they are produced.
+    :param source_file_path: File that contains the fables
+    :param stop_word_list: If given, stop words are filtered into document.filtered_terms
+    :param stemming: Whether document.stemmed_terms should be computed
+    :param index_stopword_filtering: Representation of the merged inverted index and document frequencies
+    :param index_stemming: Representation of the merged inverted index and document frequencies
+    :param workers: Number of worker processes (default: number of CPUs). With 1 no pool is started.
+    :param shard_size: Number of documents per shard (default: DEFAULT_SHARD_SIZE)
+    :return: BuildResult with the documents and the merged indexes
+    """
+    workers = workers or os.cpu_count() or 1
+    settings = (stop_word_list, stemming, index_stopword_filtering, index_stemming)
+
+    result = BuildResult()
+    if workers == 1:
+        # The worker globals are left alone, the serial build runs in the calling process.
+        representation_pipeline = representation.RepresentationPipeline(stop_word_list or ())
+        for document in iter_documents(source_file_path, stop_word_list, stemming):
+            _add_document(result, document, representation_pipeline, index_stopword_filtering, index_stemming)
+        return result
+
+    shards = _iter_shards(extraction.iter_split_collection(source_file_path), shard_size or DEFAULT_SHARD_SIZE)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=settings) as executor:
+        in_flight = deque()
+        for shard in shards:
+            in_flight.append(executor.submit(_process_shard, shard))
+            if len(in_flight) >= 2 * workers:
+                result.merge(in_flight.popleft().result())
+        while in_flight:
+            result.merge(in_flight.popleft().result())
+    return result
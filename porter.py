@@ -1,5 +1,10 @@
-import re
-from document import Document
+import threading
+from collections import OrderedDict
+from array import array
+from document import Document, TERM_ID_TYPE, vocabulary
+import query_parser
+
+_VOWELS = frozenset('aeiouy')
 
 def get_measure(term: str) -> int:
     """
@@ -7,9 +12,14 @@ def get_measure(term: str) -> int:
     :param term: Given term/word
     :return: Measure value m
     """
-    form = re.sub(r'[^aeiouy]+', 'C', term)
-    form = re.sub(r'[aeiouy]+', 'V', form)
-    return form.count('VC')
+    measure = 0
+    previous_is_vowel = False
+    for char in term:
+        is_vowel = char in _VOWELS
+        if previous_is_vowel and not is_vowel:
+            measure += 1
+        previous_is_vowel = is_vowel
+    return measure
 
 def condition_v(stem: str) -> bool:
     """
@@ -17,7 +27,7 @@ def condition_v(stem: str) -> bool:
     :param stem: Word stem to check
     :return: True if the condition *v* holds
     """
-    return bool(re.search(r'[aeiouy]', stem))
+    return any(char in _VOWELS for char in stem)
 
 def condition_d(stem: str) -> bool:
     """
@@ -36,6 +46,21 @@ def cond_o(stem: str) -> bool:
     """
     return len(stem) >= 3 and stem[-3] not in 'aeiou' and stem[-2] in 'aeiou' and stem[-1] not in 'aeiouwx'
 
+STEP2_SUFFIXES = {
+    'ational': 'ate', 'tional': 'tion', 'enci': 'ence', 'anci': 'ance', 'izer': 'ize', 'abli': 'able', 'alli': 'al',
+    'entli': 'ent', 'eli': 'e', 'ousli': 'ous', 'ization': 'ize', 'ation': 'ate', 'ator': 'ate', 'alism': 'al',
+    'iveness': 'ive', 'fulness': 'ful', 'ousness': 'ous', 'aliti': 'al', 'iviti': 'ive', 'biliti': 'ble'
+}
+
+STEP3_SUFFIXES = {
+    'icate': 'ic', 'ative': '', 'alize': 'al', 'iciti': 'ic', 'ical': 'ic', 'ful': '', 'ness': ''
+}
+
+STEP4_SUFFIXES = [
+    'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment', 'ent', 'ion', 'ou', 'ism', 'ate', 'iti',
+    'ous', 'ive', 'ize'
+]
+
 def stem_term(term: str) -> str:
     """
     Stems a given term of the English language using the Porter stemming algorithm.
@@ -86,12 +111,7 @@ def stem_term(term: str) -> str:
             term = base + 'i'
 
 
-    step2_suffixes = {
-        'ational': 'ate', 'tional': 'tion', 'enci': 'ence', 'anci': 'ance', 'izer': 'ize', 'abli': 'able', 'alli': 'al',
-        'entli': 'ent', 'eli': 'e', 'ousli': 'ous', 'ization': 'ize', 'ation': 'ate', 'ator': 'ate', 'alism': 'al',
-        'iveness': 'ive', 'fulness': 'ful', 'ousness': 'ous', 'aliti': 'al', 'iviti': 'ive', 'biliti': 'ble'
-    }
-    for suffix, replacement in step2_suffixes.items():
+    for suffix, replacement in STEP2_SUFFIXES.items():
         if term.endswith(suffix):
             base = term[:-len(suffix)]
             if get_measure(base) > 0:
@@ -99,10 +119,7 @@ def stem_term(term: str) -> str:
             break
 
  
-    step3_suffixes = {
-        'icate': 'ic', 'ative': '', 'alize': 'al', 'iciti': 'ic', 'ical': 'ic', 'ful': '', 'ness': ''
-    }
-    for suffix, replacement in step3_suffixes.items():
+    for suffix, replacement in STEP3_SUFFIXES.items():
         if term.endswith(suffix):
             base = term[:-len(suffix)]
             if get_measure(base) > 0:
@@ -110,11 +127,7 @@ def stem_term(term: str) -> str:
             break
 
  
-    step4_suffixes = [
-        'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment', 'ent', 'ion', 'ou', 'ism', 'ate', 'iti',
-        'ous', 'ive', 'ize'
-    ]
-    for suffix in step4_suffixes:
+    for suffix in STEP4_SUFFIXES:
         if term.endswith(suffix):
             base = term[:-len(suffix)]
             if get_measure(base) > 1:
@@ -135,6 +148,101 @@ def stem_term(term: str) -> str:
 
     return term
 
+class StemCache(object):
+    """
+    Size-bounded LRU cache for stem_term(). Term frequencies follow Zipf's law, so a small cache answers most lookups
+    of a collection or query stream. hits and misses count the lookups since creation or the last clear().
+    The cache is shared by the threads of a search service, so it is locked; stems are computed outside the lock.
+    """
+
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._stems = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stem(self, term: str) -> str:
+        return self.get(term, stem_term)
+
+    def get(self, key, compute):
+        """
+        Returns the cached stem of key, or computes it with compute(key) and caches it.
+        """
+        with self._lock:
+            stem = self._stems.get(key)
+            if stem is not None:
+                self.hits += 1
+                self._stems.move_to_end(key)
+                return stem
+            self.misses += 1
+
+        stem = compute(key)
+        self._insert({key: stem})
+        return stem
+
+    def get_many(self, keys, compute) -> dict:
+        """
+        Like get() for several distinct keys, with one lock acquisition for all cached ones.
+        :return: Dictionary key -> stem
+        """
+        stems = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                stem = self._stems.get(key)
+                if stem is not None:
+                    self._stems.move_to_end(key)
+                    stems[key] = stem
+                else:
+                    missing.append(key)
+            self.hits += len(stems)
+            self.misses += len(missing)
+
+        computed = {key: compute(key) for key in missing}
+        self._insert(computed)
+        stems.update(computed)
+        return stems
+
+    def _insert(self, stems: dict):
+        with self._lock:
+            self._stems.update(stems)
+            while len(self._stems) > self.max_size:
+                self._stems.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._stems.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._stems)
+
+stem_cache = StemCache()
+
+def stem_term_cached(term: str) -> str:
+    """
+    Same result as stem_term(), but answered from the module-wide stem_cache where possible.
+    """
+    return stem_cache.stem(term)
+
+stem_id_cache = StemCache()  # term id -> id of the stem, in the shared vocabulary
+
+def _stem_id(term_id: int) -> int:
+    return vocabulary.id(stem_term_cached(vocabulary.terms[term_id]))
+
+def stem_term_ids(term_ids) -> array:
+    """
+    Stems term ids of the shared vocabulary. Stem ids are answered from the module-wide stem_id_cache where possible.
+    """
+    stem_ids = stem_id_cache.get_many(dict.fromkeys(term_ids), _stem_id)
+    return array(TERM_ID_TYPE, map(stem_ids.__getitem__, term_ids))
+
 def stem_all_documents(collection: list[Document]):
     """
     For each document in the given collection, this method uses the stem_term() function on all terms in its term list.
@@ -142,7 +250,27 @@ def stem_all_documents(collection: list[Document]):
     :param collection: Document collection to process
     """
     for document in collection:
-        document.stemmed_terms = [stem_term(term) for term in document.terms]
+        document.stemmed_term_ids = stem_term_ids(document.term_ids)
+
+def iter_stem_documents(documents):
+    """
+    Lazy variant of stem_all_documents(): stems the terms of each document as it is consumed.
+    :param documents: Iterable of Document objects, e.g. extraction.iter_collection()
+    :return: Generator of the processed documents
+    """
+    for document in documents:
+        document.stemmed_term_ids = stem_term_ids(document.term_ids)
+        yield document
+
+def _stem_query_token(token: str) -> str:
+    # Boolean operators stay as they are; parentheses and quotes around a term are kept, the term itself is stemmed.
+    if query_parser.is_operator(token):
+        return token
+    core = token.lstrip('("').rstrip(')"')
+    if not core:
+        return token
+    start = token.index(core)
+    return token[:start] + stem_term_cached(core) + token[start + len(core):]
 
 def stem_query_terms(query: str) -> str:
     """
@@ -151,5 +279,5 @@ def stem_query_terms(query: str) -> str:
     :return: Query with stemmed terms
     """
     terms = query.split()
-    stemmed_terms = [stem_term(term) for term in terms]
+    stemmed_terms = [_stem_query_token(term) for term in terms]
     return ' '.join(stemmed_terms)
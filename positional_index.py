@@ -0,0 +1,171 @@
+import sys
+from collections import defaultdict
+from document import Document
+from index_storage import encode_vbyte, decode_vbyte, encode_postings
+from query_parser import gallop_intersect
+
+
+def encode_positions(positions: list[int]) -> bytes:
+    gaps = []
+    previous = 0
+    for position in positions:
+        gaps.append(position - previous)
+        previous = position
+    return encode_vbyte(gaps)
+
+
+def decode_positions(data: bytes) -> list[int]:
+    positions = decode_vbyte(data)
+    for i in range(1, len(positions)):
+        positions[i] += positions[i - 1]
+    return positions
+
+
+def _shifted_intersection(left: list[int], right: list[int], shift: int) -> list[int]:
+    """
+    Returns the positions p of left for which p + shift is in right. Both lists are sorted.
+    """
+    result = []
+    j = 0
+    for position in left:
+        target = position + shift
+        while j < len(right) and right[j] < target:
+            j += 1
+        if j == len(right):
+            break
+        if right[j] == target:
+            result.append(position)
+    return result
+
+
+def _within(left: list[int], right: list[int], distance: int) -> bool:
+    """
+    Returns whether a position of left and a position of right are at most distance apart.
+    """
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if abs(left[i] - right[j]) <= distance:
+            return True
+        if left[i] < right[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+class PositionalIndex(object):
+    """
+    Inverted index whose postings also hold the positions of a term in the document. For every term the document ids
+    are kept in a sorted list, the positions of each document as variable-byte encoded gaps next to it.
+    Supports exact phrase queries and NEAR/k proximity queries.
+    """
+
+    def __init__(self):
+        self.doc_ids = {}  # term -> sorted list of document ids
+        self.positions = {}  # term -> list of encoded position lists, parallel to doc_ids[term]
+
+    def build(self, documents: list[Document], representation=None):
+        """
+        :param documents: Documents to index
+        :param representation: Function document -> list of terms, default: document.terms
+        """
+        collected = defaultdict(dict)  # term -> doc_id -> positions
+        for document in documents:
+            terms = representation(document) if representation is not None else document.terms
+            for position, term in enumerate(terms):
+                collected[term].setdefault(document.document_id, []).append(position)
+
+        self.doc_ids = {}
+        self.positions = {}
+        for term, documents_positions in collected.items():
+            doc_ids = sorted(documents_positions)
+            self.doc_ids[term] = doc_ids
+            self.positions[term] = [encode_positions(documents_positions[doc_id]) for doc_id in doc_ids]
+
+    def postings(self, term: str) -> list[int]:
+        return self.doc_ids.get(term, [])
+
+    def document_frequency(self, term: str) -> int:
+        return len(self.doc_ids.get(term, ()))
+
+    def term_positions(self, term: str, doc_id: int) -> list[int]:
+        doc_ids = self.doc_ids.get(term)
+        if not doc_ids:
+            return []
+        low, high = 0, len(doc_ids)
+        while low < high:
+            middle = (low + high) // 2
+            if doc_ids[middle] < doc_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(doc_ids) and doc_ids[low] == doc_id:
+            return decode_positions(self.positions[term][low])
+        return []
+
+    def _candidates(self, terms: list[str]) -> list[int]:
+        ordered = sorted(set(terms), key=self.document_frequency)
+        candidates = self.postings(ordered[0])
+        for term in ordered[1:]:
+            if not candidates:
+                break
+            candidates = gallop_intersect(candidates, self.postings(term))
+        return candidates
+
+    def phrase_postings(self, terms: list[str]) -> list[int]:
+        """
+        Returns the ids of all documents that contain the terms as an exact phrase. Documents are first intersected
+        on their ids; then the positions of the rarest terms are intersected first, shifted by their offset in the
+        phrase, so most candidates are rejected after decoding two short position lists.
+        """
+        if not terms:
+            return []
+        offsets = sorted(range(len(terms)), key=lambda i: self.document_frequency(terms[i]))
+        result = []
+        for doc_id in self._candidates(terms):
+            first = offsets[0]
+            starts = [p - first for p in self.term_positions(terms[first], doc_id)]
+            for offset in offsets[1:]:
+                starts = _shifted_intersection(starts, self.term_positions(terms[offset], doc_id), offset)
+                if not starts:
+                    break
+            if starts:
+                result.append(doc_id)
+        return result
+
+    def near_postings(self, left: str, right: str, distance: int) -> list[int]:
+        """
+        Returns the ids of all documents in which the two terms occur at most distance positions apart (in any order).
+        """
+        return [
+            doc_id
+            for doc_id in self._candidates([left, right])
+            if _within(self.term_positions(left, doc_id), self.term_positions(right, doc_id), distance)
+        ]
+
+    def memory_report(self) -> dict:
+        """
+        Compares the size of the positional index with a non-positional index over the same postings.
+        Encoded sizes count the variable-byte data only; in-memory sizes include the Python objects.
+        """
+        doc_id_bytes = sum(len(encode_postings(doc_ids)) for doc_ids in self.doc_ids.values())
+        position_bytes = sum(len(data) for position_lists in self.positions.values() for data in position_lists)
+        doc_id_objects = sum(
+            sys.getsizeof(term) + sys.getsizeof(doc_ids) + sum(sys.getsizeof(doc_id) for doc_id in doc_ids)
+            for term, doc_ids in self.doc_ids.items()
+        )
+        position_objects = sum(
+            sys.getsizeof(position_lists) + sum(sys.getsizeof(data) for data in position_lists)
+            for position_lists in self.positions.values()
+        )
+        return {
+            'terms': len(self.doc_ids),
+            'postings': sum(len(doc_ids) for doc_ids in self.doc_ids.values()),
+            'positions': sum(len(decode_vbyte(data)) for lists in self.positions.values() for data in lists),
+            'non_positional_encoded_bytes': doc_id_bytes,
+            'positional_encoded_bytes': doc_id_bytes + position_bytes,
+            'encoded_ratio': (doc_id_bytes + position_bytes) / doc_id_bytes if doc_id_bytes else 0.0,
+            'non_positional_memory_bytes': doc_id_objects,
+            'positional_memory_bytes': doc_id_objects + position_objects,
+            'memory_ratio': (doc_id_objects + position_objects) / doc_id_objects if doc_id_objects else 0.0,
+        }
@@ -0,0 +1,182 @@
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from index_storage import DiskInvertedIndex
+
+_MAX_COUNT = 15  # counters saturate like the 4-bit counters of the original TinyLFU
+
+
+class FrequencySketch(object):
+    """
+    Count-min sketch that estimates how often a key was accessed recently. After sample_size increments all counters
+    are halved, so the estimates follow changes in the workload instead of growing forever (TinyLFU aging).
+    """
+
+    def __init__(self, width: int, depth=4):
+        self.width = 1 << max(width - 1, 1).bit_length()  # power of two, so positions are a bit mask
+        self.depth = depth
+        self.sample_size = 10 * self.width
+        self.additions = 0
+        self._counters = [bytearray(self.width) for _ in range(depth)]
+
+    def _positions(self, key):
+        h = hash(key)
+        step = (h >> 16) | 1
+        mask = self.width - 1
+        return [(h + i * step) & mask for i in range(self.depth)]
+
+    def increment(self, key):
+        for row, position in zip(self._counters, self._positions(key)):
+            if row[position] < _MAX_COUNT:
+                row[position] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._age()
+
+    def frequency(self, key) -> int:
+        return min(row[position] for row, position in zip(self._counters, self._positions(key)))
+
+    def _age(self):
+        for i, row in enumerate(self._counters):
+            self._counters[i] = bytearray(count >> 1 for count in row)
+        self.additions //= 2
+
+
+def postings_size(postings: list) -> int:
+    """
+    Approximate memory footprint of a decoded posting list in bytes, including the elements.
+    """
+    return sys.getsizeof(postings) + sum(sys.getsizeof(posting) for posting in postings)
+
+
+class CachedInvertedIndex(Mapping):
+    """
+    Keeps decoded posting lists of a DiskInvertedIndex in memory, up to max_bytes.
+    Entries are evicted in LRU order, but a newly decoded list is only admitted if the frequency sketch estimates it
+    was requested more often than every entry it would evict (TinyLFU admission). A burst of rare terms therefore
+    cannot push the hot working set out of memory; cold terms are decoded from disk on every access.
+    Returned lists are shared with the cache and must not be modified. Lookups are thread-safe; posting lists are
+    decoded outside the lock.
+    Per-term hit and miss counts are kept for the first max_tracked_terms distinct terms of the index that are
+    requested; terms that are not in the index are never tracked.
+    """
+
+    def __init__(self, index: DiskInvertedIndex, max_bytes=8 * 1024 * 1024, max_tracked_terms=10000):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.sketch = FrequencySketch(max(max_bytes // 512, 256))
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self.max_tracked_terms = max_tracked_terms
+        self._term_counts = {}  # term -> [hits, misses]
+        self._entries = OrderedDict()  # (term, with frequencies) -> (postings, size)
+        self._lock = threading.Lock()
+
+        self.file_path = index.file_path
+        self.num_terms = index.num_terms
+        self.num_documents = index.num_documents
+        self.stopword_filtering = index.stopword_filtering
+        self.stemming = index.stemming
+        self.frequencies = index.frequencies
+
+    def _lookup(self, key: tuple, decode) -> list:
+        term = key[0]
+        with self._lock:
+            self.sketch.increment(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                if entry[0]:
+                    self._count(term, 0)
+                self._entries.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+
+        postings = decode(term)
+        with self._lock:
+            if postings:  # only terms of the index, so requests for unknown terms cannot grow the counts
+                self._count(term, 1)
+            if key not in self._entries:  # another thread may have admitted it meanwhile
+                self._admit(key, postings)
+        return postings
+
+    def _count(self, term: str, outcome: int):
+        counts = self._term_counts.get(term)
+        if counts is None:
+            if len(self._term_counts) >= self.max_tracked_terms:
+                return
+            counts = self._term_counts[term] = [0, 0]
+        counts[outcome] += 1
+
+    def _admit(self, key: tuple, postings: list):
+        size = postings_size(postings)
+        if size > self.max_bytes:
+            self.rejections += 1
+            return
+
+        victims = []
+        free = self.max_bytes - self.used_bytes
+        if free < size:
+            frequency = self.sketch.frequency(key)
+            for victim, (_, victim_size) in self._entries.items():
+                if self.sketch.frequency(victim) >= frequency:
+                    self.rejections += 1
+                    return
+                victims.append(victim)
+                free += victim_size
+                if free >= size:
+                    break
+
+        for victim in victims:
+            self.used_bytes -= self._entries.pop(victim)[1]
+        self._entries[key] = (postings, size)
+        self.used_bytes += size
+
+    def __getitem__(self, term: str) -> list[int]:
+        return self._lookup((term, False), self.index.__getitem__)
+
+    def postings_with_frequencies(self, term: str) -> list[tuple[int, int]]:
+        return self._lookup((term, True), self.index.postings_with_frequencies)
+
+    def document_frequency(self, term: str) -> int:
+        return self.index.document_frequency(term)
+
+    def __contains__(self, term) -> bool:
+        return term in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def term_statistics(self, n=10) -> list[tuple[str, int, int]]:
+        """
+        :return: (term, hits, misses) of the n most requested terms, most requested first
+        """
+        with self._lock:
+            term_counts = [(term, hits, misses) for term, (hits, misses) in self._term_counts.items()]
+        term_counts.sort(key=lambda entry: (-(entry[1] + entry[2]), entry[0]))
+        return term_counts[:n]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def close(self):
+        self.clear()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,357 @@
+import heapq
+import re
+import instrumentation
+
+# Grammar (operators are upper case, everything else is a term):
+#   query   := or      with adjacent expressions being OR-ed like before
+#   or      := and ('OR'? and)*
+#   and     := unary ('AND' unary)*
+#   unary   := 'NOT' unary | near
+#   near    := primary ('NEAR/k' primary)?     both operands single terms, k = maximum distance in positions
+#   primary := '(' or ')' | '"' term+ '"' | term
+OPERATORS = ('AND', 'OR', 'NOT')
+_TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"?|[^\s()"]+')
+_NEAR_PATTERN = re.compile(r'NEAR/(\d+)$')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class Term(object):
+    def __init__(self, term: str):
+        self.term = term
+
+    def matches(self, terms: list[str], term_set: set) -> bool:
+        return self.term in term_set
+
+    def __repr__(self):
+        return f'Term({self.term!r})'
+
+
+class Phrase(object):
+    def __init__(self, terms: list[str]):
+        self.terms = terms
+
+    def matches(self, terms: list[str], term_set: set) -> bool:
+        length = len(self.terms)
+        return any(terms[i:i + length] == self.terms for i in range(len(terms) - length + 1))
+
+    def __repr__(self):
+        return f'Phrase({self.terms!r})'
+
+
+class Near(object):
+    def __init__(self, left: str, right: str, distance: int):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def matches(self, terms: list[str], term_set: set) -> bool:
+        left_positions = [i for i, term in enumerate(terms) if term == self.left]
+        right_positions = [i for i, term in enumerate(terms) if term == self.right]
+        return any(abs(i - j) <= self.distance for i in left_positions for j in right_positions)
+
+    def __repr__(self):
+        return f'Near({self.left!r}, {self.right!r}, {self.distance})'
+
+
+class And(object):
+    def __init__(self, children: list):
+        self.children = children
+
+    def matches(self, terms: list[str], term_set: set) -> bool:
+        return all(child.matches(terms, term_set) for child in self.children)
+
+    def __repr__(self):
+        return f'And({self.children!r})'
+
+
+class Or(object):
+    def __init__(self, children: list):
+        self.children = children
+
+    def matches(self, terms: list[str], term_set: set) -> bool:
+        return any(child.matches(terms, term_set) for child in self.children)
+
+    def __repr__(self):
+        return f'Or({self.children!r})'
+
+
+class Not(object):
+    def __init__(self, child):
+        self.child = child
+
+    def matches(self, terms: list[str], term_set: set) -> bool:
+        return not self.child.matches(terms, term_set)
+
+    def __repr__(self):
+        return f'Not({self.child!r})'
+
+
+def tokenize(query: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(query)
+
+
+def is_operator(token: str) -> bool:
+    return token in OPERATORS or _NEAR_PATTERN.match(token) is not None
+
+
+@instrumentation.timed('query_parse')
+def parse_query(query: str, term_transform=None):
+    """
+    Parses a Boolean query with AND, OR, NOT, NEAR/k, parentheses and "phrases". Terms are lower cased and passed
+    through term_transform (e.g. a stemmer) if given.
+    :return: Root node of the query tree, or None for an empty query
+    :raises QuerySyntaxError: if the query is malformed
+    """
+    tokens = tokenize(query)
+    position = 0
+
+    def normalize(term: str) -> str:
+        term = term.lower()
+        return term_transform(term) if term_transform is not None else term
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() is not None and peek() != ')':
+            if peek() == 'OR':
+                advance()
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and():
+        children = [parse_unary()]
+        while peek() == 'AND':
+            advance()
+            children.append(parse_unary())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_unary():
+        if peek() == 'NOT':
+            advance()
+            return Not(parse_unary())
+        return parse_near()
+
+    def parse_near():
+        left = parse_primary()
+        match = _NEAR_PATTERN.match(peek() or '')
+        if match is None:
+            return left
+        advance()
+        right = parse_primary()
+        if not isinstance(left, Term) or not isinstance(right, Term) or _NEAR_PATTERN.match(peek() or ''):
+            raise QuerySyntaxError(f'NEAR needs a single term on each side in query {query!r}')
+        return Near(left.term, right.term, int(match.group(1)))
+
+    def parse_primary():
+        token = peek()
+        if token is None or token in (')', 'AND', 'OR') or _NEAR_PATTERN.match(token):
+            raise QuerySyntaxError(f'Unexpected {token or "end of query"!r} in query {query!r}')
+        advance()
+        if token == '(':
+            node = parse_or()
+            if peek() != ')':
+                raise QuerySyntaxError(f'Missing closing parenthesis in query {query!r}')
+            advance()
+            return node
+        if token.startswith('"'):
+            terms = [normalize(term) for term in token.strip('"').split()]
+            if not terms:
+                raise QuerySyntaxError(f'Empty phrase in query {query!r}')
+            return Term(terms[0]) if len(terms) == 1 else Phrase(terms)
+        return Term(normalize(token))
+
+    def advance():
+        nonlocal position
+        position += 1
+
+    if not tokens:
+        return None
+    node = parse_or()
+    if position != len(tokens):
+        raise QuerySyntaxError(f'Unexpected {tokens[position]!r} in query {query!r}')
+    return node
+
+
+def query_terms(node) -> list[str]:
+    """
+    Returns all terms of a query tree, including negated ones, in query order.
+    """
+    if node is None:
+        return []
+    if isinstance(node, Term):
+        return [node.term]
+    if isinstance(node, Phrase):
+        return list(node.terms)
+    if isinstance(node, Near):
+        return [node.left, node.right]
+    if isinstance(node, Not):
+        return query_terms(node.child)
+    return [term for child in node.children for term in query_terms(child)]
+
+
+def needs_positions(node) -> bool:
+    """
+    Returns whether a query tree contains phrases or NEAR operators, which need term positions to be evaluated.
+    """
+    if isinstance(node, (Phrase, Near)):
+        return True
+    if isinstance(node, Not):
+        return needs_positions(node.child)
+    return any(needs_positions(child) for child in getattr(node, 'children', ()))
+
+
+def gallop_intersect(small: list[int], large: list[int]) -> list[int]:
+    """
+    Intersects two sorted lists. For every element of the smaller list the larger one is searched with an exponential
+    (galloping) search starting at the previous match, so the cost is O(|small| * log(|large| / |small|)).
+    """
+    result = []
+    low = 0
+    size = len(large)
+    for value in small:
+        step = 1
+        high = low
+        while high < size and large[high] < value:
+            low = high + 1
+            high += step
+            step *= 2
+        high = min(high, size)
+        while low < high:  # binary search in large[low:high+1]
+            middle = (low + high) // 2
+            if large[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low >= size:
+            break
+        if large[low] == value:
+            result.append(value)
+            low += 1
+    return result
+
+
+def union(lists: list[list[int]]) -> list[int]:
+    result = []
+    for value in heapq.merge(*lists):
+        if not result or result[-1] != value:
+            result.append(value)
+    return result
+
+
+def difference(left: list[int], right: list[int]) -> list[int]:
+    if not right:
+        return left
+    remove = set(right)
+    return [value for value in left if value not in remove]
+
+
+class QueryPlanner(object):
+    """
+    Executes query trees over sorted posting lists.
+    Conjunctions are evaluated cheapest operand first (by document frequency, without decoding any postings),
+    intersected with galloping search and stopped as soon as the intermediate result is empty; negated operands
+    are subtracted at the end, so they are only fetched if something is left to subtract from.
+    :param postings: Function term -> sorted list of doc ids
+    :param document_frequency: Function term -> length of the posting list
+    :param all_doc_ids: Function returning the sorted ids of all documents (needed for pure negations)
+    :param phrase_postings: Optional function list of terms -> sorted doc ids that contain the phrase, e.g. from a
+                            PositionalIndex. Without it, phrases are evaluated with verify_phrase on the candidates
+                            of the conjunction.
+    :param verify_phrase: Function (doc_id, list of terms) -> bool
+    :param near_postings: Optional function (left, right, distance) -> sorted doc ids, analogous to phrase_postings
+    :param verify_near: Function (doc_id, left, right, distance) -> bool
+    A phrase or NEAR node without either of its functions raises ValueError.
+    """
+
+    def __init__(self, postings, document_frequency, all_doc_ids, phrase_postings=None, verify_phrase=None,
+                 near_postings=None, verify_near=None):
+        self.postings = postings
+        self.document_frequency = document_frequency
+        self.all_doc_ids = all_doc_ids
+        self.phrase_postings = phrase_postings
+        self.verify_phrase = verify_phrase
+        self.near_postings = near_postings
+        self.verify_near = verify_near
+        self.postings_fetched = 0
+
+    def execute(self, node) -> list[int]:
+        if node is None:
+            return []
+        return self._evaluate(node)
+
+    def _fetch(self, term: str) -> list[int]:
+        with instrumentation.timer('posting_fetch'):
+            doc_ids = self.postings(term)
+        self.postings_fetched += len(doc_ids)
+        instrumentation.count('postings_fetched', len(doc_ids))
+        return doc_ids
+
+    def estimate(self, node) -> int:
+        """
+        Upper bound for the number of results of a node.
+        """
+        if isinstance(node, Term):
+            return self.document_frequency(node.term)
+        if isinstance(node, Phrase):
+            return min(self.document_frequency(term) for term in node.terms)
+        if isinstance(node, Near):
+            return min(self.document_frequency(node.left), self.document_frequency(node.right))
+        if isinstance(node, And):
+            positive = [self.estimate(child) for child in node.children if not isinstance(child, Not)]
+            return min(positive) if positive else len(self.all_doc_ids())
+        if isinstance(node, Or):
+            return sum(self.estimate(child) for child in node.children)
+        return len(self.all_doc_ids())
+
+    def _evaluate(self, node) -> list[int]:
+        if isinstance(node, Term):
+            return self._fetch(node.term)
+        if isinstance(node, Phrase):
+            return self._evaluate_phrase(node)
+        if isinstance(node, Near):
+            return self._evaluate_near(node)
+        if isinstance(node, Or):
+            return union([self._evaluate(child) for child in node.children])
+        if isinstance(node, Not):
+            return difference(self.all_doc_ids(), self._evaluate(node.child))
+        return self._evaluate_and(node.children)
+
+    def _evaluate_and(self, children: list) -> list[int]:
+        positive = sorted((child for child in children if not isinstance(child, Not)), key=self.estimate)
+        negative = [child.child for child in children if isinstance(child, Not)]
+
+        result = self._evaluate(positive[0]) if positive else self.all_doc_ids()
+        for child in positive[1:]:
+            if not result:
+                return []
+            result = self._intersect(result, self._evaluate(child))
+        for child in negative:
+            if not result:
+                return []
+            result = difference(result, self._evaluate(child))
+        return result
+
+    @staticmethod
+    def _intersect(a: list[int], b: list[int]) -> list[int]:
+        return gallop_intersect(a, b) if len(a) <= len(b) else gallop_intersect(b, a)
+
+    def _evaluate_phrase(self, node: Phrase) -> list[int]:
+        if self.phrase_postings is not None:
+            return self.phrase_postings(node.terms)
+        if self.verify_phrase is None:
+            raise ValueError('Phrase queries need a positional index or a phrase verifier')
+        candidates = self._evaluate_and([Term(term) for term in node.terms])
+        return [doc_id for doc_id in candidates if self.verify_phrase(doc_id, node.terms)]
+
+    def _evaluate_near(self, node: Near) -> list[int]:
+        if self.near_postings is not None:
+            return self.near_postings(node.left, node.right, node.distance)
+        if self.verify_near is None:
+            raise ValueError('NEAR queries need a positional index or a proximity verifier')
+        candidates = self._evaluate_and([Term(node.left), Term(node.right)])
+        return [doc_id for doc_id in candidates if self.verify_near(doc_id, node.left, node.right, node.distance)]
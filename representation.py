@@ -0,0 +1,60 @@
+from array import array
+import cleanup
+import instrumentation
+import porter
+from document import Document, vocabulary
+
+
+class RepresentationPipeline(object):
+    """
+    Derives the terms of a document for a search mode when they are first requested and caches their ids in the
+    document, so no work is spent on representations that no model uses. Stemming is applied after stop word
+    filtering: with both enabled the representation consists of the stems of the filtered terms.
+    """
+
+    def __init__(self, stop_word_list=()):
+        self.normalizer = cleanup.TextNormalizer(stop_word_list)
+
+    def term_ids(self, document: Document, stopword_filtering=False, stemming=False) -> array:
+        if stopword_filtering and stemming:
+            term_ids = document.filtered_stemmed_term_ids
+            if term_ids is None:
+                filtered_term_ids = self.term_ids(document, stopword_filtering=True)
+                with instrumentation.timer('stemming'):
+                    term_ids = porter.stem_term_ids(filtered_term_ids)
+                document.filtered_stemmed_term_ids = term_ids
+        elif stopword_filtering:
+            term_ids = document.filtered_term_ids
+            if term_ids is None:
+                with instrumentation.timer('cleanup'):
+                    term_ids = document.filtered_term_ids = self.normalizer.filter_term_ids(document.term_ids)
+        elif stemming:
+            term_ids = document.stemmed_term_ids
+            if term_ids is None:
+                with instrumentation.timer('stemming'):
+                    term_ids = document.stemmed_term_ids = porter.stem_term_ids(document.term_ids)
+        else:
+            term_ids = document.term_ids
+        return term_ids
+
+    def terms(self, document: Document, stopword_filtering=False, stemming=False) -> list[str]:
+        return vocabulary.decode(self.term_ids(document, stopword_filtering, stemming))
+
+    def set_stop_word_list(self, stop_word_list: list[str], documents=()):
+        """
+        Replaces the stop word list and drops the filtered representations of the given documents, which were
+        computed with the old list.
+        """
+        self.normalizer = cleanup.TextNormalizer(stop_word_list)
+        for document in documents:
+            document.filtered_term_ids = None
+            document.filtered_stemmed_term_ids = None
+
+
+default_pipeline = RepresentationPipeline()
+
+def document_terms(document: Document, stopword_filtering=False, stemming=False) -> list[str]:
+    """
+    Returns the terms of a document for a search mode, computed by the module-wide default_pipeline where necessary.
+    """
+    return default_pipeline.terms(document, stopword_filtering, stemming)
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query: str) -> str:
+    """
+    Collapses runs of whitespace, so queries that only differ in spacing share a cache entry. Case is kept because
+    the Boolean operators are case sensitive.
+    """
+    return ' '.join(query.split())
+
+
+class QueryResultCache(object):
+    """
+    Size-bounded LRU cache for search results. Entries are keyed by the normalized query, the model and the search
+    mode and belong to an index version; invalidate() starts a new version and drops all entries, which has to
+    happen whenever the collection or an index is rebuilt.
+    hits, misses and saved_seconds (the time the cached computations originally took) count the lookups since
+    creation or the last reset_statistics().
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()  # key -> (results, seconds it took to compute them)
+
+    @staticmethod
+    def key(query: str, model, stop_word_filtering: bool, stemming: bool, k: int) -> tuple:
+        return normalize_query(query), str(model), stop_word_filtering, stemming, k
+
+    def get_or_compute(self, key: tuple, compute) -> tuple[list, bool]:
+        """
+        Returns the cached results for key, or calls compute() and caches what it returns.
+        :return: Tuple of the results and whether they came from the cache
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            self._entries.move_to_end(key)
+            return list(entry[0]), True
+
+        self.misses += 1
+        version = self.version
+        start = time.perf_counter()
+        results = compute()
+        elapsed = time.perf_counter() - start
+        if version == self.version:  # the index was not rebuilt while computing
+            self._entries[key] = (tuple(results), elapsed)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results, False
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
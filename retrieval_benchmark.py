@@ -0,0 +1,293 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import evaluation
+import extraction
+import index_storage
+import models
+import scoring
+from document import Document
+
+RAW_DATA_PATH = "raw_data"
+DATA_PATH = "data"
+RESULTS_PATH = os.path.join(DATA_PATH, "benchmarks")
+SOURCE_PATH = os.path.join(RAW_DATA_PATH, "aesopa10.txt")
+
+
+def build_workload(terms: list[str]) -> list[str]:
+    """
+    Builds a deterministic query workload from the ground truth terms: every term on its own, every pair of terms
+    (OR-ed by the Boolean models, a two-term query for the ranking models) and every pair as a conjunction.
+    """
+    pairs = list(itertools.combinations(terms, 2))
+    return terms + [f"{a} {b}" for a, b in pairs] + [f"{a} AND {b}" for a, b in pairs]
+
+
+def scale_collection(documents: list[Document], factor: int) -> list[Document]:
+    """
+    Concatenates factor copies of a collection. Copy c of document d gets the id c * len(documents) + d.document_id;
+    the term arrays are shared between the copies.
+    """
+    scaled = []
+    for copy in range(factor):
+        for document in documents:
+            scaled_document = Document()
+            scaled_document.document_id = copy * len(documents) + document.document_id
+            scaled_document.title = document.title
+            scaled_document.raw_text = document.raw_text
+            scaled_document.term_ids = document.term_ids
+            scaled.append(scaled_document)
+    return scaled
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """
+    Percentile with linear interpolation between the closest ranks.
+    :param sorted_values: Values in ascending order
+    :param p: Percentile between 0 and 100
+    """
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class BenchmarkTarget(object):
+    """
+    Adapts one retrieval model to the harness: build() indexes a collection, query() answers one query and
+    index_bytes() reports the size of the built index.
+    """
+
+    name = ''
+
+    def __init__(self, k=10):
+        self.k = k
+        self.model = None
+
+    def build(self, documents: list[Document]):
+        raise NotImplementedError()
+
+    def query(self, query: str):
+        raise NotImplementedError()
+
+    def index_bytes(self) -> int:
+        """
+        Size of the index in its compact serialized form, or 0 if the model has no index.
+        """
+        return 0
+
+
+class LinearTarget(BenchmarkTarget):
+    name = 'linear'
+
+    def build(self, documents: list[Document]):
+        self.model = models.LinearBooleanModel(documents)
+
+    def query(self, query: str):
+        return self.model.search(query)
+
+
+class InvertedListTarget(BenchmarkTarget):
+    name = 'inverted'
+
+    def build(self, documents: list[Document]):
+        self.model = models.InvertedListBooleanModel()
+        self.model.build_inverted_index(documents)
+
+    def query(self, query: str):
+        return self.model.search(query)
+
+    def index_bytes(self) -> int:
+        with tempfile.TemporaryDirectory() as directory:
+            index_path = os.path.join(directory, "index.bin")
+            index_storage.write_inverted_index(self.model.inverted_index, index_path, len(self.model.document_ids))
+            return os.path.getsize(index_path)
+
+
+class SignatureTarget(BenchmarkTarget):
+    name = 'signature'
+
+    def build(self, documents: list[Document]):
+        self.model = models.SignatureBasedBooleanModel()
+        self.model.build_signature_index(documents)
+
+    def query(self, query: str):
+        return self.model.search(query)
+
+    def index_bytes(self) -> int:
+        return len(self.model.bit_slices) * ((len(self.model.doc_ids) + 7) // 8)
+
+
+class VectorSpaceTarget(BenchmarkTarget):
+    name = 'vsm'
+    scorer_class = None
+
+    def build(self, documents: list[Document]):
+        scorer = self.scorer_class() if self.scorer_class is not None else None
+        self.model = models.VectorSpaceModel(scorer)
+        self.model.build_inverted_index(documents)
+
+    def query(self, query: str):
+        return self.model.top_k(query, self.k)
+
+    def index_bytes(self) -> int:
+        # (doc_id, tf) postings as variable-byte gaps, the layout of an index file with frequencies
+        postings = self.model.statistics.postings.values()
+        return sum(len(index_storage.encode_postings_with_frequencies(term_postings)) for term_postings in postings)
+
+
+class BM25Target(VectorSpaceTarget):
+    name = 'vsm-bm25'
+    scorer_class = scoring.BM25Scorer
+
+
+class TfIdfTarget(VectorSpaceTarget):
+    name = 'vsm-tfidf'
+    scorer_class = scoring.TfIdfCosineScorer
+
+
+TARGETS = {target.name: target for target in (LinearTarget, InvertedListTarget, SignatureTarget, VectorSpaceTarget,
+                                               TfIdfTarget, BM25Target)}
+
+
+def run_target(target: BenchmarkTarget, documents: list[Document], workload: list[str], repeat=5) -> dict:
+    """
+    Benchmarks one model on one collection. Timings are taken without tracing; index memory and peak memory come
+    from a second, traced build and pass over the workload, so tracemalloc does not distort the latencies.
+    :return: Dictionary with the measurements
+    """
+    gc.collect()
+    start = time.perf_counter()
+    target.build(documents)
+    build_seconds = time.perf_counter() - start
+
+    for query in workload:  # warm-up, e.g. lazily derived representations
+        target.query(query)
+
+    latencies = []
+    for _ in range(repeat):
+        for query in workload:
+            start = time.perf_counter()
+            target.query(query)
+            latencies.append(time.perf_counter() - start)
+    total_seconds = sum(latencies)
+    latencies.sort()
+    index_bytes = target.index_bytes()
+
+    target.model = None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        target.build(documents)
+        index_memory_bytes = tracemalloc.get_traced_memory()[0]
+        for query in workload:
+            target.query(query)
+        peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        target.model = None
+
+    return {
+        'model': target.name,
+        'documents': len(documents),
+        'queries': len(latencies),
+        'build_seconds': build_seconds,
+        'index_bytes': index_bytes,
+        'index_memory_bytes': index_memory_bytes,
+        'peak_memory_bytes': peak_memory_bytes,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'qps': len(latencies) / total_seconds if total_seconds else 0.0,
+    }
+
+
+def run_benchmarks(target_names: list[str], scales: list[int], repeat=5, k=10) -> dict:
+    """
+    Runs every model on the fable collection scaled by every factor, with the ground truth workload.
+    :return: Dictionary with the environment, the settings and one result per model and scale
+    """
+    base_collection = extraction.extract_collection(SOURCE_PATH)
+    workload = build_workload(evaluation.GroundTruth.load().queries())
+    results = []
+    for scale in scales:
+        documents = scale_collection(base_collection, scale)
+        for name in target_names:
+            result = run_target(TARGETS[name](k), documents, workload, repeat)
+            result['scale'] = scale
+            results.append(result)
+            print_result(result)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': {'models': target_names, 'scales': scales, 'repeat': repeat, 'k': k,
+                     'workload_queries': len(workload)},
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict) -> list[dict]:
+    """
+    Matches results with a baseline run by model and scale.
+    :return: One entry per match with the ratios current / baseline of latency, throughput and build time
+    """
+    baseline_results = {(r['model'], r['scale']): r for r in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        previous = baseline_results.get((result['model'], result['scale']))
+        if previous is None:
+            continue
+        entry = {'model': result['model'], 'scale': result['scale']}
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'qps', 'build_seconds', 'peak_memory_bytes'):
+            entry[key] = result[key] / previous[key] if previous[key] else 0.0
+        comparison.append(entry)
+    return comparison
+
+
+def print_result(result: dict):
+    print(f"{result['model']:10} x{result['scale']:<3} {result['documents']:6} docs  "
+          f"build {result['build_seconds'] * 1000:8.1f} ms  index {result['index_bytes'] / 1024:8.1f} KiB  "
+          f"p50 {result['p50_ms']:7.3f} ms  p95 {result['p95_ms']:7.3f} ms  p99 {result['p99_ms']:7.3f} ms  "
+          f"{result['qps']:9.0f} q/s  peak {result['peak_memory_bytes'] / 1024 / 1024:6.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the retrieval models on the ground truth workload.")
+    parser.add_argument("--models", nargs="+", choices=sorted(TARGETS), default=list(TARGETS))
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 4, 16],
+                        help="number of copies of the fable collection")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the workload per measurement")
+    parser.add_argument("-k", type=int, default=10, help="number of results of the ranking models")
+    parser.add_argument("--output", help="result file (default: data/benchmarks/<timestamp>.json)")
+    parser.add_argument("--compare", help="result file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.models, args.scales, args.repeat, args.k)
+
+    output_path = args.output or os.path.join(RESULTS_PATH, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (current / baseline):")
+        for entry in compare(results, baseline):
+            print(f"  {entry['model']:10} x{entry['scale']:<3} p50 {entry['p50_ms']:.2f}  p99 {entry['p99_ms']:.2f}  "
+                  f"qps {entry['qps']:.2f}  build {entry['build_seconds']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
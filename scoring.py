@@ -0,0 +1,192 @@
+import math
+from collections import defaultdict
+import instrumentation
+import topk
+
+
+class CollectionStatistics(object):
+    """
+    Scorer independent statistics of a collection: raw term frequency postings, document lengths (number of terms),
+    document and collection frequencies. Built once; every Scorer computes its weights from it at query time.
+    """
+
+    def __init__(self, term_counts: dict, document_ids: list):
+        """
+        :param term_counts: Dictionary that maps each term to a list of (doc_id, number of occurrences) tuples
+        :param document_ids: IDs of all documents of the collection
+        """
+        self.postings = {}  # term -> [(doc_id, tf)] sorted by doc_id
+        self.collection_frequency = {}  # term -> number of occurrences in the collection
+        self.document_lengths = {doc_id: 0 for doc_id in document_ids}
+        for term, counts in term_counts.items():
+            postings = sorted(counts)
+            self.postings[term] = postings
+            self.collection_frequency[term] = sum(tf for _, tf in postings)
+            for doc_id, tf in postings:
+                self.document_lengths[doc_id] += tf
+
+        self.num_documents = len(self.document_lengths)
+        self.num_tokens = sum(self.document_lengths.values())
+        self.average_document_length = self.num_tokens / self.num_documents if self.num_documents else 0.0
+        self.scorer_data = {}  # data that scorers precompute from the statistics, e.g. document norms
+        self._upper_bounds = {}  # scorer key -> term -> upper bound
+
+    def document_frequency(self, term: str) -> int:
+        return len(self.postings.get(term, ()))
+
+    def upper_bounds(self, scorer: 'Scorer') -> dict:
+        """
+        Returns the per-term maximum score of a scorer (for a query weight of 1). Computed once per scorer
+        configuration and cached, so switching between scorers never touches the postings again.
+        """
+        scorer.prepare(self)
+        key = scorer.key()
+        bounds = self._upper_bounds.get(key)
+        if bounds is None:
+            with instrumentation.timer('index_build'):
+                bounds = {
+                    term: max(scorer.score(term, tf, doc_id) for doc_id, tf in postings)
+                    for term, postings in self.postings.items()
+                }
+            self._upper_bounds[key] = bounds
+        return bounds
+
+
+class Scorer(object):
+    """
+    Base class of the scoring functions. score() is the contribution of one posting for a query weight of 1,
+    query_weight() the weight of a query term that occurs query_tf times in the query. query_weight(term, query_tf)
+    must equal query_tf_weight(query_tf) * query_weight(term, 1), so the term part can be precomputed.
+    """
+
+    def key(self) -> tuple:
+        return (type(self).__name__,)
+
+    def prepare(self, statistics: CollectionStatistics):
+        self.statistics = statistics
+
+    def query_weight(self, term: str, query_tf: int) -> float:
+        return self.query_tf_weight(query_tf)
+
+    def query_tf_weight(self, query_tf: int) -> float:
+        return float(query_tf)
+
+    def score(self, term: str, tf: int, doc_id) -> float:
+        raise NotImplementedError()
+
+
+class BM25Scorer(Scorer):
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def key(self) -> tuple:
+        return (type(self).__name__, self.k1, self.b)
+
+    def idf(self, term: str) -> float:
+        document_frequency = self.statistics.document_frequency(term)
+        return math.log(1 + (self.statistics.num_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def score(self, term: str, tf: int, doc_id) -> float:
+        statistics = self.statistics
+        average_length = statistics.average_document_length
+        # Without any tokens in the collection every document has the average length.
+        length_ratio = statistics.document_lengths[doc_id] / average_length if average_length else 1.0
+        return self.idf(term) * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length_ratio))
+
+    def __str__(self):
+        return 'BM25'
+
+
+class TfIdfCosineScorer(Scorer):
+    """
+    Cosine similarity of (1 + log10 tf) * idf weighted vectors. The query vector is not normalized, which does not
+    change the ranking.
+    """
+
+    def prepare(self, statistics: CollectionStatistics):
+        super().prepare(statistics)
+        self.norms = statistics.scorer_data.get('tf_idf_norms')
+        if self.norms is None:
+            norms = defaultdict(float)
+            for term, postings in statistics.postings.items():
+                idf = math.log10(statistics.num_documents / len(postings))
+                for doc_id, tf in postings:
+                    norms[doc_id] += ((1 + math.log10(tf)) * idf) ** 2
+            self.norms = {doc_id: math.sqrt(norm) for doc_id, norm in norms.items()}
+            statistics.scorer_data['tf_idf_norms'] = self.norms
+
+    def idf(self, term: str) -> float:
+        document_frequency = self.statistics.document_frequency(term)
+        return math.log10(self.statistics.num_documents / document_frequency) if document_frequency else 0.0
+
+    def query_weight(self, term: str, query_tf: int) -> float:
+        return self.query_tf_weight(query_tf) * self.idf(term)
+
+    def query_tf_weight(self, query_tf: int) -> float:
+        return 1 + math.log10(query_tf)
+
+    def score(self, term: str, tf: int, doc_id) -> float:
+        norm = self.norms.get(doc_id)
+        return (1 + math.log10(tf)) * self.idf(term) / norm if norm else 0.0
+
+    def __str__(self):
+        return 'tf-idf cosine'
+
+
+class LanguageModelScorer(Scorer):
+    """
+    Query likelihood with Jelinek-Mercer smoothing. Only the rank equivalent part that depends on matching terms is
+    computed: log(1 + (1 - lambda) * P(t|d) / (lambda * P(t|C))).
+    """
+
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing
+
+    def key(self) -> tuple:
+        return (type(self).__name__, self.smoothing)
+
+    def score(self, term: str, tf: int, doc_id) -> float:
+        statistics = self.statistics
+        document_probability = tf / statistics.document_lengths[doc_id]
+        collection_probability = statistics.collection_frequency[term] / statistics.num_tokens
+        return math.log(1 + (1 - self.smoothing) * document_probability / (self.smoothing * collection_probability))
+
+    def __str__(self):
+        return 'Language Model (Jelinek-Mercer)'
+
+
+class ScorerCursor(topk.TermCursor):
+    """
+    Cursor over (doc_id, tf) postings that are weighted by a Scorer while they are visited.
+    """
+
+    def __init__(self, term: str, postings: list[tuple], query_weight: float, upper_bound: float, scorer: Scorer):
+        super().__init__(postings, query_weight, upper_bound)
+        self.term = term
+        self.scorer = scorer
+
+    def score(self) -> float:
+        doc_id, tf = self.postings[self.position]
+        return self.scorer.score(self.term, tf, doc_id) * self.query_weight
+
+
+def top_k(statistics: CollectionStatistics, scorer: Scorer, query_terms: list[str], k: int,
+          stats: dict = None) -> list[tuple]:
+    """
+    Ranks the documents for a query with the given scorer, using MaxScore and the scorer's precomputed upper bounds.
+    :return: List of (score, doc_id) tuples, best first
+    """
+    bounds = statistics.upper_bounds(scorer)
+    query_counts = defaultdict(int)
+    for term in query_terms:
+        query_counts[term] += 1
+
+    cursors = []
+    with instrumentation.timer('posting_fetch'):
+        for term, query_tf in query_counts.items():
+            postings = statistics.postings.get(term)
+            if postings:
+                instrumentation.count('postings_fetched', len(postings))
+                cursors.append(ScorerCursor(term, postings, scorer.query_weight(term, query_tf), bounds[term], scorer))
+    return topk.maxscore_top_k(cursors, k, stats)
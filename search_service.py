@@ -0,0 +1,576 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import os
+import signal
+import time
+from urllib.parse import parse_qs, urlsplit
+import instrumentation
+import ir_system
+import models
+import shared_index
+
+DEFAULT_MODEL = 'vsm-bm25'
+MAX_K = 1000
+MAX_BODY_BYTES = 1024 * 1024
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class ServiceOverloaded(Exception):
+    """
+    Raised when a request is rejected because too many requests are already waiting.
+    """
+
+
+def parse_request(request: dict) -> dict:
+    """
+    Validates a search request {"query": str, "model": str, "stopword_filtering": bool, "stemming": bool, "k": int}.
+    Only the query is required.
+    :return: The request with defaults filled in
+    :raises ValueError: if the request is malformed
+    """
+    if not isinstance(request, dict):
+        raise ValueError('A search request must be a JSON object')
+    query = request.get('query')
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError('"query" must be a non-empty string')
+    k = request.get('k', 10)
+    if not isinstance(k, int) or isinstance(k, bool) or not 0 < k <= MAX_K:
+        raise ValueError(f'"k" must be an integer between 1 and {MAX_K}')
+    model = request.get('model', DEFAULT_MODEL)
+    if not isinstance(model, str):
+        raise ValueError('"model" must be a string')
+    options = {}
+    for option in ('stopword_filtering', 'stemming'):
+        options[option] = request.get(option, False)
+        if not isinstance(options[option], bool):
+            raise ValueError(f'"{option}" must be true or false')
+    return {'query': query, 'model': model, **options, 'k': k}
+
+
+class SearchEngine(object):
+    """
+    Programmatic search API. Loads the collection once and builds the indexes of every model and search mode up
+    front, one InformationRetrievalSystem per model over the shared collection. Everything that would otherwise be
+    built on the first query (positional indexes, document representations) is built here as well, so searches do not
+    build shared structures; the caches they still update (posting lists, stems, vocabulary) are locked. One engine
+    can serve many threads, or forked worker processes that share its memory.
+    """
+
+    def __init__(self, model_names=None, search_modes=ir_system.SEARCH_MODES, collection=None, flat_indexes=False):
+        """
+        :param model_names: Names of ir_system.MODEL_SELECTORS to load, default: all. Models whose optional
+                            dependencies are missing are skipped.
+        :param search_modes: (stop word filtering, stemming) tuples to build indexes for
+        :param collection: CollectionStore to search, default: the collection saved in data/
+        :param flat_indexes: Convert the indexes of the scorer-based ranking models to flat indexes in shared memory
+                             (see shared_index), so worker processes do not copy them when they touch them
+        """
+        base = ir_system.InformationRetrievalSystem(collection)
+        self.collection = base.collection
+        self.search_modes = tuple(search_modes)
+        self.systems = {}
+        self.shared_blocks = []  # shared memory of the flat indexes, released by close()
+        for name in model_names or ir_system.MODEL_SELECTORS:
+            system = base if not self.systems else ir_system.InformationRetrievalSystem(self.collection)
+            try:
+                ir_system.MODEL_SELECTORS[name](system)
+            except ImportError:
+                continue
+            for stop_word_filtering, stemming in self.search_modes:
+                model = system.prepare_mode(stop_word_filtering, stemming)
+                if flat_indexes and isinstance(model, models.VectorSpaceModel) and model.scorer is not None:
+                    block = shared_index.publish_flat_index(
+                        shared_index.build_flat_index(model.statistics, model.scorer)
+                    )
+                    self.shared_blocks.append(block)
+                    system.model_variants[stop_word_filtering, stemming] = shared_index.FlatVectorSpaceModel(
+                        shared_index.FlatIndex(block.buf)
+                    )
+            self.systems[name] = system
+
+    def close(self):
+        """
+        Releases the shared memory of the flat indexes. The engine cannot search afterwards.
+        """
+        for system in self.systems.values():
+            for model in system.model_variants.values():
+                if isinstance(model, shared_index.FlatVectorSpaceModel):
+                    model.index.close()
+        for block in self.shared_blocks:
+            block.close()
+            block.unlink()
+        self.shared_blocks = []
+
+    def models(self) -> list[str]:
+        return list(self.systems)
+
+    def search(self, query: str, model=DEFAULT_MODEL, stopword_filtering=False, stemming=False, k=10) -> list[dict]:
+        """
+        :return: List of {"id", "title", "score"} dictionaries, best first
+        :raises ValueError: if the model or search mode is not loaded
+        :raises query_parser.QuerySyntaxError: if the query is malformed
+        """
+        system = self.systems.get(model)
+        if system is None:
+            raise ValueError(f'Unknown model {model!r}, available: {", ".join(self.systems)}')
+        if (stopword_filtering, stemming) not in self.search_modes:
+            raise ValueError('Search mode is not loaded')
+        with instrumentation.query(query):
+            results = system.search(query, stemming, stopword_filtering, k)
+            with instrumentation.timer('materialization'):
+                return [
+                    {'id': document.document_id, 'title': document.title, 'score': score}
+                    for score, document in results[:k]
+                ]
+
+    def search_batch(self, requests: list[dict]) -> list[tuple[bool, object]]:
+        """
+        Runs several parsed requests (see parse_request()). A failing request does not affect the others.
+        :return: Per request: (True, results) or (False, error message)
+        """
+        responses = []
+        for request in requests:
+            try:
+                responses.append((True, self.search(**request)))
+            except ValueError as e:  # includes QuerySyntaxError
+                responses.append((False, str(e)))
+        return responses
+
+
+_worker_engine = None  # engine of the worker processes, inherited from the parent on fork
+
+
+def _search_batch_in_worker(requests: list[dict]) -> list[tuple[bool, object]]:
+    return _worker_engine.search_batch(requests)
+
+
+def _start_worker():
+    pass
+
+
+def create_executor(engine: SearchEngine, workers: int, use_processes=False) -> concurrent.futures.Executor:
+    """
+    Creates the worker pool that runs searches of an engine. Worker processes are forked right away, so they inherit
+    the loaded engine (and no sockets or files opened later).
+    """
+    global _worker_engine
+    if use_processes:
+        _worker_engine = engine
+        executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        executor.submit(_start_worker).result()
+        return executor
+    return concurrent.futures.ThreadPoolExecutor(workers)
+
+
+class SearchService(object):
+    """
+    Runs searches of concurrent clients on a worker pool. Requests that arrive within batch_delay of each other are
+    grouped into batches of up to max_batch requests, and each batch is one task for the pool, which amortizes the
+    dispatch (and for processes the pickling) overhead. At most max_pending requests may be queued or running;
+    further requests are rejected with ServiceOverloaded instead of letting latency grow without bound.
+    """
+
+    def __init__(self, engine: SearchEngine, workers=None, use_processes=False, max_pending=256, max_batch=16,
+                 batch_delay=0.002):
+        """
+        :param workers: Size of the pool, default: number of CPUs
+        :param use_processes: Score in forked processes that share the engine's indexes copy-on-write, so CPU-bound
+                              scoring runs in parallel. Falls back to threads where fork is not available.
+        """
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes and 'fork' in multiprocessing.get_all_start_methods()
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.pending = 0
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self._queue = None
+        self._dispatcher = None
+        self._batch_tasks = set()
+        self._executor = None
+        self._run_batch = None
+
+    async def start(self):
+        self._executor = create_executor(self.engine, self.workers, self.use_processes)
+        self._run_batch = _search_batch_in_worker if self.use_processes else self.engine.search_batch
+        self._queue = asyncio.Queue()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def search(self, request: dict) -> list[dict]:
+        """
+        :param request: Search request, see parse_request()
+        :return: Results as returned by SearchEngine.search()
+        :raises ValueError: if the request is malformed or the query cannot be parsed
+        :raises ServiceOverloaded: if max_pending requests are already waiting
+        """
+        request = parse_request(request)
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ServiceOverloaded(f'{self.pending} requests are waiting, try again later')
+        self.pending += 1
+        self.requests += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait((request, future))
+            ok, result = await future
+        finally:
+            self.pending -= 1
+        if not ok:
+            raise ValueError(result)
+        return result
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            task = asyncio.create_task(self._execute(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _execute(self, batch: list[tuple]):
+        start = time.perf_counter()
+        try:
+            responses = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._run_batch, [request for request, _ in batch]
+            )
+        except Exception as e:  # e.g. a crashed worker process, fail the batch instead of the dispatcher
+            responses = [(False, f'Search failed: {e}')] * len(batch)
+        self.busy_seconds += time.perf_counter() - start
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+    def statistics(self) -> dict:
+        """
+        Service counters. With instrumentation enabled they include its summary under 'instrumentation'; searches that
+        ran in worker processes are not part of it.
+        """
+        statistics = {
+            'models': self.engine.models(),
+            'workers': self.workers,
+            'executor': 'process' if self.use_processes else 'thread',
+            'pending': self.pending,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'average_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'busy_seconds': self.busy_seconds,
+        }
+        if instrumentation.recorder.enabled:
+            statistics['instrumentation'] = instrumentation.summary()
+        return statistics
+
+
+def _read_bulk_chunks(lines, chunk_size: int):
+    """
+    Parses JSONL search requests into chunks of (line number, request id, request, error) entries. Malformed lines
+    become entries with an error instead of aborting the run.
+    """
+    chunk = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        request_id = request = error = None
+        try:
+            raw_request = json.loads(line)
+            if isinstance(raw_request, dict):
+                request_id = raw_request.get('id')
+            request = parse_request(raw_request)
+        except ValueError as e:  # includes json.JSONDecodeError
+            error = str(e)
+        chunk.append((line_number, request_id, request, error))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _search_bulk_chunk(engine: SearchEngine, chunk: list[tuple]) -> tuple[str, int]:
+    """
+    Runs a chunk of bulk requests and serializes the results in the worker.
+    :return: The JSONL output of the chunk and its number of errors
+    """
+    output = []
+    errors = 0
+    for line_number, request_id, request, error in chunk:
+        record = {'line': line_number}
+        if request_id is not None:
+            record['id'] = request_id
+        if request is not None:
+            try:
+                record['results'] = engine.search(**request)
+            except ValueError as e:  # includes QuerySyntaxError
+                error = str(e)
+        if error is not None:
+            record['error'] = error
+            errors += 1
+        output.append(json.dumps(record) + '\n')
+    return ''.join(output), errors
+
+
+def _search_bulk_chunk_in_worker(chunk: list[tuple]) -> tuple[str, int]:
+    return _search_bulk_chunk(_worker_engine, chunk)
+
+
+def run_bulk_queries(engine: SearchEngine, lines, output, workers=None, use_processes=False, ordered=True,
+                     chunk_size=64) -> dict:
+    """
+    Runs a JSONL stream of search requests (see parse_request(), plus an optional "id" that is copied to the
+    output) on a worker pool and writes one JSON record per request to output as soon as its chunk is done:
+    {"line": n, "id": ..., "results": [...]} or {"line": n, "id": ..., "error": "..."}.
+    Only a few chunks per worker are in flight, so input and output of any size are streamed.
+    :param lines: Iterable of input lines, e.g. an open file
+    :param output: Writable text file
+    :param ordered: Write the records in input order; otherwise in completion order, which does not hold back
+                    finished chunks behind a slow one
+    :return: Dictionary with the number of queries and errors, the elapsed seconds and the queries per second
+    """
+    workers = workers or os.cpu_count() or 1
+    use_processes = use_processes and 'fork' in multiprocessing.get_all_start_methods()
+    run_chunk = _search_bulk_chunk_in_worker if use_processes else functools.partial(_search_bulk_chunk, engine)
+    max_in_flight = 2 * workers
+    queries = errors = 0
+
+    def write(future):
+        nonlocal errors
+        records, chunk_errors = future.result()
+        output.write(records)
+        errors += chunk_errors
+
+    start = time.perf_counter()
+    executor = create_executor(engine, workers, use_processes)
+    try:
+        in_flight = collections.deque() if ordered else set()
+        for chunk in _read_bulk_chunks(lines, chunk_size):
+            queries += len(chunk)
+            if len(in_flight) >= max_in_flight:
+                if ordered:
+                    write(in_flight.popleft())
+                else:
+                    done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        write(future)
+            future = executor.submit(run_chunk, chunk)
+            if ordered:
+                in_flight.append(future)
+            else:
+                in_flight.add(future)
+        for future in in_flight if ordered else concurrent.futures.as_completed(in_flight):
+            write(future)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    seconds = time.perf_counter() - start
+    return {
+        'queries': queries,
+        'errors': errors,
+        'seconds': seconds,
+        'queries_per_second': queries / seconds if seconds else 0.0,
+    }
+
+
+class SearchServer(object):
+    """
+    Minimal HTTP/1.1 JSON front end of a SearchService on asyncio streams, over TCP or a Unix socket.
+      GET  /search?q=...&model=...&sw=1&stem=1&k=10
+      POST /search   body: a search request (see parse_request()) or a list of them
+      GET  /health, GET /stats
+    """
+
+    def __init__(self, service: SearchService, host='127.0.0.1', port=8080, unix_path=None):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.server = None
+
+    async def start(self):
+        await self.service.start()
+        if self.unix_path:
+            self.server = await asyncio.start_unix_server(self._handle_connection, self.unix_path)
+        else:
+            self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+
+    async def serve_forever(self):
+        """
+        Serves until the task is cancelled, on SIGTERM or with KeyboardInterrupt, and shuts the worker pool down.
+        """
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, AttributeError):  # no signal handlers on Windows event loops
+            pass
+        await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            await self.service.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              if version == 'HTTP/1.1' else headers.get('connection', '').lower() == 'keep-alive')
+                try:
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Invalid Content-Length'}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {'error': 'Request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._route(method, target, body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, body: bytes) -> tuple[int, object]:
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'models': self.service.engine.models()}
+        if url.path == '/stats':
+            return 200, self.service.statistics()
+        if url.path != '/search':
+            return 404, {'error': f'Unknown path {url.path}'}
+
+        if method == 'GET':
+            parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                request = {
+                    'query': parameters.get('q', ''),
+                    'model': parameters.get('model', DEFAULT_MODEL),
+                    'stopword_filtering': parameters.get('sw', '0') in ('1', 'true', 'yes'),
+                    'stemming': parameters.get('stem', '0') in ('1', 'true', 'yes'),
+                    'k': int(parameters.get('k', 10)),
+                }
+            except ValueError:
+                return 400, {'error': '"k" must be an integer'}
+            return await self._search(request)
+        if method == 'POST':
+            try:
+                request = json.loads(body)
+            except ValueError:
+                return 400, {'error': 'Body is not valid JSON'}
+            if isinstance(request, list):
+                responses = await asyncio.gather(*(self._search(r) for r in request))
+                status = 503 if any(s == 503 for s, _ in responses) else 200
+                return status, [payload for _, payload in responses]
+            return await self._search(request)
+        return 405, {'error': f'Method {method} not allowed'}
+
+    async def _search(self, request) -> tuple[int, dict]:
+        start = time.perf_counter()
+        try:
+            results = await self.service.search(request)
+        except ServiceOverloaded as e:
+            return 503, {'error': str(e)}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        return 200, {'results': results, 'milliseconds': (time.perf_counter() - start) * 1000}
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        body = json.dumps(payload).encode('utf-8')
+        headers = [
+            f'HTTP/1.1 {status} {_STATUS_TEXT[status]}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}',
+        ]
+        if status == 503:
+            headers.append('Retry-After: 1')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves searches over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--models", nargs="+", choices=list(ir_system.MODEL_SELECTORS),
+                        help="models to load (default: all)")
+    parser.add_argument("--workers", type=int, help="size of the worker pool (default: number of CPUs)")
+    parser.add_argument("--processes", action="store_true", help="score in forked worker processes")
+    parser.add_argument("--flat-index", action="store_true",
+                        help="serve the ranking models from flat indexes in shared memory")
+    parser.add_argument("--max-pending", type=int, default=256, help="requests queued before rejecting with 503")
+    parser.add_argument("--max-batch", type=int, default=16, help="maximum number of requests per batch")
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="milliseconds to wait for a batch to fill")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.enable_from_arguments(args)
+
+    start = time.perf_counter()
+    engine = SearchEngine(args.models, flat_indexes=args.flat_index)
+    print(f"Loaded {len(engine.collection)} documents and {len(engine.models())} models "
+          f"in {time.perf_counter() - start:.2f} s")
+    service = SearchService(engine, args.workers, args.processes, args.max_pending, args.max_batch,
+                            args.batch_delay / 1000)
+    server = SearchServer(service, args.host, args.port, args.unix)
+    print(f"Listening on {args.unix or f'http://{args.host}:{args.port}'}")
+    try:
+        asyncio.run(server.serve_forever())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        engine.close()
+        instrumentation.report(args)
+
+
+if __name__ == "__main__":
+    main()
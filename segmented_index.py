@@ -0,0 +1,412 @@
+import heapq
+import json
+import math
+import os
+import threading
+from collections import defaultdict
+from collections.abc import Mapping
+import index_storage
+import topk
+from document import Document
+from models import InvertedListBooleanModel, VectorSpaceModel
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class DiskSegment(object):
+    """
+    Immutable segment on disk: an index file with (doc_id, tf) postings and a metadata file with the ids of the
+    documents stored in the segment and the ids of the documents the segment deletes in older segments.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.index_path = os.path.join(directory, name + '.idx')
+        self.meta_path = os.path.join(directory, name + '.json')
+        self.index = index_storage.DiskInvertedIndex(self.index_path)
+        with open(self.meta_path, 'r') as f:
+            meta = json.load(f)
+        self.doc_ids = set(meta['doc_ids'])
+        self.deletes = set(meta['deletes'])
+        self.readers = 0  # queries that currently read the segment, guarded by the lock of the SegmentedIndex
+        self.retired = False  # merged away, closed as soon as the last reader is done
+
+    @staticmethod
+    def write(directory: str, name: str, postings: dict, doc_ids, deletes) -> 'DiskSegment':
+        segment_path = os.path.join(directory, name)
+        index_storage.write_inverted_index(postings, segment_path + '.idx', len(doc_ids), frequencies=True)
+        with open(segment_path + '.json', 'w') as f:
+            json.dump({'doc_ids': sorted(doc_ids), 'deletes': sorted(deletes)}, f)
+        return DiskSegment(directory, name)
+
+    def postings(self, term: str) -> list[tuple[int, int]]:
+        return self.index.postings_with_frequencies(term)
+
+    def terms(self):
+        return iter(self.index)
+
+    def close(self):
+        self.index.close()
+
+    def remove_files(self):
+        # Readers that still hold the segment keep reading through the mmap, the data is freed once it is closed.
+        os.remove(self.index_path)
+        os.remove(self.meta_path)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+class SegmentedIndex(object):
+    """
+    Log-structured inverted index. New documents are collected in an in-memory segment (the memtable) that is flushed
+    to an immutable disk segment once it holds flush_threshold documents. Deletes and updates never touch existing
+    segments: a newer segment shadows all older versions of its documents and records deleted ids.
+
+    Segments are organized in tiers by size; tier t holds segments with about flush_threshold * segments_per_tier^t
+    documents. As soon as segments_per_tier adjacent segments share a tier they are merged into one segment of the
+    next tier, which bounds both the number of segments a query fans out to and the number of times a posting is
+    rewritten (write amplification: log_{segments_per_tier}(collection size / flush_threshold)). Merges run in a
+    background thread if start_background_merging() was called, and after every flush otherwise.
+    """
+
+    def __init__(self, directory: str, flush_threshold=1000, segments_per_tier=4, representation=None):
+        self.directory = directory
+        self.flush_threshold = flush_threshold
+        self.segments_per_tier = segments_per_tier
+        self.representation = representation or (lambda document: document.terms)
+
+        self._lock = threading.RLock()
+        self._memtable = {}  # doc_id -> {term: tf}
+        self._memtable_deletes = set()
+        self._generation = 0
+        self._segments = []  # oldest first
+        self._dead = []  # per segment: ids of its documents that are shadowed by a newer segment
+        self._sealed_live = set()  # ids of the live documents in the disk segments
+        self._merge_requested = threading.Event()
+        self._merge_thread = None
+        self._stopping = False
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self._generation = manifest['generation']
+            self._segments = [DiskSegment(directory, name) for name in manifest['segments']]
+        self._update_liveness()
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump({'generation': self._generation, 'segments': [s.name for s in self._segments]}, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def _update_liveness(self):
+        shadow = set()
+        dead = []
+        for segment in reversed(self._segments):
+            dead.append(segment.doc_ids & shadow)
+            shadow |= segment.doc_ids | segment.deletes
+        self._dead = dead[::-1]
+        self._sealed_live = set()
+        for segment, segment_dead in zip(self._segments, self._dead):
+            self._sealed_live |= segment.doc_ids - segment_dead
+
+    def _is_live(self, doc_id) -> bool:
+        return doc_id in self._memtable or (doc_id not in self._memtable_deletes and doc_id in self._sealed_live)
+
+    def add_document(self, document: Document):
+        """
+        Adds a document to the memtable. An existing document with the same id is replaced.
+        """
+        term_count = defaultdict(int)
+        for term in self.representation(document):
+            term_count[term] += 1
+        with self._lock:
+            self._memtable[document.document_id] = dict(term_count)
+            if len(self._memtable) >= self.flush_threshold:
+                self.flush()
+
+    def update_document(self, document: Document):
+        self.add_document(document)
+
+    def remove_document(self, doc_id) -> bool:
+        with self._lock:
+            existed = self._is_live(doc_id)
+            self._memtable.pop(doc_id, None)
+            if doc_id in self._sealed_live:
+                self._memtable_deletes.add(doc_id)
+            return existed
+
+    def flush(self):
+        """
+        Writes the memtable to a new disk segment.
+        """
+        with self._lock:
+            if not self._memtable and not self._memtable_deletes:
+                return
+            postings = defaultdict(list)
+            for doc_id, term_count in self._memtable.items():
+                for term, tf in term_count.items():
+                    postings[term].append((doc_id, tf))
+            self._generation += 1
+            segment = DiskSegment.write(self.directory, f'segment_{self._generation:06d}', postings,
+                                        self._memtable.keys(), self._memtable_deletes)
+            self._segments.append(segment)
+            self._memtable = {}
+            self._memtable_deletes = set()
+            self._update_liveness()
+            self._write_manifest()
+
+        if self._merge_thread is not None:
+            self._merge_requested.set()
+        else:
+            self.maybe_merge()
+
+    def _tier(self, segment: DiskSegment) -> int:
+        tier = 0
+        capacity = self.flush_threshold
+        while len(segment) > capacity:
+            capacity *= self.segments_per_tier
+            tier += 1
+        return tier
+
+    def _find_merge(self):
+        """
+        Returns the positions of the newest run of adjacent segments that fills a tier, or None.
+        """
+        end = len(self._segments)
+        while end > 0:
+            start = end - 1
+            tier = self._tier(self._segments[start])
+            while start > 0 and self._tier(self._segments[start - 1]) == tier:
+                start -= 1
+            if end - start >= self.segments_per_tier:
+                return end - self.segments_per_tier, end
+            end = start
+        return None
+
+    def maybe_merge(self):
+        """
+        Applies the tiered merge policy until no tier is full.
+        """
+        while True:
+            with self._lock:
+                run = self._find_merge()
+                if run is None:
+                    return
+                sources = self._segments[run[0]:run[1]]
+                dead = self._dead[run[0]:run[1]]
+                includes_oldest = run[0] == 0
+            self._merge(sources, dead, includes_oldest)
+
+    def _merge(self, sources: list[DiskSegment], dead: list[set], includes_oldest: bool):
+        postings = defaultdict(list)
+        doc_ids = set()
+        deletes = set()
+        for segment, segment_dead in zip(sources, dead):
+            doc_ids |= segment.doc_ids - segment_dead
+            deletes |= segment.deletes
+            for term in segment.terms():
+                postings[term].extend(p for p in segment.postings(term) if p[0] not in segment_dead)
+        if includes_oldest:
+            deletes = set()  # there is nothing older left to delete from
+        postings = {term: term_postings for term, term_postings in postings.items() if term_postings}
+
+        with self._lock:
+            self._generation += 1
+            name = f'segment_{self._generation:06d}'
+        merged = DiskSegment.write(self.directory, name, postings, doc_ids, deletes)
+
+        with self._lock:
+            position = self._segments.index(sources[0])
+            self._segments[position:position + len(sources)] = [merged]
+            self._update_liveness()
+            self._write_manifest()
+            for segment in sources:
+                segment.retired = True
+                if not segment.readers:
+                    segment.close()
+        for segment in sources:
+            segment.remove_files()
+
+    def _acquire_segments(self) -> list[tuple[DiskSegment, set]]:
+        """
+        Returns the current segments with their dead ids. They stay open until they are passed to _release_segments(),
+        even if a merge replaces them in the meantime. Must be called with the lock held.
+        """
+        for segment in self._segments:
+            segment.readers += 1
+        return list(zip(self._segments, self._dead))
+
+    def _release_segments(self, segments: list[tuple[DiskSegment, set]]):
+        with self._lock:
+            for segment, _ in segments:
+                segment.readers -= 1
+                if segment.retired and not segment.readers:
+                    segment.close()
+
+    def start_background_merging(self):
+        if self._merge_thread is not None:
+            return
+        self._stopping = False
+        self._merge_thread = threading.Thread(target=self._merge_loop, daemon=True)
+        self._merge_thread.start()
+
+    def stop_background_merging(self):
+        if self._merge_thread is None:
+            return
+        self._stopping = True
+        self._merge_requested.set()
+        self._merge_thread.join()
+        self._merge_thread = None
+
+    def _merge_loop(self):
+        while True:
+            self._merge_requested.wait()
+            self._merge_requested.clear()
+            if self._stopping:
+                return
+            self.maybe_merge()
+
+    def close(self):
+        self.stop_background_merging()
+        self.flush()
+
+    def postings(self, term: str) -> list[tuple[int, int]]:
+        """
+        Fans out to all segments and the memtable and merges the live (doc_id, tf) postings of a term.
+        :return: Postings sorted by doc_id
+        """
+        with self._lock:
+            segments = self._acquire_segments()
+            memtable = {doc_id: terms[term] for doc_id, terms in self._memtable.items() if term in terms}
+            shadowed = self._memtable.keys() | self._memtable_deletes
+        parts = [sorted(memtable.items())]
+        try:
+            for segment, segment_dead in segments:
+                parts.append([p for p in segment.postings(term) if p[0] not in segment_dead and p[0] not in shadowed])
+        finally:
+            self._release_segments(segments)
+        return list(heapq.merge(*parts))
+
+    def num_documents(self) -> int:
+        with self._lock:
+            shadowed = sum(1 for doc_id in self._memtable.keys() | self._memtable_deletes
+                           if doc_id in self._sealed_live)
+            return len(self._sealed_live) - shadowed + len(self._memtable)
+
+    def document_ids(self) -> list:
+        """
+        :return: Sorted ids of the live documents: the memtable and the disk segments without deleted or shadowed ids
+        """
+        with self._lock:
+            live = (self._sealed_live - self._memtable_deletes) | self._memtable.keys()
+        return sorted(live)
+
+    def terms(self) -> set:
+        with self._lock:
+            terms = {term for term_count in self._memtable.values() for term in term_count}
+            segments = self._acquire_segments()
+        try:
+            for segment, _ in segments:
+                terms.update(segment.terms())
+        finally:
+            self._release_segments(segments)
+        return terms
+
+    def num_segments(self) -> int:
+        return len(self._segments)
+
+
+class SegmentedPostingsView(Mapping):
+    """
+    Read-only term -> sorted doc ids mapping over a SegmentedIndex, so it can be used as inverted_index of an
+    InvertedListBooleanModel.
+    """
+
+    def __init__(self, index: SegmentedIndex):
+        self.index = index
+
+    def __getitem__(self, term: str) -> list[int]:
+        doc_ids = [doc_id for doc_id, _ in self.index.postings(term)]
+        if not doc_ids:
+            raise KeyError(term)
+        return doc_ids
+
+    def __contains__(self, term) -> bool:
+        return bool(self.index.postings(term))
+
+    def __iter__(self):
+        return iter(self.index.terms())
+
+    def __len__(self) -> int:
+        return len(self.index.terms())
+
+
+class SegmentedBooleanModel(InvertedListBooleanModel):
+    def __init__(self, directory: str, stopword_filtering=False, stemming=False, **options):
+        super().__init__()
+        self.segmented_index = SegmentedIndex(
+            directory,
+            representation=lambda document: self.document_to_representation(document, stopword_filtering, stemming),
+            **options,
+        )
+        self.inverted_index = SegmentedPostingsView(self.segmented_index)
+
+    @property
+    def document_ids(self) -> list:
+        # Resolved at query time (needed for negations), so documents added or removed later are taken into account.
+        return self.segmented_index.document_ids()
+
+    @document_ids.setter
+    def document_ids(self, document_ids):
+        pass  # the live ids always come from the segmented index
+
+    def build_inverted_index(self, collection: list[Document], stopword_filtering=False, stemming=False):
+        for document in collection:
+            self.segmented_index.add_document(document)
+        self.segmented_index.flush()
+
+    def __str__(self):
+        return 'Boolean Model (Segmented Inverted List)'
+
+
+class SegmentedVectorSpaceModel(VectorSpaceModel):
+    def __init__(self, directory: str, stopword_filtering=False, stemming=False, **options):
+        super().__init__()
+        self.stopword_filtering = stopword_filtering  # search mode of the indexed representations
+        self.stemming = stemming
+        self.segmented_index = SegmentedIndex(
+            directory,
+            representation=lambda document: self.document_to_representation(document, self.stopword_filtering,
+                                                                             self.stemming),
+            **options,
+        )
+
+    def build_inverted_index(self, documents: list[Document], stopword_filtering=False, stemming=False):
+        """
+        Adds the documents in the given search mode, which is also used for documents added later on.
+        """
+        self.stopword_filtering = stopword_filtering
+        self.stemming = stemming
+        for document in documents:
+            self.segmented_index.add_document(document)
+        self.segmented_index.flush()
+
+    def is_built(self) -> bool:
+        return self.segmented_index.num_documents() > 0
+
+    def top_k(self, query: str, k: int, stats: dict = None) -> list[tuple]:
+        num_documents = self.segmented_index.num_documents()
+        cursors = []
+        for term, weight in self.query_to_vector(query).items():
+            postings = self.segmented_index.postings(term)
+            if postings:
+                idf = math.log10(num_documents / len(postings))
+                cursors.append(topk.TfIdfCursor(postings, weight, idf, max(tf for _, tf in postings)))
+        return topk.maxscore_top_k(cursors, k, stats)
+
+    def __str__(self):
+        return 'Vector Space Model (Segmented)'
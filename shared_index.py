@@ -0,0 +1,292 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from multiprocessing import shared_memory
+import instrumentation
+import models
+import scoring
+import topk
+
+# Layout (little endian, every section starts at a multiple of 8):
+#   header             magic, version, number of terms, documents and postings, offset of every section,
+#                      length of the scorer description
+#   term offsets       uint64 [terms + 1]: postings of term t are postings[term_offsets[t]:term_offsets[t + 1]]
+#   text offsets       uint64 [terms + 1]: term t is term_texts[text_offsets[t]:text_offsets[t + 1]]
+#   max weights        float64 [terms]: highest posting weight of every term (MaxScore upper bound)
+#   query weights      float64 [terms]: Scorer.query_weight(term, 1)
+#   postings           uint32 [postings]: document ordinals, ascending per term
+#   weights            float64 [postings]: Scorer.score() of every posting; document length normalization (the
+#                      cosine norms of the tf-idf scorer, the length ratio of BM25) is folded into these weights
+#   document ids       int64 [documents]: ordinal -> document id, ascending
+#   term texts         utf-8 terms in ascending byte order, for binary search
+#   scorer             JSON array, Scorer.key() of the scorer that computed the weights
+MAGIC = b'IRFX'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHIIQ' + 'Q' * 9 + 'I')
+_SECTIONS = (
+    ('term_offsets', 'Q'),
+    ('text_offsets', 'Q'),
+    ('max_weights', 'd'),
+    ('query_weights', 'd'),
+    ('postings', 'I'),
+    ('weights', 'd'),
+    ('document_ids', 'q'),
+)
+_SCORERS = {cls.__name__: cls for cls in (scoring.BM25Scorer, scoring.TfIdfCosineScorer, scoring.LanguageModelScorer)}
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def build_flat_index(statistics: scoring.CollectionStatistics, scorer: scoring.Scorer) -> bytes:
+    """
+    Serializes the postings of a collection, weighted by a scorer, into flat typed arrays.
+    :return: The index as one block of bytes, for write_flat_index(), publish_flat_index() or FlatIndex()
+    :raises ValueError: if the scorer cannot be reconstructed from its key
+    """
+    key = list(scorer.key())
+    if key[0] not in _SCORERS:
+        raise ValueError(f'Unsupported scorer {scorer}')
+    bounds = statistics.upper_bounds(scorer)  # prepares the scorer
+    document_ids = sorted(statistics.document_lengths)
+    ordinals = {doc_id: ordinal for ordinal, doc_id in enumerate(document_ids)}
+    terms = sorted(statistics.postings, key=lambda term: term.encode('utf-8'))
+
+    sections = {name: array(typecode) for name, typecode in _SECTIONS}
+    sections['term_offsets'].append(0)
+    sections['text_offsets'].append(0)
+    sections['document_ids'].extend(document_ids)
+    texts = []
+    for term in terms:
+        encoded = term.encode('utf-8')
+        texts.append(encoded)
+        sections['text_offsets'].append(sections['text_offsets'][-1] + len(encoded))
+        for doc_id, tf in statistics.postings[term]:
+            sections['postings'].append(ordinals[doc_id])
+            sections['weights'].append(scorer.score(term, tf, doc_id))
+        sections['term_offsets'].append(len(sections['postings']))
+        sections['max_weights'].append(bounds[term])
+        sections['query_weights'].append(scorer.query_weight(term, 1))
+
+    if sys.byteorder != 'little':
+        for data in sections.values():
+            data.byteswap()
+    blocks = [data.tobytes() for data in sections.values()] + [b''.join(texts), json.dumps(key).encode('utf-8')]
+
+    offsets = []
+    position = _align(_HEADER.size)
+    for block in blocks:
+        offsets.append(position)
+        position = _align(position + len(block))
+    output = bytearray(position)
+    _HEADER.pack_into(output, 0, MAGIC, VERSION, len(terms), len(document_ids), len(sections['postings']), *offsets,
+                      len(blocks[-1]))
+    for offset, block in zip(offsets, blocks):
+        output[offset:offset + len(block)] = block
+    return bytes(output)
+
+
+class FlatIndex(object):
+    """
+    Read-only view of a flat index in a buffer (mmap, shared memory or bytes). The arrays are memoryview casts of the
+    buffer, nothing is copied or decoded when the index is opened, so any number of processes can map the same index
+    and the memory is shared between them. Terms are found by binary search over the term texts.
+    The typed arrays are used in native byte order, so the index can only be opened on little endian machines.
+    """
+
+    def __init__(self, buffer, release=None):
+        """
+        :param buffer: Object supporting the buffer protocol that contains an index written by build_flat_index()
+        :param release: Function called by close() after the views were released, e.g. to close the mmap
+        :raises ValueError: if the buffer does not contain a flat index
+        """
+        self._views = []  # casts of the buffer, released before the buffer itself
+        self._release = None
+        if sys.byteorder != 'little':
+            raise ValueError('Flat indexes can only be mapped on little endian machines')
+        view = memoryview(buffer).cast('B')
+        if len(view) < _HEADER.size:
+            view.release()
+            raise ValueError('Buffer does not contain a flat index')
+        magic, version, num_terms, num_documents, num_postings, *offsets, scorer_length = \
+            _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            view.release()
+            raise ValueError('Buffer does not contain a flat index')
+
+        self.num_terms = num_terms
+        self.num_documents = num_documents
+        self.num_postings = num_postings
+        self._views.append(view)
+        self._release = release
+        lengths = (num_terms + 1, num_terms + 1, num_terms, num_terms, num_postings, num_postings, num_documents)
+        for (name, typecode), offset, length in zip(_SECTIONS, offsets, lengths):
+            size = array(typecode).itemsize
+            section = view[offset:offset + length * size].cast(typecode)
+            self._views.append(section)
+            setattr(self, name, section)
+        self.term_texts = view[offsets[7]:offsets[7] + self.text_offsets[num_terms]]
+        self._views.append(self.term_texts)
+        name, *parameters = json.loads(bytes(view[offsets[8]:offsets[8] + scorer_length]))
+        self.scorer = _SCORERS[name](*parameters)  # only used for query_tf_weight(), needs no statistics
+
+    def find(self, term: str) -> int:
+        """
+        :return: Position of a term in the term table, or -1 if the term is not indexed
+        """
+        key = term.encode('utf-8')
+        text_offsets = self.text_offsets
+        term_texts = self.term_texts
+        low, high = 0, self.num_terms
+        while low < high:
+            middle = (low + high) // 2
+            middle_term = term_texts[text_offsets[middle]:text_offsets[middle + 1]].tobytes()
+            if middle_term < key:
+                low = middle + 1
+            elif middle_term > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def document_frequency(self, term: str) -> int:
+        position = self.find(term)
+        return self.term_offsets[position + 1] - self.term_offsets[position] if position >= 0 else 0
+
+    def cursor(self, position: int, query_weight: float) -> 'FlatCursor':
+        start, end = self.term_offsets[position], self.term_offsets[position + 1]
+        return FlatCursor(self.postings[start:end], self.weights[start:end], query_weight,
+                          self.max_weights[position])
+
+    def close(self):
+        """
+        Releases the views and the buffer. Cursors must not be used afterwards.
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FlatCursor(topk.TermCursor):
+    """
+    Cursor over the postings of one term in a FlatIndex. Document ordinals stand in for document ids while ranking;
+    they are ordered like the ids, so ties are broken the same way.
+    """
+
+    def __init__(self, postings: memoryview, weights: memoryview, query_weight: float, max_weight: float):
+        super().__init__(postings, query_weight, max_weight)
+        self.weights = weights
+
+    def doc_id(self):
+        return self.postings[self.position] if self.position < len(self.postings) else None
+
+    def score(self) -> float:
+        return self.weights[self.position] * self.query_weight
+
+    def seek(self, doc_id: int):
+        self.position = bisect_left(self.postings, doc_id, self.position)
+
+
+class FlatVectorSpaceModel(models.VectorSpaceModel):
+    """
+    Read-only VectorSpaceModel over a FlatIndex. Returns the same rankings as a VectorSpaceModel with the scorer the
+    index was built with, but holds no per-process dictionaries, lists or tuples.
+    """
+
+    def __init__(self, index: FlatIndex):
+        super().__init__(index.scorer)
+        self.index = index
+
+    def build_inverted_index(self, documents, stopword_filtering=False, stemming=False):
+        raise TypeError('A FlatVectorSpaceModel is read-only, build a VectorSpaceModel and convert its statistics')
+
+    def is_built(self) -> bool:
+        return True
+
+    def top_k(self, query: str, k: int, stats: dict = None) -> list[tuple]:
+        index = self.index
+        cursors = []
+        query_counts = Counter(self.query_to_representation(query))
+        with instrumentation.timer('posting_fetch'):
+            for term, query_tf in query_counts.items():
+                position = index.find(term)
+                if position >= 0:
+                    query_weight = self.scorer.query_tf_weight(query_tf) * index.query_weights[position]
+                    cursor = index.cursor(position, query_weight)
+                    instrumentation.count('postings_fetched', len(cursor.postings))
+                    cursors.append(cursor)
+        document_ids = index.document_ids
+        return [(score, document_ids[ordinal]) for score, ordinal in topk.maxscore_top_k(cursors, k, stats)]
+
+    def __str__(self):
+        return f'Vector Space Model ({self.scorer}, flat index)'
+
+
+def write_flat_index(data: bytes, file_path: str):
+    """
+    Writes an index built by build_flat_index() to a file. The file is replaced atomically.
+    """
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, file_path)
+
+
+def open_flat_index(file_path: str) -> FlatIndex:
+    """
+    Memory maps an index file; processes that open the same file share its pages.
+    :raises ValueError: if the file is not a flat index
+    """
+    with open(file_path, 'rb') as file:
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            raise ValueError(f'{file_path} is not a flat index')
+    try:
+        return FlatIndex(mapping, mapping.close)
+    except ValueError:
+        mapping.close()
+        raise ValueError(f'{file_path} is not a flat index')
+
+
+def publish_flat_index(data: bytes, name: str = None) -> shared_memory.SharedMemory:
+    """
+    Copies an index built by build_flat_index() into a new shared memory block, which worker processes open with
+    attach_flat_index(block.name). The caller owns the block: it must close() and unlink() it when all workers are
+    done.
+    """
+    block = shared_memory.SharedMemory(name, create=True, size=len(data))
+    block.buf[:len(data)] = data
+    return block
+
+
+def attach_flat_index(name: str) -> FlatIndex:
+    """
+    Maps an index published by publish_flat_index() without copying it. Before Python 3.13 the block is registered
+    with the resource tracker, which multiprocessing workers share with the publisher; a process that was not started
+    by the publisher would unlink the block when it exits.
+    """
+    try:
+        block = shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # Python < 3.13
+        block = shared_memory.SharedMemory(name)
+    return FlatIndex(block.buf, block.close)
@@ -0,0 +1,121 @@
+from collections import Counter
+from document import Document
+import instrumentation
+from models import VectorSpaceModel
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional dependencies, only needed for this backend
+    np = None
+    sparse = None
+
+
+class SparseVectorSpaceModel(VectorSpaceModel):
+    """
+    Vector Space Model backed by a SciPy CSR document-term matrix. Document weights are the same log-tf * idf values
+    as in VectorSpaceModel, but they are computed with NumPy and many queries are scored with one sparse matrix
+    product. Query terms are weighted with log-tf * idf as well, using the idf of the collection, so a query of a
+    single term still ranks by that term. Requires numpy and scipy.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError('SparseVectorSpaceModel requires numpy and scipy')
+        super().__init__()
+        self.vocabulary = {}  # term -> column
+        self.idf = None  # column -> idf of the term in the collection
+        self.doc_ids = None  # row -> document id
+        self.matrix = None  # documents x terms, CSR
+        self.norms = None  # L2 norm of every row
+
+    @instrumentation.timed('index_build')
+    def build_matrix(self, documents: list[Document], stopword_filtering=False, stemming=False):
+        self.vocabulary = {}
+        indptr = [0]
+        indices = []
+        counts = []
+        doc_ids = []
+        for document in documents:
+            terms = self.document_to_representation(document, stopword_filtering, stemming)
+            for term, count in Counter(terms).items():
+                indices.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                counts.append(count)
+            indptr.append(len(indices))
+            doc_ids.append(document.document_id)
+
+        num_documents = len(doc_ids)
+        indices = np.asarray(indices, dtype=np.int64)
+        tf = 1 + np.log10(np.asarray(counts, dtype=np.float64))
+        document_frequency = np.bincount(indices, minlength=len(self.vocabulary))
+        idf = np.log10(num_documents / np.maximum(document_frequency, 1))
+
+        self.idf = idf
+        self.matrix = sparse.csr_matrix(
+            (tf * idf[indices], indices, np.asarray(indptr, dtype=np.int64)),
+            shape=(num_documents, len(self.vocabulary)),
+        )
+        self.norms = np.sqrt(np.asarray(self.matrix.multiply(self.matrix).sum(axis=1)).ravel())
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.document_lengths = dict(zip(doc_ids, self.norms.tolist()))
+
+    def queries_to_matrix(self, queries: list[str]):
+        """
+        :return: CSR matrix of shape (number of queries, number of terms) with the log-tf * idf weight of every query
+                 term that occurs in the collection
+        """
+        rows = []
+        columns = []
+        weights = []
+        for row, query in enumerate(queries):
+            for term, count in Counter(self.query_to_representation(query)).items():
+                column = self.vocabulary.get(term)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+                    weights.append((1 + np.log10(count)) * self.idf[column])
+        return sparse.csr_matrix((weights, (rows, columns)), shape=(len(queries), len(self.vocabulary)))
+
+    def score_queries(self, queries: list[str], normalize=False):
+        """
+        Scores all documents for all queries with a single sparse matrix product.
+        :param queries: List of query strings
+        :param normalize: Divide the scores by the document norms (cosine similarity without query normalization)
+        :return: Dense array of shape (number of queries, number of documents)
+        """
+        scores = (self.queries_to_matrix(queries) @ self.matrix.T).toarray()
+        if normalize:
+            scores /= np.where(self.norms > 0, self.norms, 1.0)
+        return scores
+
+    @instrumentation.timed('scoring')
+    def top_k_batch(self, queries: list[str], k: int, normalize=False) -> list[list[tuple]]:
+        """
+        Returns the k best documents for every query. Candidates are selected with np.partition, only the candidates
+        are sorted. As in VectorSpaceModel.top_k(), documents need a positive score and ties are broken by document id.
+        :return: One list of (score, doc_id) tuples per query, best first
+        """
+        if not queries:
+            return []
+        scores = self.score_queries(queries, normalize)
+        num_documents = scores.shape[1]
+        k = min(k, num_documents)
+        if k <= 0:
+            return [[] for _ in queries]
+
+        kth_scores = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        results = []
+        for row, kth_score in zip(scores, kth_scores):
+            candidates = np.flatnonzero((row >= kth_score) & (row > 0))
+            order = np.lexsort((self.doc_ids[candidates], -row[candidates]))[:k]
+            results.append([(float(row[c]), int(self.doc_ids[c])) for c in candidates[order]])
+        return results
+
+    def build_inverted_index(self, documents: list[Document], stopword_filtering=False, stemming=False):
+        self.build_matrix(documents, stopword_filtering, stemming)
+
+    def top_k(self, query: str, k: int, stats: dict = None) -> list[tuple]:
+        return self.top_k_batch([query], k)[0]
+
+    def __str__(self):
+        return 'Vector Space Model (Sparse Matrix)'
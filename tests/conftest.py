@@ -0,0 +1,40 @@
+import random
+import pytest
+from collection_store import CollectionStore
+from document import Document
+
+WORDS = ('the', 'fox', 'crow', 'lion', 'wolf', 'grapes', 'cheese', 'and', 'a', 'running', 'runs', 'hunter',
+         'mouse', 'eagle', 'tortoise', 'hare', 'sour', 'flattered', 'strength', 'of')
+
+
+def make_documents(count=80, seed=7) -> list[Document]:
+    """
+    Random documents over a small vocabulary, so every term occurs in many documents and phrases and NEAR queries
+    have both matches and near misses.
+    """
+    rng = random.Random(seed)
+    documents = []
+    for document_id in range(count):
+        terms = [rng.choice(WORDS) for _ in range(rng.randint(3, 40))]
+        document = Document()
+        document.document_id = document_id
+        document.title = f'Document {document_id}'
+        document.raw_text = ' '.join(terms)
+        document.terms = terms
+        documents.append(document)
+    return documents
+
+
+@pytest.fixture
+def collection() -> CollectionStore:
+    return CollectionStore(make_documents())
+
+
+@pytest.fixture
+def data_directory(tmp_path, monkeypatch):
+    """
+    Runs the test in an empty working directory, so the indexes ir_system writes to data/ do not touch the real ones.
+    """
+    (tmp_path / 'data').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,29 @@
+import os
+import cleanup
+import extraction
+
+SOURCE = os.path.join(os.path.dirname(__file__), os.pardir, 'raw_data', 'aesopa10.txt')
+STOP_WORDS = ['the', 'a', 'and', 'of', 'it']
+
+
+def test_tokenize_matches_the_separate_passes():
+    normalizer = cleanup.TextNormalizer(STOP_WORDS)
+    texts = ["The Fox's -- grapes, and IT's sour!", '']
+    texts += [' '.join(fable[3:]) for _, fable in extraction.iter_split_collection(SOURCE)]
+    for text in texts:
+        assert normalizer.tokenize(text) == normalizer.filter_terms(cleanup.remove_symbols(text).split())
+
+
+def test_normalizer_caches_are_bounded():
+    normalizer = cleanup.TextNormalizer(STOP_WORDS, max_size=10)
+    terms = [f'Term{i}!' for i in range(25)] + ['The']
+    assert normalizer.filter_terms(terms) == [f'term{i}' for i in range(25)]
+    assert normalizer.tokenize(' '.join(terms)) == [f'term{i}' for i in range(25)]
+    assert len(normalizer._normalized) <= 10
+
+
+def test_normalizer_is_reused_per_stop_word_list():
+    assert cleanup.remove_stop_words_from_term_list(['The', 'Fox'], STOP_WORDS) == ['fox']
+    assert cleanup.remove_stop_words_from_term_list(['The', 'Fox'], list(reversed(STOP_WORDS))) == ['fox']
+    assert cleanup.remove_stop_words_from_term_list(['The', 'Fox'], ['fox']) == ['the']
+    assert cleanup._cached_normalizer.cache_info().hits >= 1
@@ -0,0 +1,79 @@
+import json
+import pytest
+import collection_snapshot
+import extraction
+import representation
+from conftest import make_documents
+
+STOP_WORDS = ['the', 'a', 'and', 'of']
+
+
+def representations(document) -> tuple:
+    return (document.document_id, document.title, document.raw_text, document.terms, document.filtered_term_ids,
+            document.stemmed_term_ids, document.filtered_stemmed_term_ids)
+
+
+def test_snapshot_round_trip(tmp_path):
+    documents = make_documents()
+    documents[0].title = 'Ünïcode – title'
+    documents[0].raw_text = 'ünïcode text'
+    pipeline = representation.RepresentationPipeline(STOP_WORDS)
+    for document in documents[::2]:
+        pipeline.term_ids(document, stopword_filtering=True, stemming=True)  # computes filtered, filtered + stemmed
+    for document in documents[::3]:
+        pipeline.term_ids(document, stemming=True)
+    path = str(tmp_path / 'collection.bin')
+    collection_snapshot.write_collection_snapshot(documents, path, STOP_WORDS)
+
+    loaded = collection_snapshot.load_collection_snapshot(path, list(reversed(STOP_WORDS)))
+
+    assert [representations(document) for document in loaded] == [representations(document) for document in documents]
+
+
+def test_filtered_representations_of_another_stop_word_list_are_not_loaded(tmp_path):
+    documents = make_documents(count=10)
+    pipeline = representation.RepresentationPipeline(STOP_WORDS)
+    for document in documents:
+        pipeline.term_ids(document, stopword_filtering=True, stemming=True)
+        pipeline.term_ids(document, stemming=True)
+    path = str(tmp_path / 'collection.bin')
+    collection_snapshot.write_collection_snapshot(documents, path, STOP_WORDS)
+
+    stale = collection_snapshot.load_collection_snapshot(path, STOP_WORDS + ['fox'])
+    assert all(d.filtered_term_ids is None and d.filtered_stemmed_term_ids is None for d in stale)
+    assert [(d.terms, d.stemmed_term_ids) for d in stale] == [(d.terms, d.stemmed_term_ids) for d in documents]
+
+    collection_snapshot.write_collection_snapshot(documents, path)  # list not recorded
+    assert all(d.filtered_term_ids is None for d in collection_snapshot.load_collection_snapshot(path, STOP_WORDS))
+    assert all(d.filtered_term_ids is not None for d in collection_snapshot.load_collection_snapshot(path))
+
+
+def test_json_collection_without_derived_representations(tmp_path):
+    path = tmp_path / 'collection.json'
+    path.write_text(json.dumps([
+        {'document_id': 0, 'title': 'The Fox', 'raw_text': 'the fox', 'terms': ['the', 'fox']},
+        {'document_id': 1, 'title': 'The Crow', 'raw_text': 'the crow', 'terms': ['the', 'crow'],
+         'filtered_terms': [], 'stemmed_terms': None},
+        {'document_id': 2, 'title': 'The Lion', 'raw_text': 'the lion', 'terms': ['the', 'lion'],
+         'filtered_terms': ['lion'], 'stemmed_terms': ['the', 'lion']},
+    ]))
+
+    documents = extraction.load_collection_from_json(str(path))
+
+    assert [(d.filtered_term_ids, d.stemmed_term_ids) for d in documents[:2]] == [(None, None), (None, None)]
+    assert (documents[2].filtered_terms, documents[2].stemmed_terms) == (['lion'], ['the', 'lion'])
+    extraction.save_collection_as_json(documents, str(path))
+    assert [d.stemmed_term_ids for d in extraction.load_collection_from_json(str(path))][:2] == [None, None]
+
+
+def test_other_versions_are_not_loaded(tmp_path):
+    path = tmp_path / 'collection.bin'
+    collection_snapshot.write_collection_snapshot(make_documents(count=3), str(path))
+    data = bytearray(path.read_bytes())
+    data[4:6] = (collection_snapshot.VERSION - 1).to_bytes(2, 'little')
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        collection_snapshot.load_collection_snapshot(str(path))
+    path.write_bytes(collection_snapshot.MAGIC)
+    with pytest.raises(ValueError):
+        collection_snapshot.load_collection_snapshot(str(path))
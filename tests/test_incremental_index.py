@@ -0,0 +1,64 @@
+import pytest
+import models
+from conftest import make_documents
+from incremental_index import IncrementalVectorSpaceModel
+
+QUERIES = ('fox', 'fox crow', 'the lion and the wolf', 'sour grapes', 'hare tortoise hare', 'unknown')
+
+
+def assert_same_ranking(model, reference, k=10):
+    for query in QUERIES:
+        ranking = model.top_k(query, k)
+        expected = reference.top_k(query, k)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected]
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+
+
+@pytest.mark.parametrize('stopword_filtering, stemming', [(False, False), (True, True)])
+def test_incremental_index_matches_rebuilt_model(stopword_filtering, stemming):
+    documents = make_documents()
+    model = IncrementalVectorSpaceModel(buffer_size=8, max_segments=2)
+    model.build_inverted_index(documents[:50], stopword_filtering, stemming)
+
+    for document in documents[50:]:
+        model.add_document(document)
+    for doc_id in range(0, 80, 7):
+        model.remove_document(doc_id)
+    replacements = make_documents(seed=11)[20:30]
+    for document in replacements:
+        model.update_document(document)
+    model.merge_segments()
+    model.add_document(documents[0])  # re-added after the delete, lives in the buffer
+
+    live = {document.document_id: document for document in documents if document.document_id % 7}
+    live.update({document.document_id: document for document in replacements})
+    live[0] = documents[0]
+    reference = models.VectorSpaceModel()
+    reference.build_inverted_index(sorted(live.values(), key=lambda d: d.document_id), stopword_filtering, stemming)
+
+    assert len(model) == len(live)
+    assert_same_ranking(model, reference)
+
+
+def make_document(doc_id: int, text: str):
+    document = make_documents(count=1)[0]
+    document.document_id = doc_id
+    document.terms = text.split()
+    return document
+
+
+def test_updating_a_buffered_document_replaces_its_postings():
+    model = IncrementalVectorSpaceModel(buffer_size=64)
+    model.build_inverted_index([make_document(2, 'wolf crow'), make_document(3, 'hare')])
+    model.add_document(make_document(1, 'fox crow'))
+    model.update_document(make_document(1, 'lion crow'))
+
+    assert model.live_postings('crow') == [(1, 1), (2, 1)]
+    assert model.live_postings('fox') == []
+    assert model.live_postings('lion') == [(1, 1)]
+    assert sorted(doc_id for _, doc_id in model.top_k('crow hare', 10)) == [1, 2, 3]
+    assert model.document_frequency['crow'] == 2 and 'fox' not in model.document_frequency
+
+    model.remove_document(1)
+    assert model.live_postings('crow') == [(2, 1)]
+    assert len(model) == 2
@@ -0,0 +1,64 @@
+import random
+import pytest
+import index_storage
+from postings_cache import CachedInvertedIndex
+
+
+def test_vbyte_round_trip():
+    numbers = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32 - 1, 2 ** 40]
+    assert index_storage.decode_vbyte(index_storage.encode_vbyte(numbers)) == numbers
+    doc_ids = sorted(random.Random(1).sample(range(10 ** 6), 1000))
+    assert index_storage.decode_postings(index_storage.encode_postings(doc_ids)) == doc_ids
+
+
+@pytest.mark.parametrize('frequencies', [False, True])
+def test_inverted_index_round_trip(tmp_path, frequencies):
+    rng = random.Random(2)
+    terms = ['fox', 'crow', 'über', 'a' * 300, 'grapes', 'the']
+    inverted_index = {}
+    for term in terms:
+        doc_ids = sorted(rng.sample(range(5000), rng.randint(1, 400)))
+        inverted_index[term] = [(doc_id, rng.randint(1, 9)) for doc_id in doc_ids] if frequencies else doc_ids
+    path = str(tmp_path / 'index.bin')
+    index_storage.write_inverted_index(inverted_index, path, 5000, stopword_filtering=True, stemming=False,
+                                       frequencies=frequencies)
+
+    with index_storage.DiskInvertedIndex(path) as index:
+        assert (index.num_documents, index.stopword_filtering, index.stemming, index.frequencies) == \
+            (5000, True, False, frequencies)
+        assert sorted(index) == sorted(terms) and len(index) == len(terms)
+        for term, postings in inverted_index.items():
+            assert term in index
+            assert index.document_frequency(term) == len(postings)
+            if frequencies:
+                assert index.postings_with_frequencies(term) == postings
+                assert index[term] == [doc_id for doc_id, _ in postings]
+            else:
+                assert index[term] == postings
+        assert 'wolf' not in index
+        assert index.get('wolf', []) == []
+        assert index.document_frequency('wolf') == 0
+
+
+def test_not_an_index_file_raises(tmp_path):
+    path = tmp_path / 'index.bin'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        index_storage.DiskInvertedIndex(str(path))
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        index_storage.DiskInvertedIndex(str(path))
+    path.write_bytes(index_storage.MAGIC)  # shorter than the header
+    with pytest.raises(ValueError):
+        index_storage.DiskInvertedIndex(str(path))
+
+
+def test_postings_cache_tracks_a_bounded_number_of_indexed_terms(tmp_path):
+    path = str(tmp_path / 'index.bin')
+    index_storage.write_inverted_index({'crow': [1, 2], 'fox': [1], 'lion': [3]}, path, 4)
+    with CachedInvertedIndex(index_storage.DiskInvertedIndex(path), max_tracked_terms=2) as cache:
+        for term in ['fox', 'fox', 'crow', 'lion', 'lion', 'lion'] + [f'unknown{i}' for i in range(100)]:
+            cache.get(term, [])
+
+        assert cache.term_statistics() == [('fox', 1, 1), ('crow', 0, 1)]
+        assert (cache.hits, cache.misses) == (3, 103)
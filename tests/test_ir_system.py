@@ -0,0 +1,16 @@
+import ir_system
+
+
+def test_positional_index_is_built_for_the_first_positional_query(collection, data_directory):
+    system = ir_system.InformationRetrievalSystem(collection)
+    ir_system.MODEL_SELECTORS['inverted'](system)
+
+    system.search('fox AND NOT (crow OR lion)', False, False)
+    assert system.model.positional_index is None
+
+    results = system.search('"the fox"', False, False, k=len(collection))
+    assert system.model.positional_index is not None
+    assert [document.document_id for _, document in results] == [
+        document.document_id for document in collection
+        if any(document.terms[i:i + 2] == ['the', 'fox'] for i in range(len(document.terms)))
+    ]
@@ -0,0 +1,50 @@
+import pytest
+import models
+from conftest import make_documents
+from test_query_parser import expected_ids, queries
+
+
+@pytest.fixture
+def documents():
+    return make_documents()
+
+
+def test_linear_model_matches_brute_force(documents):
+    model = models.LinearBooleanModel(documents)
+    for query in queries():
+        query_representation = model.query_to_representation(query)
+        results = [document.document_id for document in documents
+                   if model.match(model.document_to_representation(document), query_representation)]
+        assert results == expected_ids(documents, query), query
+
+
+def test_inverted_list_model_matches_brute_force(documents):
+    model = models.InvertedListBooleanModel()
+    model.build_inverted_index(documents)
+    model.build_positional_index(documents)
+    for query in queries():
+        assert model.search(query) == expected_ids(documents, query), query
+
+
+def test_inverted_list_model_on_disk_matches_brute_force(documents, tmp_path):
+    built = models.InvertedListBooleanModel()
+    built.build_inverted_index(documents)
+    built.save_inverted_index(str(tmp_path / 'index.bin'), len(documents))
+
+    model = models.InvertedListBooleanModel()
+    model.load_inverted_index(str(tmp_path / 'index.bin'), [d.document_id for d in documents], cache_bytes=4096)
+    model.build_positional_index(documents)
+    try:
+        for query in queries():
+            assert model.search(query) == expected_ids(documents, query), query
+    finally:
+        model.inverted_index.close()
+
+
+@pytest.mark.parametrize('signature_width, bits_per_term', [(256, 2), (16, 1)])
+def test_signature_model_matches_brute_force(documents, signature_width, bits_per_term):
+    model = models.SignatureBasedBooleanModel(signature_width, bits_per_term)
+    model.build_signature_index(documents)
+    for query in queries():
+        assert model.search(query) == expected_ids(documents, query), query
+    assert 0.0 <= model.false_drop_rate() <= 1.0
@@ -0,0 +1,34 @@
+import os
+import pytest
+import models
+import pipeline
+
+SOURCE = os.path.join(os.path.dirname(__file__), os.pardir, 'raw_data', 'aesopa10.txt')
+
+
+def test_streamed_shards_match_serial_build():
+    serial = pipeline.build_collection(SOURCE, ['the', 'a'], True, True, False, workers=1)
+    sharded = pipeline.build_collection(SOURCE, ['the', 'a'], True, True, False, workers=2, shard_size=5)
+
+    assert [document.document_id for document in sharded.documents] == list(range(len(serial.documents)))
+    assert [(d.terms, d.filtered_terms, d.stemmed_terms) for d in sharded.documents] == \
+        [(d.terms, d.filtered_terms, d.stemmed_terms) for d in serial.documents]
+    assert sharded.inverted_index == serial.inverted_index
+    assert sharded.document_frequency == serial.document_frequency
+    assert sharded.document_frequency == {term: len(doc_ids) for term, doc_ids in serial.inverted_index.items()}
+
+
+def test_serial_build_leaves_the_worker_settings_alone():
+    pipeline.build_collection(SOURCE, ['the', 'a'], True, True, True, workers=1)
+    assert pipeline._worker_representation is None and not pipeline._worker_index_stopword_filtering
+
+
+def test_merged_term_counts_match_a_vector_space_model_build():
+    build = pipeline.build_collection(SOURCE, ['the', 'a'], True, True, False, workers=2, shard_size=5)
+    model = build.to_vector_space_model()
+    reference = models.VectorSpaceModel()
+    reference.build_inverted_index(build.documents, stopword_filtering=True)
+    for query in ('fox', 'the lion and the wolf', 'sour grapes'):
+        ranking, expected = model.top_k(query, 10), reference.top_k(query, 10)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected], query
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
@@ -0,0 +1,23 @@
+import concurrent.futures
+import porter
+from document import vocabulary
+
+TERMS = ['running', 'flattered', 'strength', 'hopping', 'generalization', 'caresses', 'ponies', 'relational'] * 50
+
+
+def test_stem_cache_is_bounded_and_thread_safe():
+    cache = porter.StemCache(max_size=3)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        stems = list(executor.map(cache.stem, TERMS))
+
+    assert stems == [porter.stem_term(term) for term in TERMS]
+    assert len(cache) == 3
+    assert cache.hits + cache.misses == len(TERMS)
+
+
+def test_stem_term_ids_uses_the_bounded_id_cache(monkeypatch):
+    monkeypatch.setattr(porter, 'stem_id_cache', porter.StemCache(max_size=2))
+    term_ids = vocabulary.encode(TERMS)
+
+    assert vocabulary.decode(porter.stem_term_ids(term_ids)) == [porter.stem_term(term) for term in TERMS]
+    assert len(porter.stem_id_cache) == 2
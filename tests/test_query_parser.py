@@ -0,0 +1,133 @@
+import random
+import pytest
+import query_parser
+from conftest import WORDS, make_documents
+from positional_index import PositionalIndex
+from query_parser import And, Near, Not, Or, Phrase, QueryPlanner, QuerySyntaxError, Term, parse_query
+
+FIXED_QUERIES = (
+    'fox', 'FOX', 'fox crow', 'fox AND crow', 'fox OR crow', 'NOT fox', 'fox AND NOT crow', 'NOT NOT fox',
+    '(lion OR wolf) AND NOT "the lion"', '"the fox"', '"sour grapes and"', 'fox NEAR/0 fox', 'fox NEAR/3 crow',
+    'fox NEAR/1 crow OR "the hare"', 'NOT (fox AND crow) AND NOT hare', 'unknown', 'unknown OR fox', 'NOT unknown',
+)
+
+
+def brute_force(node, terms: list[str]) -> bool:
+    """
+    Reference semantics of a query tree on the term list of one document.
+    """
+    if isinstance(node, Term):
+        return node.term in terms
+    if isinstance(node, Phrase):
+        length = len(node.terms)
+        return any(terms[i:i + length] == node.terms for i in range(len(terms)))
+    if isinstance(node, Near):
+        return any(abs(i - j) <= node.distance
+                   for i, left in enumerate(terms) if left == node.left
+                   for j, right in enumerate(terms) if right == node.right)
+    if isinstance(node, Not):
+        return not brute_force(node.child, terms)
+    if isinstance(node, And):
+        return all(brute_force(child, terms) for child in node.children)
+    return any(brute_force(child, terms) for child in node.children)
+
+
+def random_query(rng: random.Random, depth=3) -> str:
+    choice = rng.randrange(7 if depth else 3)
+    if choice == 0:
+        return rng.choice(WORDS)
+    if choice == 1:
+        return '"' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 3))) + '"'
+    if choice == 2:
+        return f'{rng.choice(WORDS)} NEAR/{rng.randint(0, 4)} {rng.choice(WORDS)}'
+    if choice == 3:
+        return 'NOT ' + random_query(rng, depth - 1)
+    operator = (' AND ', ' OR ', ' ')[choice - 4]
+    return '(' + operator.join(random_query(rng, depth - 1) for _ in range(rng.randint(2, 3))) + ')'
+
+
+def queries() -> list[str]:
+    rng = random.Random(3)
+    return list(FIXED_QUERIES) + [random_query(rng) for _ in range(200)]
+
+
+def expected_ids(documents, query: str) -> list[int]:
+    node = parse_query(query)
+    return [document.document_id for document in documents if brute_force(node, document.terms)]
+
+
+def planner_for(documents, positional: bool) -> QueryPlanner:
+    inverted_index = {}
+    for document in documents:
+        for term in set(document.terms):
+            inverted_index.setdefault(term, []).append(document.document_id)
+    terms = {document.document_id: document.terms for document in documents}
+    positional_index = None
+    if positional:
+        positional_index = PositionalIndex()
+        positional_index.build(documents, lambda document: document.terms)
+    return QueryPlanner(
+        postings=lambda term: inverted_index.get(term, []),
+        document_frequency=lambda term: len(inverted_index.get(term, ())),
+        all_doc_ids=lambda: sorted(terms),
+        phrase_postings=positional_index.phrase_postings if positional else None,
+        verify_phrase=lambda doc_id, phrase: brute_force(Phrase(phrase), terms[doc_id]),
+        near_postings=positional_index.near_postings if positional else None,
+        verify_near=lambda doc_id, left, right, distance: brute_force(Near(left, right, distance), terms[doc_id]),
+    )
+
+
+def test_parse_precedence():
+    assert repr(parse_query('a b AND c')) == repr(Or([Term('a'), And([Term('b'), Term('c')])]))
+    assert repr(parse_query('NOT a AND b OR c')) == repr(Or([And([Not(Term('a')), Term('b')]), Term('c')]))
+    assert repr(parse_query('a NEAR/2 c')) == repr(Near('a', 'c', 2))
+    assert repr(parse_query('("The Fox")')) == repr(Phrase(['the', 'fox']))
+    assert repr(parse_query('running', lambda term: term[:3])) == repr(Term('run'))
+    assert parse_query('   ') is None
+
+
+@pytest.mark.parametrize('query', ['(fox', 'fox)', 'AND fox', 'fox AND', 'NOT', '""', '"a b" NEAR/2 c',
+                                   'a NEAR/2 b NEAR/2 c', 'NEAR/2 a'])
+def test_malformed_queries_raise(query):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query)
+
+
+def test_needs_positions():
+    assert not query_parser.needs_positions(parse_query('fox AND NOT (crow OR lion)'))
+    assert query_parser.needs_positions(parse_query('fox AND NOT "the crow"'))
+    assert query_parser.needs_positions(parse_query('NOT (lion OR fox NEAR/2 crow)'))
+
+
+def test_matches_agrees_with_brute_force():
+    documents = make_documents()
+    for query in queries():
+        node = parse_query(query)
+        for document in documents:
+            assert node.matches(document.terms, set(document.terms)) == brute_force(node, document.terms), query
+
+
+@pytest.mark.parametrize('positional', [False, True])
+def test_planner_agrees_with_brute_force(positional):
+    documents = make_documents()
+    planner = planner_for(documents, positional)
+    for query in queries():
+        assert planner.execute(parse_query(query)) == expected_ids(documents, query), query
+
+
+def test_planner_without_positions_rejects_phrases():
+    planner = QueryPlanner(lambda term: [], lambda term: 0, lambda: [])
+    with pytest.raises(ValueError):
+        planner.execute(parse_query('"the fox"'))
+    with pytest.raises(ValueError):
+        planner.execute(parse_query('fox NEAR/2 crow'))
+
+
+def test_gallop_intersect_union_difference():
+    rng = random.Random(5)
+    for _ in range(100):
+        a = sorted(rng.sample(range(200), rng.randint(0, 50)))
+        b = sorted(rng.sample(range(200), rng.randint(0, 150)))
+        assert query_parser.gallop_intersect(a, b) == sorted(set(a) & set(b))
+        assert query_parser.union([a, b]) == sorted(set(a) | set(b))
+        assert query_parser.difference(a, b) == sorted(set(a) - set(b))
@@ -0,0 +1,67 @@
+import asyncio
+import concurrent.futures
+import pytest
+import ir_system
+import search_service
+
+QUERIES = ('fox', 'fox AND crow', 'lion OR NOT wolf', '"the fox"', 'fox NEAR/2 crow', 'running hunter',
+           'grapes AND NOT (sour OR cheese)')
+REPRESENTATIONS = {(False, False): 'term_ids', (True, False): 'filtered_term_ids', (False, True): 'stemmed_term_ids',
+                   (True, True): 'filtered_stemmed_term_ids'}
+
+
+@pytest.fixture
+def engine(collection, data_directory):
+    engine = search_service.SearchEngine(collection=collection)
+    yield engine
+    engine.close()
+
+
+def test_concurrent_searches_match_sequential_ones(engine):
+    requests = [
+        {'query': query, 'model': model, 'stopword_filtering': stop_word_filtering, 'stemming': stemming, 'k': 10}
+        for query in QUERIES
+        for model in engine.models()
+        for stop_word_filtering, stemming in ir_system.SEARCH_MODES
+    ]
+    # The concurrent searches run first, so anything still built on the first query would be built by racing threads.
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda request: engine.search(**request), requests * 3))
+
+    assert results == [engine.search(**request) for request in requests * 3]
+
+
+def test_engine_builds_lazy_structures_up_front(engine):
+    for mode, name in REPRESENTATIONS.items():
+        assert engine.systems['inverted'].model_variants[mode].positional_index is not None
+        assert all(getattr(document, name) is not None for document in engine.collection)
+
+
+@pytest.mark.parametrize('content_length', ['abc', '-5'])
+def test_invalid_content_length_is_rejected(engine, content_length):
+    async def request() -> bytes:
+        server = search_service.SearchServer(search_service.SearchService(engine, workers=1), port=0)
+        await server.start()
+        try:
+            port = server.server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'POST /search HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n'.encode('latin-1'))
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            server.server.close()
+            await server.service.close()
+
+    response = asyncio.run(request())
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert b'Invalid Content-Length' in response
+
+
+@pytest.mark.parametrize('option', ['stopword_filtering', 'stemming'])
+@pytest.mark.parametrize('value', ['false', 0, 1, None])
+def test_search_options_must_be_booleans(option, value):
+    with pytest.raises(ValueError):
+        search_service.parse_request({'query': 'fox', option: value})
+    assert search_service.parse_request({'query': 'fox', option: True})[option] is True
@@ -0,0 +1,109 @@
+import pytest
+import models
+from conftest import make_documents
+from segmented_index import SegmentedBooleanModel, SegmentedIndex, SegmentedVectorSpaceModel
+from test_query_parser import expected_ids, queries
+
+RANKING_QUERIES = ('fox crow', 'the lion and the wolf', 'sour grapes', 'hare tortoise hare', 'unknown')
+
+
+def apply_changes(index) -> list:
+    """
+    Builds a segmented index through several flushes and merges, then deletes, updates and re-adds documents, partly
+    in the memtable. Returns the live documents in id order.
+    """
+    documents = make_documents()
+    for document in documents[:60]:
+        index.add_document(document)
+    index.flush()
+    for document in documents[60:]:
+        index.add_document(document)
+    for doc_id in range(0, 80, 9):
+        index.remove_document(doc_id)
+    index.flush()
+    replacements = make_documents(seed=11)[30:40]
+    for document in replacements:
+        index.update_document(document)
+    index.add_document(documents[0])  # deleted in a segment, re-added in the memtable
+    index.remove_document(79)
+
+    live = {document.document_id: document for document in documents if document.document_id % 9}
+    live.update({document.document_id: document for document in replacements})
+    live[0] = documents[0]
+    del live[79]
+    return [live[doc_id] for doc_id in sorted(live)]
+
+
+def test_segmented_boolean_model_matches_brute_force(tmp_path):
+    model = SegmentedBooleanModel(str(tmp_path), flush_threshold=16, segments_per_tier=2)
+    live = apply_changes(model.segmented_index)
+    model.build_positional_index(live)
+
+    assert model.document_ids == [document.document_id for document in live]
+    for query in queries():
+        assert model.search(query) == expected_ids(live, query), query
+
+
+def test_segmented_index_reopens_from_its_directory(tmp_path):
+    model = SegmentedBooleanModel(str(tmp_path), flush_threshold=16)
+    live = apply_changes(model.segmented_index)
+    model.segmented_index.flush()
+    model.segmented_index.close()
+
+    reopened = SegmentedBooleanModel(str(tmp_path), flush_threshold=16)
+    assert reopened.document_ids == [document.document_id for document in live]
+    for query in ('fox', 'NOT fox', 'fox AND NOT (crow OR lion)', 'unknown'):
+        assert reopened.search(query) == expected_ids(live, query), query
+
+
+def test_negations_see_documents_added_after_the_build(tmp_path):
+    documents = make_documents()
+    model = SegmentedBooleanModel(str(tmp_path), flush_threshold=16)
+    model.build_inverted_index(documents[:40])
+    for document in documents[40:]:
+        model.segmented_index.add_document(document)
+    model.segmented_index.remove_document(3)
+
+    live = [document for document in documents if document.document_id != 3]
+    assert model.search('NOT fox') == expected_ids(live, 'NOT fox')
+
+
+def test_merged_segments_are_closed(tmp_path):
+    index = SegmentedIndex(str(tmp_path), flush_threshold=8, segments_per_tier=2)
+    for document in make_documents(count=8):
+        index.add_document(document)
+    segment = index._segments[0]
+    readers = index._acquire_segments()  # a query that is still reading while the segment is merged away
+    for document in make_documents(count=16)[8:]:
+        index.add_document(document)
+
+    assert index.num_segments() == 1 and not segment.index._mmap.closed
+    index._release_segments(readers)
+    assert segment.index._mmap.closed
+
+
+def assert_same_ranking(model, reference):
+    for query in RANKING_QUERIES:
+        ranking = model.top_k(query, 10)
+        expected = reference.top_k(query, 10)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected], query
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+
+
+@pytest.mark.parametrize('stopword_filtering, stemming', [(False, False), (True, True)])
+def test_segmented_vector_space_model_matches_rebuilt_model(tmp_path, stopword_filtering, stemming):
+    model = SegmentedVectorSpaceModel(str(tmp_path), stopword_filtering, stemming, flush_threshold=16,
+                                      segments_per_tier=2)
+    live = apply_changes(model.segmented_index)
+    reference = models.VectorSpaceModel()
+    reference.build_inverted_index(live, stopword_filtering, stemming)
+    assert_same_ranking(model, reference)
+
+
+def test_segmented_vector_space_model_indexes_the_requested_mode(tmp_path):
+    documents = make_documents()
+    model = SegmentedVectorSpaceModel(str(tmp_path), flush_threshold=16)
+    model.build_inverted_index(documents, stopword_filtering=True, stemming=True)
+    reference = models.VectorSpaceModel()
+    reference.build_inverted_index(documents, stopword_filtering=True, stemming=True)
+    assert_same_ranking(model, reference)
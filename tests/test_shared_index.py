@@ -0,0 +1,62 @@
+import pytest
+import models
+import scoring
+import shared_index
+from conftest import WORDS, make_documents
+
+QUERIES = ('fox', 'fox crow', 'the lion and the wolf', 'sour grapes', 'hare tortoise hare', 'unknown')
+SCORERS = [scoring.BM25Scorer(k1=1.5, b=0.5), scoring.TfIdfCosineScorer(), scoring.LanguageModelScorer(0.2)]
+
+
+def reference_model(scorer) -> models.VectorSpaceModel:
+    model = models.VectorSpaceModel(scorer)
+    model.build_inverted_index(make_documents())
+    return model
+
+
+def assert_same_rankings(flat_model, model):
+    for query in QUERIES:
+        ranking = flat_model.top_k(query, 10)
+        expected = model.top_k(query, 10)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected], query
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+
+
+@pytest.mark.parametrize('scorer', SCORERS, ids=str)
+def test_flat_index_file_round_trip(tmp_path, scorer):
+    model = reference_model(scorer)
+    path = str(tmp_path / 'flat.bin')
+    shared_index.write_flat_index(shared_index.build_flat_index(model.statistics, model.scorer), path)
+
+    index = shared_index.open_flat_index(path)
+    try:
+        assert (index.num_terms, index.num_documents) == (len(model.statistics.postings), 80)
+        assert index.scorer.key() == scorer.key()
+        assert list(index.document_ids) == list(range(80))
+        for term in WORDS:
+            assert index.document_frequency(term) == len(model.statistics.postings[term])
+        assert index.find('unknown') < 0
+        assert_same_rankings(shared_index.FlatVectorSpaceModel(index), model)
+    finally:
+        index.close()
+
+
+def test_flat_index_in_shared_memory():
+    model = reference_model(scoring.BM25Scorer())
+    block = shared_index.publish_flat_index(shared_index.build_flat_index(model.statistics, model.scorer))
+    try:
+        index = shared_index.attach_flat_index(block.name)
+        try:
+            assert_same_rankings(shared_index.FlatVectorSpaceModel(index), model)
+        finally:
+            index.close()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_not_a_flat_index_raises(tmp_path):
+    path = tmp_path / 'flat.bin'
+    path.write_bytes(b'\0' * 256)
+    with pytest.raises(ValueError):
+        shared_index.open_flat_index(str(path))
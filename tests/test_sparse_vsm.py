@@ -0,0 +1,46 @@
+import math
+from collections import Counter
+import pytest
+from conftest import make_documents
+
+sparse_vsm = pytest.importorskip('sparse_vsm')
+if sparse_vsm.np is None:
+    pytest.skip('SparseVectorSpaceModel requires numpy and scipy', allow_module_level=True)
+
+QUERIES = ('fox', 'fox crow', 'the lion and the wolf', 'hare tortoise hare', 'unknown')
+
+
+def exhaustive_ranking(documents, query: str, k: int) -> list[tuple]:
+    document_frequency = Counter(term for document in documents for term in set(document.terms))
+    idf = {term: math.log10(len(documents) / df) for term, df in document_frequency.items()}
+    query_weights = {term: (1 + math.log10(count)) * idf[term]
+                     for term, count in Counter(query.split()).items() if term in idf}
+    scores = []
+    for document in documents:
+        counts = Counter(document.terms)
+        score = sum(weight * (1 + math.log10(counts[term])) * idf[term]
+                    for term, weight in query_weights.items() if term in counts)
+        if score > 0:
+            scores.append((score, document.document_id))
+    scores.sort(key=lambda entry: (-entry[0], entry[1]))
+    return scores[:k]
+
+
+def test_queries_are_weighted_with_the_collection_idf():
+    documents = make_documents()
+    model = sparse_vsm.SparseVectorSpaceModel()
+    model.build_inverted_index(documents)
+    for query in QUERIES:
+        ranking = model.top_k(query, 10)
+        expected = exhaustive_ranking(documents, query, 10)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected]
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+    assert model.top_k('fox', 10)
+
+
+def test_rebuild_starts_with_a_new_vocabulary():
+    model = sparse_vsm.SparseVectorSpaceModel()
+    model.build_inverted_index(make_documents(seed=1))
+    model.build_inverted_index(make_documents(count=5, seed=2))
+    assert model.matrix.shape == (5, len(model.vocabulary))
+    assert set(model.vocabulary) == {term for document in make_documents(count=5, seed=2) for term in document.terms}
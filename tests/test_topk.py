@@ -0,0 +1,96 @@
+import math
+import random
+from collections import Counter
+import pytest
+import models
+import scoring
+import topk
+from conftest import make_documents
+
+QUERIES = ('fox', 'fox crow', 'the lion and the wolf', 'sour grapes', 'hare tortoise hare', 'a of the and', 'unknown')
+
+
+def random_cursors(rng: random.Random) -> list[tuple]:
+    """
+    Random (postings, query weight) pairs with skewed weights, so MaxScore actually prunes.
+    """
+    cursors = []
+    for _ in range(rng.randint(1, 6)):
+        doc_ids = sorted(rng.sample(range(500), rng.randint(1, 300)))
+        scale = rng.choice((0.1, 1.0, 10.0))
+        cursors.append(([(doc_id, rng.random() * scale) for doc_id in doc_ids], rng.choice((0.5, 1.0, 2.0))))
+    return cursors
+
+
+def cursors_of(specification: list[tuple]) -> list[topk.TermCursor]:
+    return [topk.TermCursor(postings, weight, max(w for _, w in postings)) for postings, weight in specification]
+
+
+@pytest.mark.parametrize('k', [1, 3, 10, 1000])
+def test_maxscore_matches_exhaustive_scoring(k):
+    rng = random.Random(k)
+    for _ in range(50):
+        specification = random_cursors(rng)
+        stats = {}
+        ranking = topk.maxscore_top_k(cursors_of(specification), k, stats)
+        expected = topk.exhaustive_top_k(cursors_of(specification), k)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected]
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+        assert stats['postings_scored'] <= sum(len(postings) for postings, _ in specification)
+
+
+def tf_idf_ranking(documents, query: str, k: int) -> list[tuple]:
+    """
+    Exhaustive scoring with the weights of VectorSpaceModel: log-tf * idf for documents and query_to_vector() for
+    the query.
+    """
+    document_frequency = Counter(term for document in documents for term in set(document.terms))
+    query_vector = models.VectorSpaceModel().query_to_vector(query)
+    scores = []
+    for document in documents:
+        counts = Counter(document.terms)
+        score = sum(weight * (1 + math.log10(counts[term])) * math.log10(len(documents) / document_frequency[term])
+                    for term, weight in query_vector.items() if term in counts)
+        if score > 0:
+            scores.append((score, document.document_id))
+    scores.sort(key=lambda entry: (-entry[0], entry[1]))
+    return scores[:k]
+
+
+def test_vector_space_model_matches_exhaustive_scoring():
+    documents = make_documents()
+    model = models.VectorSpaceModel()
+    model.build_inverted_index(documents)
+    for query in QUERIES:
+        ranking = model.top_k(query, 10)
+        expected = tf_idf_ranking(documents, query, 10)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected], query
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+
+
+@pytest.mark.parametrize('scorer', [scoring.BM25Scorer(), scoring.TfIdfCosineScorer(), scoring.LanguageModelScorer()],
+                         ids=str)
+def test_scorer_upper_bounds_do_not_change_the_ranking(scorer, monkeypatch):
+    documents = make_documents()
+    model = models.VectorSpaceModel(scorer)
+    model.build_inverted_index(documents)
+    rankings = [model.top_k(query, 10) for query in QUERIES]
+
+    monkeypatch.setattr(topk, 'maxscore_top_k', topk.exhaustive_top_k)
+    for query, ranking in zip(QUERIES, rankings):
+        expected = model.top_k(query, 10)
+        assert [doc_id for _, doc_id in ranking] == [doc_id for _, doc_id in expected], query
+        assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+
+
+def test_bm25_on_a_collection_of_empty_documents():
+    documents = make_documents(count=3)
+    for document in documents:
+        document.terms = []
+    model = models.VectorSpaceModel(scoring.BM25Scorer())
+    model.build_inverted_index(documents)
+    assert model.statistics.average_document_length == 0.0
+    assert model.top_k('fox', 10) == []
+    scorer = scoring.BM25Scorer()
+    scorer.prepare(model.statistics)
+    assert scorer.score('fox', 1, 0) == pytest.approx(scorer.idf('fox'))
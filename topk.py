@@ -0,0 +1,157 @@
+import heapq
+import math
+import instrumentation
+from bisect import bisect_left
+from operator import itemgetter
+
+# Relative slack for the pruning comparisons. Partial scores are summed in a different order than the final scores,
+# so without it a document could be skipped because of a rounding error in the last bit.
+_SLACK = 1e-9
+
+_doc_id_of = itemgetter(0)
+
+
+class TermCursor(object):
+    """
+    Iterates over the posting list of one query term. Postings are (doc_id, weight) tuples sorted by doc_id, the
+    contribution of a posting to a document score is weight * query_weight.
+    """
+
+    def __init__(self, postings: list[tuple], query_weight: float, max_weight: float):
+        self.postings = postings
+        self.query_weight = query_weight
+        self.upper_bound = max(max_weight * query_weight, 0.0)
+        self.position = 0
+
+    def doc_id(self):
+        return self.postings[self.position][0] if self.position < len(self.postings) else None
+
+    def score(self) -> float:
+        return self.postings[self.position][1] * self.query_weight
+
+    def seek(self, doc_id: int):
+        """
+        Moves the cursor to the first posting with a document id >= doc_id.
+        """
+        self.position = bisect_left(self.postings, doc_id, self.position, key=_doc_id_of)
+
+
+class TfIdfCursor(TermCursor):
+    """
+    Cursor over (doc_id, tf) postings that weights them at query time with (1 + log10(tf)) * idf, the same weights
+    VectorSpaceModel stores in its index.
+    """
+
+    def __init__(self, postings: list[tuple], query_weight: float, idf: float, max_tf: int):
+        super().__init__(postings, query_weight, (1 + math.log10(max_tf)) * idf)
+        self.idf = idf
+
+    def score(self) -> float:
+        return (1 + math.log10(self.postings[self.position][1])) * self.idf * self.query_weight
+
+
+def _push(heap: list, k: int, score: float, doc_id: int):
+    entry = (score, -doc_id)  # on equal scores the smaller document id ranks higher
+    if len(heap) < k:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+
+def _ranking(heap: list) -> list[tuple]:
+    return [(score, -negative_doc_id) for score, negative_doc_id in sorted(heap, reverse=True)]
+
+
+@instrumentation.timed('scoring')
+def exhaustive_top_k(cursors: list[TermCursor], k: int, stats: dict = None) -> list[tuple]:
+    """
+    Scores every posting of every cursor (term-at-a-time). Serves as reference for maxscore_top_k().
+    :param cursors: One cursor per query term
+    :param k: Number of results
+    :param stats: Optional dictionary, receives the number of scored postings under 'postings_scored'
+    :return: List of (score, doc_id) tuples with a positive score, best first
+    """
+    contributions = {}
+    scored = 0
+    for cursor in cursors:
+        for doc_id, _ in cursor.postings:
+            contributions.setdefault(doc_id, []).append(cursor.score())
+            cursor.position += 1
+            scored += 1
+
+    heap = []
+    for doc_id, values in contributions.items():
+        score = math.fsum(values)
+        if score > 0:
+            _push(heap, k, score, doc_id)
+
+    if stats is not None:
+        stats['postings_scored'] = scored
+    instrumentation.count('postings_scored', scored)
+    return _ranking(heap)
+
+
+@instrumentation.timed('scoring')
+def maxscore_top_k(cursors: list[TermCursor], k: int, stats: dict = None) -> list[tuple]:
+    """
+    Document-at-a-time top-k retrieval with MaxScore dynamic pruning (Turtle & Flood, 1995).
+    Terms are ordered by their score upper bound. As soon as the bounds of the weakest terms together cannot lift a
+    document above the current k-th best score, those terms become non-essential: they no longer produce candidates
+    and are only probed (by binary search) for documents found through the essential terms.
+    The result is identical to exhaustive_top_k().
+    :param cursors: One cursor per query term
+    :param k: Number of results
+    :param stats: Optional dictionary, receives the number of scored postings under 'postings_scored'
+    :return: List of (score, doc_id) tuples with a positive score, best first
+    """
+    cursors = sorted((c for c in cursors if c.postings), key=lambda c: c.upper_bound)
+    bounds = []  # bounds[i] = sum of the upper bounds of cursors[0..i]
+    total = 0.0
+    for cursor in cursors:
+        total += cursor.upper_bound
+        bounds.append(total)
+
+    heap = []
+    threshold = 0.0  # only documents with a positive score are returned
+    first_essential = 0
+    scored = 0
+
+    while k > 0:
+        while first_essential < len(cursors) and bounds[first_essential] < threshold * (1 - _SLACK):
+            first_essential += 1
+
+        doc_id = min((c.doc_id() for c in cursors[first_essential:] if c.doc_id() is not None), default=None)
+        if doc_id is None:
+            break
+
+        contributions = []
+        for cursor in cursors[first_essential:]:
+            if cursor.doc_id() == doc_id:
+                contributions.append(cursor.score())
+                cursor.position += 1
+                scored += 1
+        partial_score = sum(contributions)
+
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if partial_score + bounds[i] < threshold * (1 - _SLACK):
+                pruned = True
+                break
+            cursor = cursors[i]
+            cursor.seek(doc_id)
+            if cursor.doc_id() == doc_id:
+                contributions.append(cursor.score())
+                partial_score += contributions[-1]
+                scored += 1
+
+        if not pruned:
+            score = math.fsum(contributions)
+            if score > 0:
+                _push(heap, k, score, doc_id)
+                if len(heap) == k:
+                    threshold = heap[0][0]
+
+    if stats is not None:
+        stats['postings_scored'] = scored
+    instrumentation.count('postings_scored', scored)
+    return _ranking(heap)